@@ -0,0 +1,120 @@
+"""Time every billing stage against local fake Toggl and Google Sheets backends
+
+Run with: python -m benchmarks.end_to_end
+"""
+import contextlib
+import datetime
+import io
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, Iterator, List
+
+from src import cache, config, gsheet
+from src.bill import aggregate_entries
+from src.config import AppConfig, GSheetClientConfig, TogglClientConfig
+from src.gsheet import SheetsRateLimiter, upload_to_gsheet
+from src.sqlite_cache import SqliteEntryCache
+from src.toggl import Toggl, parse_supported_entries
+from src.types import JsonDict, Project, TimeRange, TogglTimeEntry
+from tests.fake_sheets import FakeClient, FakeSpreadsheet, FakeWorksheet
+from tests.fake_toggl import FakeTogglServer
+from tests.test_toggl import generate_sample_data
+
+SIZES = (1, 2, 4)  # years of sample data
+UTC = datetime.timezone.utc
+NO_QUOTA = 10**9  # requests per minute
+
+
+def to_raw_entry(entry: TogglTimeEntry) -> JsonDict:
+    assert entry.stop
+    stop = entry.stop.replace(tzinfo=UTC).isoformat()
+    return {
+        "id": entry.id,
+        "pid": entry.project.id,
+        "start": entry.start.replace(tzinfo=UTC).isoformat(),
+        "stop": stop,
+        "description": entry.description,
+        "at": stop,
+    }
+
+
+@contextlib.contextmanager
+def stage(name: str, timings: Dict[str, float]) -> Iterator[None]:
+    # Keep the progress messages of each stage out of the report
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
+    timings[name] = time.perf_counter() - start
+
+
+def run(years: int, tmp_dir: Path) -> None:
+    sample = generate_sample_data(years=years)
+    raw_entries = [to_raw_entry(entry) for entry in sample]
+    project = Project(
+        id=sample[0].project.id,
+        alias=sample[0].project.alias,
+        start_date=sample[0].start.replace(tzinfo=UTC),
+    )
+    app_config = AppConfig(
+        projects=[project],
+        toggl_api_token="token",
+        gsheet_url="https://example.com",
+        gspread_credentials_path=Path(),
+        gspread_authorized_user_path=Path(),
+        toggl_client=TogglClientConfig(incremental_sync=False),
+        gsheet_client=GSheetClientConfig(
+            read_requests_per_minute=NO_QUOTA,
+            write_requests_per_minute=NO_QUOTA,
+        ),
+    )
+    config._CACHED_APP_CONFIG = app_config
+    entry_cache = SqliteEntryCache(path=tmp_dir / f"{years}-years.sqlite3")
+    cache._CACHED_ENTRY_CACHE = entry_cache
+    last_stop = datetime.datetime.fromisoformat(raw_entries[-1]["stop"])
+    time_range = TimeRange(after=project.start_date, until=last_stop)
+
+    timings: Dict[str, float] = {}
+    entries: List[TogglTimeEntry]
+    with FakeTogglServer(raw_entries) as server:
+        client = Toggl(
+            token=app_config.toggl_api_token,
+            settings=app_config.toggl_client,
+            api_url=server.url,
+        )
+        with stage("fetch", timings):
+            data = client._fetch_time_entries(time_range)
+            entries = list(parse_supported_entries(data))
+    toggl_requests = len(server.requests)
+
+    with stage("cache write", timings):
+        entry_cache.write(entries)
+
+    with stage("cache read", timings):
+        entries = list(entry_cache.read(time_range))
+
+    with stage("aggregate", timings):
+        stats = aggregate_entries(entries)
+
+    worksheet = FakeWorksheet(title=project.alias, rows=[["date", "description"]])
+    spreadsheet = FakeSpreadsheet([worksheet])
+    gsheet._CACHED_GSHEET_CLIENT = FakeClient(spreadsheet)
+    gsheet._CACHED_RATE_LIMITER = SheetsRateLimiter(app_config.gsheet_client)
+    with stage("upload", timings):
+        upload_to_gsheet(stats, append_only=False)
+    sheets_calls = sum(spreadsheet.total_calls.values())
+
+    print(f"{len(entries)} entries, {len(stats)} daily stats:")
+    for name, elapsed in timings.items():
+        print(f"  {name:<12} {elapsed:.2f}s")
+    print(f"  {toggl_requests} Toggl requests, {sheets_calls} Google Sheets calls")
+
+
+def main() -> None:
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for years in SIZES:
+            run(years, Path(tmp_dir))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""Measure how many bytes each cached entry takes in memory
+
+Run with: python -m benchmarks.entry_memory
+"""
+import datetime
+import gc
+import tracemalloc
+from dataclasses import dataclass
+from typing import Callable, List, Optional
+
+from src.types import TogglTimeEntry
+from tests.test_toggl import generate_sample_data
+
+
+@dataclass
+class DictTogglTimeEntry:
+    """TogglTimeEntry as it was before using slots"""
+
+    id: int
+    project: object
+    description: str
+    start: datetime.datetime
+    stop: Optional[datetime.datetime] = None
+
+
+def measure(name: str, build: Callable[[], List[object]]) -> None:
+    gc.collect()
+    tracemalloc.start()
+    entries = build()
+    allocated, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{name:<16} {allocated / len(entries):.0f} bytes/entry")
+
+
+def main() -> None:
+    sample = generate_sample_data()
+
+    def build_slotted() -> List[object]:
+        return [
+            TogglTimeEntry(
+                id=entry.id,
+                project=entry.project,
+                description=entry.description,
+                start=entry.start + datetime.timedelta(0),
+                stop=entry.stop + datetime.timedelta(0),  # type: ignore
+            )
+            for entry in sample
+        ]
+
+    def build_with_dict() -> List[object]:
+        return [
+            DictTogglTimeEntry(
+                id=entry.id,
+                project=entry.project,
+                description=entry.description,
+                start=entry.start + datetime.timedelta(0),
+                stop=entry.stop + datetime.timedelta(0),  # type: ignore
+            )
+            for entry in sample
+        ]
+
+    measure("with __dict__", build_with_dict)
+    measure("slotted", build_slotted)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,42 @@
+"""Measure how long importing the CLI takes, with and without the HTTP clients
+
+Run with: python -m benchmarks.import_time
+"""
+import subprocess
+import sys
+from typing import Dict
+
+RUNS = 5
+
+
+def get_import_times(module: str) -> Dict[str, int]:
+    """Return the cumulative import time of every imported module, in microseconds"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    import_times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        import_times[name.strip()] = int(cumulative)
+    return import_times
+
+
+def measure(module: str) -> None:
+    # The fastest run is the one least disturbed by the rest of the system
+    best = min(get_import_times(module)[module] for _ in range(RUNS))
+    print(f"import {module:<16} {best / 1000:.0f}ms")
+
+
+def main() -> None:
+    measure("src.cli")
+    measure("src.gsheet")
+    measure("src.async_toggl")
+
+
+if __name__ == "__main__":
+    main()
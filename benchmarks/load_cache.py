@@ -0,0 +1,56 @@
+"""Measure how many rows per second the CSV and segmented caches load
+
+Run with: python -m benchmarks.load_cache
+"""
+import csv
+import datetime
+import io
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable, Iterator
+
+from src.csv_cache import CsvEntryCache, table_row_to_entry
+from src.segmented_cache import SegmentedEntryCache
+from src.types import TimeRange, TogglTimeEntry
+from tests.test_toggl import generate_sample_data
+
+
+def load_without_shared_projects(path: Path) -> Iterator[TogglTimeEntry]:
+    """Load entries as before: one new Project per row"""
+    with path.open("rb") as f:
+        for row in csv.reader(io.TextIOWrapper(f, newline="")):
+            yield table_row_to_entry(row, projects={})  # type: ignore
+
+
+def measure(name: str, load: Callable[[], Iterator[TogglTimeEntry]]) -> None:
+    start = time.perf_counter()
+    rows = sum(1 for _ in load())
+    elapsed = time.perf_counter() - start
+    print(f"{name:<24} {rows} rows in {elapsed:.2f}s: {rows / elapsed:,.0f} rows/s")
+
+
+def main() -> None:
+    entries = generate_sample_data()
+    project = entries[0].project
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = Path(tmp_dir) / "toggl-cache.csv"
+        cache = CsvEntryCache(path=path, projects={project.id: project})
+        cache.write(entries)
+
+        measure("one Project per row", lambda: load_without_shared_projects(path))
+        measure("shared Project", cache.load)
+
+        segmented = SegmentedEntryCache(path=Path(tmp_dir) / "toggl-cache.segments")
+        segmented.write(entries)
+        measure("segments", segmented.load)
+
+        # Billing usually reads the last weeks only
+        last_month = TimeRange(after=entries[-1].start - datetime.timedelta(days=30))
+        measure("last month, CSV", lambda: cache.read(last_month))
+        measure("last month, segments", lambda: segmented.read(last_month))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,296 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+import aiohttp
+
+from src.cache import (
+    SyncableEntryCache,
+    cache_entries,
+    find_cached_entries,
+    find_time_range_not_cached,
+    get_syncable_entry_cache,
+)
+from src.config import TogglApiToken, TogglClientConfig, get_config
+from src.metrics import get_metrics
+from src.retry import get_backoff
+from src.toggl import (
+    API_URL,
+    RETRY_STATUS_CODES,
+    Endpoint,
+    TogglClientStats,
+    apply_sync,
+    drop_entries_gone_from_toggl,
+    get_sync_started_at,
+    get_time_range_to_fetch,
+    get_time_range_to_recheck,
+    get_time_range_to_refetch,
+    mark_fetched,
+    parse_supported_entries,
+    sort_and_deduplicate,
+    split_time_range_per_month,
+    split_truncated_window,
+)
+from src.types import JsonDict, TimeRange, TogglProjectId, TogglTimeEntry
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncToggl:
+    """Asyncio counterpart of ``Toggl``, to overlap many requests without threads
+
+    Use it as an async context manager, so that its HTTP session is closed::
+
+        async with AsyncToggl(token=token) as toggl:
+            async for entry in toggl.get_entries(tr):
+                ...
+    """
+
+    _token: TogglApiToken
+    _session: Optional[aiohttp.ClientSession]
+
+    def __init__(
+        self,
+        token: TogglApiToken,
+        settings: Optional[TogglClientConfig] = None,
+        api_url: str = API_URL,
+    ) -> None:
+        self._token = token
+        self._settings = settings or TogglClientConfig()
+        self._api_url = api_url
+        self._session = None
+        self.stats = TogglClientStats()
+
+    async def __aenter__(self) -> AsyncToggl:
+        connector = aiohttp.TCPConnector(limit=self._settings.pool_maxsize)
+        self._session = aiohttp.ClientSession(
+            auth=aiohttp.BasicAuth(self._token, "api_token"),
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=self._settings.timeout),
+        )
+        return self
+
+    async def __aexit__(self, *_: object) -> None:
+        if self._session is None:
+            return
+
+        await self._session.close()
+        self._session = None
+
+    def _url(self, endpoint: Endpoint) -> str:
+        return f"{self._api_url}/{endpoint.value}"
+
+    async def _get(self, endpoint: str, params: Dict) -> Any:
+        if self._session is None:
+            raise RuntimeError(f"Use {self.__class__.__name__} as a context manager")
+
+        metrics = get_metrics()
+        attempt = 0
+        while True:
+            self.stats.requests += 1
+            metrics.count("toggl.requests")
+            retry_after: Optional[str] = None
+            try:
+                async with self._session.get(endpoint, params=params) as response:
+                    is_retriable = response.status in RETRY_STATUS_CODES
+                    if not is_retriable or attempt >= self._settings.max_retries:
+                        response.raise_for_status()
+                        body = await response.read()
+                        metrics.count("toggl.bytes_received", len(body))
+                        return json.loads(body)
+                    reason = f"HTTP {response.status}"
+                    retry_after = response.headers.get("Retry-After")
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as error:
+                if attempt >= self._settings.max_retries:
+                    raise
+                reason = repr(error)
+
+            delay = get_backoff(self._settings, attempt, retry_after)
+            logger.info(f"Toggl request failed ({reason}), retrying in {delay:.1f}s")
+            self.stats.retries += 1
+            self.stats.seconds_waited += delay
+            metrics.count("toggl.retries")
+            metrics.count("toggl.seconds_waited", delay)
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def _sync_or_refetch(
+        self,
+        entry_cache: SyncableEntryCache,
+        tr: Optional[TimeRange],
+    ) -> None:
+        """See ``Toggl._sync_or_refetch``"""
+        time_range = get_time_range_to_refetch(entry_cache, tr)
+        if time_range is None:
+            await self.sync(entry_cache)
+            time_range = get_time_range_to_recheck(tr)
+            if time_range is None:
+                return
+
+        fetched = await self._fetch_and_cache(time_range, entry_cache)
+        drop_entries_gone_from_toggl(
+            entry_cache, time_range, [entry.id for entry in fetched]
+        )
+
+    async def sync(self, entry_cache: SyncableEntryCache) -> None:
+        """See ``Toggl.sync``"""
+        sync_started_at = get_sync_started_at()
+        params = {
+            "with_related_data": "true",
+            "since": entry_cache.get_watermark(),
+        }
+        payload = await self._get(self._url(Endpoint.ME), params)
+        apply_sync(entry_cache, payload, default_watermark=sync_started_at)
+
+    async def _fetch_window(self, window: TimeRange) -> List[JsonDict]:
+        """Fetch entries in ``window``, splitting it if Toggl truncates the response"""
+        params = {"start_date": window.after.isoformat()}
+        if window.until:
+            params["end_date"] = window.until.isoformat()
+
+        data = await self._get(self._url(Endpoint.TIME_ENTRIES), params)
+
+        halves = split_truncated_window(window, len(data))
+        if halves is None:
+            return data
+
+        first_half, second_half = await asyncio.gather(
+            *(self._fetch_window(half) for half in halves)
+        )
+        return first_half + second_half
+
+    async def _fetch_time_entries(self, time_range: TimeRange) -> List[JsonDict]:
+        """Fetch raw entries one month at a time, concurrently, sorted by start date"""
+        semaphore = asyncio.Semaphore(self._settings.max_workers)
+
+        async def fetch(window: TimeRange) -> List[JsonDict]:
+            async with semaphore:
+                return await self._fetch_window(window)
+
+        windows = split_time_range_per_month(time_range)
+        windows_data = await asyncio.gather(*map(fetch, windows))
+        return list(sort_and_deduplicate(windows_data))
+
+    async def fetch_time_ranges(
+        self,
+        time_ranges: List[TimeRange],
+    ) -> List[List[TogglTimeEntry]]:
+        """Fetch several time ranges concurrently, bypassing the cache"""
+        ranges_data = await asyncio.gather(*map(self._fetch_time_entries, time_ranges))
+        return [list(parse_supported_entries(data)) for data in ranges_data]
+
+    async def get_entries(
+        self,
+        tr: Optional[TimeRange] = None,
+        pid: Optional[TogglProjectId] = None,
+    ) -> AsyncIterator[TogglTimeEntry]:
+        entry_cache = self._get_syncable_entry_cache()
+        if entry_cache and entry_cache.get_watermark() is not None:
+            await self._sync_or_refetch(entry_cache, tr)
+            entries = entry_cache.read(tr, pid=pid)
+            for entry in get_metrics().count_items("cache.rows_read", entries):
+                yield entry
+            return
+
+        updated_tr, cached_entries = find_cached_entries(tr, pid=pid)
+        for cached_entry in cached_entries:
+            yield cached_entry
+
+        print(f"{len(cached_entries)} entries from cache...")
+
+        for entry in await self._fetch_and_cache(updated_tr, entry_cache):
+            yield entry
+
+    async def update_cache(self, tr: Optional[TimeRange] = None) -> None:
+        """See ``Toggl.update_cache``"""
+        entry_cache = self._get_syncable_entry_cache()
+        if entry_cache and entry_cache.get_watermark() is not None:
+            await self._sync_or_refetch(entry_cache, tr)
+            return
+
+        await self._fetch_and_cache(find_time_range_not_cached(tr), entry_cache)
+
+    def _get_syncable_entry_cache(self) -> Optional[SyncableEntryCache]:
+        if not self._settings.incremental_sync:
+            return None
+
+        return get_syncable_entry_cache()
+
+    async def _fetch_and_cache(
+        self,
+        updated_tr: Optional[TimeRange],
+        entry_cache: Optional[SyncableEntryCache],
+    ) -> List[TogglTimeEntry]:
+        sync_started_at = get_sync_started_at()
+        time_range = get_time_range_to_fetch(updated_tr)
+        data = await self._fetch_time_entries(time_range)
+        entries = list(parse_supported_entries(data))
+
+        cache_entries(entries)
+        if entry_cache:
+            mark_fetched(entry_cache, time_range, sync_started_at)
+
+        logger.info(f"Async Toggl client stats: {self.stats}")
+        return entries
+
+    async def get_project_entries(
+        self,
+        pid: TogglProjectId,
+        time_range: Optional[TimeRange] = None,
+    ) -> AsyncIterator[TogglTimeEntry]:
+        # The API doesn't filter entries per project, see ``get_project_entries``
+        async for entry in self.get_entries(tr=time_range, pid=pid):
+            if entry.project.id == pid:
+                yield entry
+
+
+async def _collect_entries(time_range: Optional[TimeRange]) -> List[TogglTimeEntry]:
+    config = get_config()
+    async with AsyncToggl(
+        token=config.toggl_api_token,
+        settings=config.toggl_client,
+    ) as toggl:
+        return [entry async for entry in toggl.get_entries(tr=time_range)]
+
+
+def get_entries(*, time_range: Optional[TimeRange] = None) -> List[TogglTimeEntry]:
+    """Sync wrapper around ``AsyncToggl.get_entries``, for every project"""
+    return asyncio.run(_collect_entries(time_range=time_range))
+
+
+async def _collect_project_entries(
+    pid: TogglProjectId,
+    time_range: Optional[TimeRange],
+) -> List[TogglTimeEntry]:
+    config = get_config()
+    async with AsyncToggl(
+        token=config.toggl_api_token,
+        settings=config.toggl_client,
+    ) as toggl:
+        return [entry async for entry in toggl.get_project_entries(pid, time_range)]
+
+
+def get_project_entries(
+    *,
+    pid: TogglProjectId,
+    time_range: Optional[TimeRange] = None,
+) -> List[TogglTimeEntry]:
+    """Sync wrapper around ``AsyncToggl.get_project_entries``"""
+    return asyncio.run(_collect_project_entries(pid=pid, time_range=time_range))
+
+
+async def _update_cache(time_range: Optional[TimeRange]) -> None:
+    config = get_config()
+    async with AsyncToggl(
+        token=config.toggl_api_token,
+        settings=config.toggl_client,
+    ) as toggl:
+        await toggl.update_cache(tr=time_range)
+
+
+def update_cache(*, time_range: Optional[TimeRange] = None) -> None:
+    """Sync wrapper around ``AsyncToggl.update_cache``"""
+    asyncio.run(_update_cache(time_range=time_range))
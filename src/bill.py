@@ -1,12 +1,13 @@
 import datetime
-from typing import Dict, List, Optional, Tuple
+from typing import Dict, Iterable, Iterator, List, Optional
 
-from src import toggl
+from src import cache
 from src.config import get_config
-from src.gsheet import upload_to_gsheet
+from src.metrics import get_metrics
 from src.types import (
     DurationInSeconds,
     EntrySummary,
+    Project,
     ProjectAlias,
     ProjectDailyStats,
     TimeRange,
@@ -17,115 +18,239 @@ from src.types import (
 
 
 def bill(
-    project: ProjectAlias,
+    projects: List[ProjectAlias],
     clean_cache: bool,
     fetch_only: bool,
     append_only: bool,
+    diff: bool = False,
     after: Optional[datetime.datetime] = None,
     until: Optional[datetime.datetime] = None,
+    compact_cache: bool = False,
 ) -> None:
+    """Bill several projects with a single fetch from Toggl
+
+    Toggl returns the entries of every project anyway, so entries are fetched and
+    read from the cache once, and then fanned out per project while aggregating.
+
+    The cache is compacted when asked to, or when previous writes left it unsorted.
+    """
+    metrics = get_metrics()
     if clean_cache is True:
         print("Deleting cache file...", end="")
-        toggl.remove_cache()
+        with metrics.span("clean cache"):
+            cache.remove_cache()
         print(" done!")
 
-    toggl_project_id = get_toggl_project_id(alias=project)
+    with metrics.span("compact cache"):
+        if compact_cache is True:
+            report: Optional[cache.CompactionReport] = cache.compact_cache()
+        else:
+            report = cache.compact_cache_if_needed()
+    if report is not None:
+        print(f"Cache compacted: {report}")
+
+    selected = get_projects(aliases=projects)
+
+    # Unless a start is given, bill each project from its own start date
+    project_starts = {project.id: after or project.start_date for project in selected}
+    range = TimeRange(after=min(project_starts.values()), until=until)
 
-    if after is None:
-        earliest_date = get_project_earliest_date(project)
-        after = earliest_date
+    # Filter per project when reading the cache if there is only one project
+    pid = selected[0].id if len(selected) == 1 else None
 
-    range = TimeRange(after=after, until=until)
+    use_asyncio = get_config().toggl_client.use_asyncio
+    daily_totals_cache = cache.get_daily_totals_cache()
+    if daily_totals_cache is not None:
+        # The cache aggregates entries as they are written, so there is no need to
+        # read and aggregate every entry since the beginning of the project
+        with metrics.span("fetch"):
+            update_cache(time_range=range, use_asyncio=use_asyncio)
+        with metrics.span("read daily stats"):
+            daily_stats = daily_totals_cache.read_daily_stats(range, pid=pid)
+            daily_stats = metrics.count_items("cache.daily_stats_read", daily_stats)
+            stats = list(select_project_stats(daily_stats, selected, project_starts))
+        print(f"Stats: {len(stats)}")
+    else:
+        entries: Iterable[TogglTimeEntry]
+        # Entries are aggregated while they are being fetched, hence both stages share
+        # a single span
+        with metrics.span("fetch and aggregate"):
+            entries = get_entries(time_range=range, pid=pid, use_asyncio=use_asyncio)
 
-    entries = list(toggl.get_project_entries(pid=toggl_project_id, time_range=range))
-    print(f"Entries fetched: {len(entries)}")
-    stats = aggregate_entries(entries)
-    print(f"Stats: {len(stats)}")
+            # Aggregate entries while they are being fetched, without holding them in
+            # memory
+            counter = EntryCounter(entries)
+            stats = aggregate_entries(select_project_entries(counter, project_starts))
+        print(f"Entries fetched: {counter.amount}")
+        print(f"Stats: {len(stats)}")
 
     if fetch_only:
         return
 
     print("Updating GSheet")
-    upload_to_gsheet(stats, append_only=append_only)
+    # gspread and the Google auth libraries take long to import, hence only import
+    # them when there is something to upload
+    from src.gsheet import upload_to_gsheet
 
+    with metrics.span("upload"):
+        upload_to_gsheet(stats, append_only=append_only, diff=diff)
 
-def get_project_earliest_date(alias: ProjectAlias) -> datetime.datetime:
-    config = get_config()
-    project = next(project for project in config.projects if project.alias == alias)
-    return project.start_date
 
+# The Toggl clients are imported on first use, so that commands that do not fetch
+# anything, like --help, do not pay for importing requests and aiohttp
 
-def get_toggl_project_id(alias: ProjectAlias) -> TogglProjectId:
-    config = get_config()
-    for project in config.projects:
-        if project.alias == alias:
-            return project.id
+
+def update_cache(time_range: TimeRange, use_asyncio: bool) -> None:
+    if use_asyncio:
+        from src import async_toggl
+
+        async_toggl.update_cache(time_range=time_range)
     else:
-        raise ProjectAliasNotFound(f"Alias {alias!r} not found in config")
+        from src import toggl
+
+        toggl.update_cache(time_range=time_range)
+
+
+def get_entries(
+    time_range: TimeRange,
+    pid: Optional[TogglProjectId],
+    use_asyncio: bool,
+) -> Iterable[TogglTimeEntry]:
+    if use_asyncio:
+        from src import async_toggl
+
+        return async_toggl.get_entries(time_range=time_range)
+
+    from src import toggl
+
+    return toggl.get_entries(time_range=time_range, pid=pid)
+
+
+def get_projects(aliases: List[ProjectAlias]) -> List[Project]:
+    """Return the configured projects of ``aliases``, or every project if empty"""
+    config = get_config()
+    if not aliases:
+        return list(config.projects)
+
+    projects_by_alias = {project.alias: project for project in config.projects}
+    projects = []
+    for alias in aliases:
+        if alias not in projects_by_alias:
+            raise ProjectAliasNotFound(f"Alias {alias!r} not found in config")
+        projects.append(projects_by_alias[alias])
+
+    return projects
+
+
+def select_project_entries(
+    entries: Iterable[TogglTimeEntry],
+    project_starts: Dict[TogglProjectId, datetime.datetime],
+) -> Iterator[TogglTimeEntry]:
+    """Keep the entries of the selected projects, from each project's start"""
+    for entry in entries:
+        project_start = project_starts.get(entry.project.id)
+        if project_start is not None and project_start <= entry.start:
+            yield entry
+
+
+def select_project_stats(
+    stats: Iterable[ProjectDailyStats],
+    projects: List[Project],
+    project_starts: Dict[TogglProjectId, datetime.datetime],
+) -> Iterator[ProjectDailyStats]:
+    """Keep the daily stats of the selected projects, from each project's start"""
+    start_dates = {
+        project.alias: project_starts[project.id].date() for project in projects
+    }
+    for project_stats in stats:
+        start_date = start_dates.get(project_stats.alias)
+        if start_date is not None and start_date <= project_stats.date:
+            yield project_stats
 
 
 class ProjectAliasNotFound(Exception):
     ...
 
 
-def aggregate_entries(entries: List[TogglTimeEntry]) -> List[ProjectDailyStats]:
-    # Aggregate entries per project, day and task description
-    # TODO: make this in a single loop
+class EntryCounter:
+    """Count entries as they are iterated"""
 
-    """
-    {
-        ("css", "2021-01-01", "General"): 111,
-        ("css", "2021-01-01", "Meeting"): 222,
-        ("hiru", "2021-01-02", "General"): 333,
-        ("hiru", "2021-01-02", "Meeting"): 444,
-    }
-    """
-    duration_aggregation: Dict[
-        Tuple[ProjectAlias, datetime.date, TogglEntryDescription],
-        DurationInSeconds,
-    ] = {}
-    for entry in entries:
-        duration = entry.duration()
-        if duration is None:
-            # Ongoing task, ignore it
-            continue
+    def __init__(self, entries: Iterable[TogglTimeEntry]) -> None:
+        self._entries = entries
+        self.amount = 0
 
-        key = (entry.project.alias, entry.start.date(), entry.description)
-        if key in duration_aggregation:
-            duration_aggregation[key] += duration
-        else:
-            duration_aggregation[key] = duration
+    def __iter__(self) -> Iterator[TogglTimeEntry]:
+        for entry in self._entries:
+            self.amount += 1
+            yield entry
+
+
+class EntriesNotSorted(Exception):
+    ...
+
+
+def iter_project_daily_stats(
+    entries: Iterable[TogglTimeEntry],
+) -> Iterator[ProjectDailyStats]:
+    """Aggregate entries per project, day and task description, in a single pass
+
+    Entries must be sorted by start date. Only the durations of the day being
+    aggregated are kept in memory: the stats of each day are yielded as soon as an
+    entry of a later day shows up, hence stats are yielded sorted by date.
 
-    """
     {
-        ("css", "2021-01-01"): {
+        "css": {
             "General": 111,
             "Meeting": 222,
         },
-        ("hiru", "2021-01-02"): {
+        "hiru": {
             "General": 333,
-            "Meeting": 444,
         },
     }
     """
-    aggregation: Dict[
-        Tuple[ProjectAlias, datetime.date],
+    current_date: Optional[datetime.date] = None
+    day_aggregation: Dict[
+        ProjectAlias,
         Dict[TogglEntryDescription, DurationInSeconds],
     ] = {}
-    for (alias, date, description), duration in duration_aggregation.items():
-        _key = (alias, date)
-        if _key in aggregation:
-            aggregation[_key][description] = duration
-        else:
-            aggregation[_key] = {description: duration}
 
-    project_daily_stats = []
-    for (alias, date), entry_summary in aggregation.items():
+    for entry in entries:
+        duration = entry.duration()
+        if duration is None:
+            # Ongoing task, ignore it
+            continue
+
+        date = entry.start.date()
+        if current_date is None or current_date < date:
+            yield from _build_daily_stats(current_date, day_aggregation)
+            current_date = date
+            day_aggregation = {}
+        elif date < current_date:
+            raise EntriesNotSorted(f"Entry {entry.id} starts before {current_date}")
+
+        project_aggregation = day_aggregation.setdefault(entry.project.alias, {})
+        description = entry.description
+        project_aggregation[description] = (
+            project_aggregation.get(description, 0) + duration
+        )
+
+    yield from _build_daily_stats(current_date, day_aggregation)
+
+
+def _build_daily_stats(
+    date: Optional[datetime.date],
+    day_aggregation: Dict[ProjectAlias, Dict[TogglEntryDescription, DurationInSeconds]],
+) -> Iterator[ProjectDailyStats]:
+    if date is None:
+        return
+
+    for alias, entry_summary in day_aggregation.items():
         _entries = [
             EntrySummary(description=description, duration=duration)
             for description, duration in entry_summary.items()
         ]
-        pds = ProjectDailyStats(alias=alias, date=date, entries=_entries)
-        project_daily_stats.append(pds)
+        yield ProjectDailyStats(alias=alias, date=date, entries=_entries)
+
 
-    return project_daily_stats
+def aggregate_entries(entries: Iterable[TogglTimeEntry]) -> List[ProjectDailyStats]:
+    return list(iter_project_daily_stats(entries))
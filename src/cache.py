@@ -0,0 +1,218 @@
+from __future__ import annotations
+
+import datetime
+from pathlib import Path
+from typing import Iterable, Iterator, List, Optional, Protocol, Tuple
+
+from src.columnar_cache import ColumnarEntryCache
+from src.compaction import CompactionReport
+from src.config import CacheBackend, get_config
+from src.csv_cache import CsvEntryCache
+from src.metrics import get_metrics
+from src.segmented_cache import SegmentedEntryCache
+from src.sqlite_cache import SqliteEntryCache
+from src.timestamps import to_epoch
+from src.types import (
+    EpochSeconds,
+    ProjectDailyStats,
+    TimeRange,
+    TogglEntryId,
+    TogglProjectId,
+    TogglTimeEntry,
+)
+
+TOGGL_ENTRIES_CACHE = Path("toggl-cache.csv")
+TOGGL_ENTRIES_DB = Path("toggl-cache.sqlite3")
+TOGGL_ENTRIES_COLUMNS = Path("toggl-cache.columns")
+TOGGL_ENTRIES_SEGMENTS = Path("toggl-cache.segments")
+
+
+class EntryCache(Protocol):
+    def load(self) -> Iterator[TogglTimeEntry]:
+        ...
+
+    def read(
+        self,
+        time_range: Optional[TimeRange] = None,
+        pid: Optional[TogglProjectId] = None,
+    ) -> Iterator[TogglTimeEntry]:
+        ...
+
+    def last_start(self) -> Optional[datetime.datetime]:
+        ...
+
+    def write(self, entries: List[TogglTimeEntry]) -> None:
+        ...
+
+    def remove(self) -> None:
+        ...
+
+    def needs_compaction(self) -> bool:
+        ...
+
+    def compact(self) -> CompactionReport:
+        """Rewrite the cache sorted and without duplicates or wasted space"""
+        ...
+
+
+class SyncableEntryCache(EntryCache, Protocol):
+    """Cache that can be kept in sync with Toggl by fetching only changed entries
+
+    The watermark is the time, as seconds since epoch, of the last sync: entries changed
+    in Toggl after it must be upserted or deleted. Entries are only known to be cached
+    from the covered since time on, as seconds since epoch too.
+    """
+
+    def delete(self, ids: Iterable[TogglEntryId]) -> None:
+        ...
+
+    def get_watermark(self) -> Optional[EpochSeconds]:
+        ...
+
+    def set_watermark(self, watermark: EpochSeconds) -> None:
+        ...
+
+    def get_covered_since(self) -> Optional[EpochSeconds]:
+        ...
+
+    def set_covered_since(self, covered_since: EpochSeconds) -> None:
+        ...
+
+
+class DailyTotalsCache(EntryCache, Protocol):
+    """Cache that keeps the aggregated stats of each project and day up to date"""
+
+    def read_daily_stats(
+        self,
+        time_range: Optional[TimeRange] = None,
+        pid: Optional[TogglProjectId] = None,
+    ) -> Iterator[ProjectDailyStats]:
+        ...
+
+
+_CACHED_ENTRY_CACHE: Optional[EntryCache] = None
+
+
+def get_entry_cache() -> EntryCache:
+    global _CACHED_ENTRY_CACHE
+    if _CACHED_ENTRY_CACHE:
+        return _CACHED_ENTRY_CACHE
+
+    config = get_config()
+    # Resolved now rather than when parsing the config, as the parsed config is reused
+    # by runs started from other directories
+    cache_dir = config.cache_dir or Path.cwd()
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    cache: EntryCache
+    if config.cache_backend is CacheBackend.csv:
+        cache = CsvEntryCache(
+            path=cache_dir / TOGGL_ENTRIES_CACHE,
+            projects=config.project_id_to_name_map,
+        )
+    elif config.cache_backend is CacheBackend.columnar:
+        cache = ColumnarEntryCache(path=cache_dir / TOGGL_ENTRIES_COLUMNS)
+    elif config.cache_backend is CacheBackend.segments:
+        cache = SegmentedEntryCache(
+            path=cache_dir / TOGGL_ENTRIES_SEGMENTS,
+            projects=config.project_id_to_name_map,
+            compress=config.compress_cache_segments,
+        )
+    else:
+        cache = SqliteEntryCache(
+            path=cache_dir / TOGGL_ENTRIES_DB,
+            legacy_csv_path=cache_dir / TOGGL_ENTRIES_CACHE,
+            projects=config.project_id_to_name_map,
+        )
+
+    _CACHED_ENTRY_CACHE = cache
+
+    return cache
+
+
+def get_syncable_entry_cache() -> Optional[SyncableEntryCache]:
+    """Return the entry cache if it supports incremental syncs"""
+    cache = get_entry_cache()
+    if isinstance(cache, SqliteEntryCache):
+        return cache
+
+    # Append-only backends cannot update or delete entries
+    return None
+
+
+def get_daily_totals_cache() -> Optional[DailyTotalsCache]:
+    """Return the entry cache if it keeps daily totals up to date"""
+    cache = get_entry_cache()
+    if isinstance(cache, SqliteEntryCache):
+        return cache
+
+    return None
+
+
+def find_cached_entries(
+    tr: Optional[TimeRange],
+    pid: Optional[TogglProjectId] = None,
+) -> Tuple[Optional[TimeRange], List[TogglTimeEntry]]:
+    """Most common use case: find all entries from a given time on.
+
+    Return the cached entries and the time range that still needs to be fetched from
+    Toggl.
+    """
+    updated_tr = find_time_range_not_cached(tr)
+    if updated_tr is tr:
+        return tr, []
+
+    cached_entries = list(read_cache(tr, pid=pid))
+    return updated_tr, cached_entries
+
+
+def find_time_range_not_cached(tr: Optional[TimeRange]) -> Optional[TimeRange]:
+    """Return the part of ``tr`` that still needs to be fetched from Toggl
+
+    The cache holds entries of every project, so the time range to fetch only depends on
+    the latest cached entry.
+    """
+    last_start = get_entry_cache().last_start()
+    if last_start is None:
+        return tr
+
+    last_datetime = last_start  # TODO: should this be start or stop?
+    last_datetime += datetime.timedelta(seconds=1)
+    if tr and to_epoch(tr.after) > to_epoch(last_datetime):
+        last_datetime = tr.after
+    updated_tr = TimeRange(after=last_datetime, until=tr.until if tr else None)
+    return updated_tr
+
+
+def read_cache(
+    time_range: Optional[TimeRange] = None,
+    pid: Optional[TogglProjectId] = None,
+) -> Iterator[TogglTimeEntry]:
+    entries = get_entry_cache().read(time_range, pid=pid)
+    return get_metrics().count_items("cache.rows_read", entries)
+
+
+def load_cache() -> Iterator[TogglTimeEntry]:
+    entries = get_entry_cache().load()
+    return get_metrics().count_items("cache.rows_read", entries)
+
+
+def cache_entries(entries: List[TogglTimeEntry]) -> None:
+    get_entry_cache().write(entries)
+    get_metrics().count("cache.rows_written", len(entries))
+
+
+def remove_cache() -> None:
+    get_entry_cache().remove()
+
+
+def compact_cache() -> CompactionReport:
+    report = get_entry_cache().compact()
+    get_metrics().count("cache.rows_compacted", report.rows_before - report.rows_after)
+    return report
+
+
+def compact_cache_if_needed() -> Optional[CompactionReport]:
+    if get_entry_cache().needs_compaction() is False:
+        return None
+
+    return compact_cache()
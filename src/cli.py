@@ -1,17 +1,33 @@
 import logging
 from pathlib import Path
+from typing import Optional, Tuple
 
 import click
 
 from src.bill import bill
+from src.metrics import get_metrics
 
 
 @click.command(name="bill")
-@click.argument("project", nargs=1)
+@click.argument("projects", nargs=-1)
+@click.option(
+    "--all",
+    "all_projects",
+    is_flag=True,
+    help="Bill every project in the config",
+)
 @click.option(
     "--clean-cache",
     is_flag=True,
-    help="Delete the cache file before doing anything else",
+    help=(
+        "Delete the cache file before doing anything else, e.g. to pick up edits to"
+        " entries older than the previous month"
+    ),
+)
+@click.option(
+    "--compact-cache",
+    is_flag=True,
+    help="Rewrite the cache without duplicated entries before doing anything else",
 )
 @click.option(
     "--fetch-only",
@@ -23,18 +39,47 @@ from src.bill import bill
     is_flag=True,
     help="Appends every time entry to the end of the existing table in GSheet",
 )
+@click.option(
+    "--diff",
+    is_flag=True,
+    help="Only write the GSheet cells that changed since the last upload",
+)
+@click.option(
+    "--metrics",
+    "metrics_path",
+    type=click.Path(dir_okay=False, writable=True, path_type=Path),
+    help="Write the time spent per stage and the API calls made to a JSON file",
+)
 def bill_cmd(
-    project: str,
+    projects: Tuple[str, ...],
+    all_projects: bool,
     clean_cache: bool,
+    compact_cache: bool,
     fetch_only: bool,
     append_only: bool,
+    diff: bool,
+    metrics_path: Optional[Path],
 ) -> None:
-    bill(
-        project=project,
-        clean_cache=clean_cache,
-        fetch_only=fetch_only,
-        append_only=append_only,
-    )
+    if bool(projects) == all_projects:
+        raise click.UsageError("pass either one or more PROJECTS or --all")
+    if append_only and diff:
+        raise click.UsageError("--append-only and --diff are mutually exclusive")
+
+    try:
+        bill(
+            projects=list(projects),
+            clean_cache=clean_cache,
+            compact_cache=compact_cache,
+            fetch_only=fetch_only,
+            append_only=append_only,
+            diff=diff,
+        )
+    finally:
+        # Report metrics of failed runs too, they tell where the run got stuck
+        metrics = get_metrics()
+        metrics.log()
+        if metrics_path:
+            metrics.save(metrics_path)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,312 @@
+from __future__ import annotations
+
+import array
+import bisect
+import contextlib
+import datetime
+import json
+import mmap
+import os
+import shutil
+import tempfile
+from pathlib import Path
+from typing import Dict, Iterator, List, Literal, Optional, Tuple
+
+from src.compaction import (
+    CompactionReport,
+    deduplicate_entries,
+    get_size,
+    read_all,
+    time_full_read,
+)
+from src.filesystem import FileLock
+from src.timestamps import from_epoch, to_epoch
+from src.types import Project, TimeRange, TogglProjectId, TogglTimeEntry
+
+Typecode = Literal["i", "q"]
+
+# Column name -> array typecode. Every column holds one value per entry, in the same
+# order, and entries are sorted by start date.
+COLUMNS: Dict[str, Typecode] = {
+    "id": "q",
+    "project": "i",  # position in the projects table
+    "description": "i",  # position in the descriptions table
+    "start": "q",  # seconds since epoch
+    "stop": "q",  # seconds since epoch
+}
+TABLES_FILE = "tables.json"
+COMPACTION_MARKER_FILE = "needs-compaction"
+
+Columns = Dict[str, memoryview]
+
+ITEM_SIZES: Dict[Typecode, int] = {
+    code: array.array(code).itemsize for code in COLUMNS.values()
+}
+
+
+class ColumnarEntryCache:
+    """Binary columnar cache, one memory-mapped file per column
+
+    Projects and descriptions are dictionary-encoded: entries only store the position of
+    their project and description in the tables kept in ``tables.json``.
+
+    Time ranges are resolved with a binary search over the memory-mapped start column,
+    hence only the matching entries are turned into Python objects.
+
+    Writing entries that start before the last cached entry breaks the sort order that
+    the binary search relies on, hence it leaves a marker file to compact the cache.
+
+    Several processes can share the cache: writes take an exclusive lock, and reads only
+    take a shared lock while mapping the columns, to read the entries written until
+    then.
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self.compaction_marker_path = path / COMPACTION_MARKER_FILE
+        # Outside of the cache directory, as compacting replaces the directory
+        self.lock = FileLock(path.with_name(f"{path.name}.lock"))
+
+    def _column_path(self, name: str) -> Path:
+        return self.path / f"{name}.{COLUMNS[name]}"
+
+    def _load_tables(self) -> Tuple[List[Project], List[str]]:
+        tables_path = self.path / TABLES_FILE
+        if tables_path.exists() is False:
+            return [], []
+
+        raw = json.loads(tables_path.read_text())
+        projects = [
+            Project(
+                id=project_id,
+                alias=alias,
+                start_date=datetime.datetime.fromisoformat(start_date),
+            )
+            for project_id, alias, start_date in raw["projects"]
+        ]
+        return projects, raw["descriptions"]
+
+    def _save_tables(self, projects: List[Project], descriptions: List[str]) -> None:
+        raw = {
+            "projects": [
+                [project.id, project.alias, project.start_date.isoformat()]
+                for project in projects
+            ],
+            "descriptions": descriptions,
+        }
+        # Replaced atomically, as every read needs it whole
+        path = self.path / TABLES_FILE
+        fd, tmp_path = tempfile.mkstemp(dir=self.path, prefix=f".{path.name}.")
+        try:
+            with os.fdopen(fd, "w") as f:
+                f.write(json.dumps(raw))
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+
+    @contextlib.contextmanager
+    def _open_columns(self) -> Iterator[Columns]:
+        with contextlib.ExitStack() as stack:
+            columns: Columns = {}
+            # Mappings keep the size and the files they had when mapped, so appending
+            # to or replacing the columns afterwards does not change them
+            with self.lock.shared():
+                for name, typecode in COLUMNS.items():
+                    path = self._column_path(name)
+                    if path.exists() is False or path.stat().st_size == 0:
+                        columns[name] = memoryview(b"").cast(typecode)
+                        continue
+
+                    f = stack.enter_context(path.open("rb"))
+                    mapped = stack.enter_context(
+                        mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                    )
+                    raw = memoryview(mapped)
+                    stack.callback(raw.release)
+                    # An interrupted write might leave half a value at the end
+                    complete = len(raw) // ITEM_SIZES[typecode] * ITEM_SIZES[typecode]
+                    column = raw[:complete].cast(typecode)
+                    stack.callback(column.release)
+                    columns[name] = column
+
+            # An interrupted write might leave some columns longer than others
+            length = min(len(column) for column in columns.values())
+            for name, column in columns.items():
+                columns[name] = column[:length]
+                stack.callback(columns[name].release)
+
+            yield columns
+
+    def _read_rows(
+        self,
+        time_range: Optional[TimeRange],
+        pid: Optional[TogglProjectId],
+    ) -> Iterator[TogglTimeEntry]:
+        with contextlib.ExitStack() as stack:
+            # Tables and columns must be read at once, as compacting rewrites both
+            with self.lock.shared():
+                projects, descriptions = self._load_tables()
+                columns = stack.enter_context(self._open_columns())
+
+            starts = columns["start"]
+            stops = columns["stop"]
+            project_refs = columns["project"]
+
+            low, high = 0, len(starts)
+            after: Optional[int] = None
+            until: Optional[int] = None
+            if time_range is not None:
+                after = to_epoch(time_range.after)
+                if time_range.until is not None:
+                    until = to_epoch(time_range.until)
+
+            # Out of order writes break the binary search until the cache is compacted
+            is_sorted = self.needs_compaction() is False
+            if is_sorted and after is not None:
+                low = bisect.bisect_left(starts, after)
+                if until is not None:
+                    high = bisect.bisect_right(starts, until, lo=low)
+
+            project_ref: Optional[int] = None
+            if pid is not None:
+                refs = [i for i, project in enumerate(projects) if project.id == pid]
+                if not refs:
+                    return
+                project_ref = refs[0]
+
+            ids = columns["id"]
+            description_refs = columns["description"]
+            for i in range(low, high):
+                if project_ref is not None and project_refs[i] != project_ref:
+                    continue
+                if until is not None and until < stops[i]:
+                    continue
+                if not is_sorted and after is not None and starts[i] < after:
+                    continue
+
+                yield TogglTimeEntry(
+                    id=ids[i],
+                    project=projects[project_refs[i]],
+                    description=descriptions[description_refs[i]],
+                    start=from_epoch(starts[i]),
+                    stop=from_epoch(stops[i]),
+                )
+
+    def load(self) -> Iterator[TogglTimeEntry]:
+        yield from self._read_rows(time_range=None, pid=None)
+
+    def read(
+        self,
+        time_range: Optional[TimeRange] = None,
+        pid: Optional[TogglProjectId] = None,
+    ) -> Iterator[TogglTimeEntry]:
+        yield from self._read_rows(time_range=time_range, pid=pid)
+
+    def last_start(self) -> Optional[datetime.datetime]:
+        with self._open_columns() as columns:
+            starts = columns["start"]
+            if len(starts) == 0:
+                return None
+            if self.needs_compaction():
+                # Entries written out of order might follow the latest one
+                return from_epoch(max(starts))
+            return from_epoch(starts[-1])
+
+    def write(self, entries: List[TogglTimeEntry]) -> None:
+        # Assumption: all entries must be sorted by start date
+        with self.lock.exclusive():
+            last_start = self.last_start() if entries else None
+            self.path.mkdir(parents=True, exist_ok=True)
+            if last_start is not None and any(
+                to_epoch(entry.start) <= to_epoch(last_start) for entry in entries
+            ):
+                self.compaction_marker_path.touch()
+
+            self._append(entries)
+
+    def _append(self, entries: List[TogglTimeEntry]) -> None:
+        projects, descriptions = self._load_tables()
+        project_refs = {project.id: i for i, project in enumerate(projects)}
+        description_refs = {text: i for i, text in enumerate(descriptions)}
+
+        new_columns = {name: array.array(code) for name, code in COLUMNS.items()}
+        for entry in entries:
+            if entry.stop is None:
+                # Ongoing time entry, just ignore it
+                continue
+
+            if entry.project.id not in project_refs:
+                project_refs[entry.project.id] = len(projects)
+                projects.append(entry.project)
+            if entry.description not in description_refs:
+                description_refs[entry.description] = len(descriptions)
+                descriptions.append(entry.description)
+
+            new_columns["id"].append(entry.id)
+            new_columns["project"].append(project_refs[entry.project.id])
+            new_columns["description"].append(description_refs[entry.description])
+            new_columns["start"].append(to_epoch(entry.start))
+            new_columns["stop"].append(to_epoch(entry.stop))
+
+        # Appending after half a value or after the end of another column would
+        # misalign every following entry, so drop what an interrupted write left
+        rows = min(self._count_complete_values(name) for name in COLUMNS)
+
+        # Tables first, so that columns never point to missing table positions
+        self._save_tables(projects, descriptions)
+        for name, column in new_columns.items():
+            with self._column_path(name).open("ab") as f:
+                f.truncate(rows * column.itemsize)
+                column.tofile(f)
+
+    def _count_complete_values(self, name: str) -> int:
+        path = self._column_path(name)
+        if path.exists() is False:
+            return 0
+        return path.stat().st_size // ITEM_SIZES[COLUMNS[name]]
+
+    def needs_compaction(self) -> bool:
+        return self.compaction_marker_path.exists()
+
+    def compact(self) -> CompactionReport:
+        """Rewrite the cache sorted by start date and without duplicated entries
+
+        The new cache is written to a temporary directory that is then swapped with the
+        cache directory, so that an interrupted compaction leaves the cache untouched.
+        """
+        with self.lock.exclusive():
+            bytes_before = get_size(self.path)
+            entries, read_seconds_before = read_all(self.load)
+            compacted = deduplicate_entries(entries)
+
+            parent = self.path.parent
+            tmp_path = Path(tempfile.mkdtemp(dir=parent, prefix=f".{self.path.name}."))
+            old_path = tmp_path.with_name(f"{tmp_path.name}.old")
+            try:
+                ColumnarEntryCache(path=tmp_path)._append(compacted)
+                if self.path.exists():
+                    self.path.rename(old_path)
+                tmp_path.rename(self.path)
+            finally:
+                shutil.rmtree(tmp_path, ignore_errors=True)
+                shutil.rmtree(old_path, ignore_errors=True)
+
+        return CompactionReport(
+            rows_before=len(entries),
+            rows_after=len(compacted),
+            bytes_before=bytes_before,
+            bytes_after=get_size(self.path),
+            read_seconds_before=read_seconds_before,
+            read_seconds_after=time_full_read(self.load),
+        )
+
+    def remove(self) -> None:
+        # The lock file stays, other processes might be waiting on it
+        with self.lock.exclusive():
+            if not self.path.exists():
+                return
+
+            for path in self.path.iterdir():
+                path.unlink()
+            self.path.rmdir()
@@ -0,0 +1,68 @@
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Iterator, List, Tuple
+
+from src.types import TogglEntryId, TogglTimeEntry
+
+
+@dataclass(frozen=True)
+class CompactionReport:
+    rows_before: int
+    rows_after: int
+    bytes_before: int
+    bytes_after: int
+    read_seconds_before: float  # to read every cached entry
+    read_seconds_after: float
+
+    @property
+    def bytes_saved(self) -> int:
+        return self.bytes_before - self.bytes_after
+
+    @property
+    def read_seconds_saved(self) -> float:
+        return self.read_seconds_before - self.read_seconds_after
+
+    def __str__(self) -> str:
+        return (
+            f"{self.rows_before} -> {self.rows_after} rows,"
+            f" {self.bytes_saved} bytes saved,"
+            f" full read {self.read_seconds_before:.3f}s"
+            f" -> {self.read_seconds_after:.3f}s"
+        )
+
+
+def deduplicate_entries(entries: Iterable[TogglTimeEntry]) -> List[TogglTimeEntry]:
+    """Return entries sorted by start, keeping the last written version of each id"""
+    latest: Dict[TogglEntryId, TogglTimeEntry] = {}
+    for entry in entries:
+        # Entries are appended, hence later rows hold the latest version of an entry
+        latest[entry.id] = entry
+    return sorted(latest.values(), key=lambda entry: (entry.start, entry.id))
+
+
+def read_all(
+    load: Callable[[], Iterator[TogglTimeEntry]],
+) -> Tuple[List[TogglTimeEntry], float]:
+    """Return every entry yielded by ``load`` and how many seconds reading took"""
+    start = time.perf_counter()
+    entries = list(load())
+    return entries, time.perf_counter() - start
+
+
+def time_full_read(load: Callable[[], Iterator[TogglTimeEntry]]) -> float:
+    start = time.perf_counter()
+    for _ in load():
+        pass
+    return time.perf_counter() - start
+
+
+def get_size(*paths: Path) -> int:
+    """Return the size of the given files and of the files in the given directories"""
+    size = 0
+    for path in paths:
+        if path.is_dir():
+            size += sum(child.stat().st_size for child in path.iterdir())
+        elif path.exists():
+            size += path.stat().st_size
+    return size
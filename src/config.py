@@ -1,8 +1,12 @@
 import datetime
+import enum
 import logging
-from dataclasses import dataclass
+import os
+import pickle
+import tempfile
+from dataclasses import dataclass, field
 from pathlib import Path
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Tuple
 
 from src.filesystem import abort_if_file_does_not_exist, read_json_with_comments
 from src.types import JsonDict, Project, TogglProjectId
@@ -12,12 +16,46 @@ CONFIG_PATH = DOTFILES_DIR / "config.jsonc"
 SECRETS_PATH = DOTFILES_DIR / "secrets.jsonc"
 GSPREAD_CREDENTIALS = DOTFILES_DIR / "gspread_credentials.json"
 GSPREAD_AUTHORIZED_USER = DOTFILES_DIR / "gspread_authorized_user.json"
+CONFIG_SNAPSHOT_PATH = DOTFILES_DIR / "config-snapshot.pickle"
+# Bump it whenever AppConfig changes, so that outdated snapshots are not loaded
+CONFIG_SNAPSHOT_VERSION = 3
 
 logger = logging.getLogger(__name__)
 
 TogglApiToken = str
 
 
+class CacheBackend(enum.Enum):
+    columnar = "columnar"
+    csv = "csv"
+    segments = "segments"
+    sqlite = "sqlite"
+
+
+@dataclass
+class TogglClientConfig:
+    pool_connections: int = 1  # amount of hosts to keep connection pools for
+    pool_maxsize: int = 10  # connections kept alive per host
+    timeout: float = 30  # seconds
+    max_retries: int = 5
+    backoff_factor: float = 0.5  # seconds, doubled on every retry
+    max_backoff: float = 60  # seconds
+    max_workers: int = 4  # concurrent requests when fetching long time ranges
+    use_asyncio: bool = False  # fetch with AsyncToggl instead of Toggl
+    stream: bool = False  # decode responses while downloading, one window at a time
+    incremental_sync: bool = True  # only fetch changed entries, needs the sqlite cache
+
+
+@dataclass
+class GSheetClientConfig:
+    max_workers: int = 4  # worksheets updated concurrently
+    read_requests_per_minute: int = 60  # Sheets API quota per user
+    write_requests_per_minute: int = 60  # Sheets API quota per user
+    max_retries: int = 5  # when the quota is exceeded anyway
+    backoff_factor: float = 1  # seconds, doubled on every retry
+    max_backoff: float = 64  # seconds
+
+
 @dataclass
 class AppConfig:
     projects: List[Project]
@@ -25,6 +63,11 @@ class AppConfig:
     gsheet_url: str
     gspread_credentials_path: Path
     gspread_authorized_user_path: Path
+    cache_backend: CacheBackend = CacheBackend.sqlite
+    cache_dir: Optional[Path] = None  # current directory if not set
+    compress_cache_segments: bool = True  # of past months, with the segments backend
+    toggl_client: TogglClientConfig = field(default_factory=TogglClientConfig)
+    gsheet_client: GSheetClientConfig = field(default_factory=GSheetClientConfig)
 
     @property
     def project_id_to_name_map(self) -> Dict[TogglProjectId, Project]:
@@ -59,8 +102,14 @@ def parse_project(raw: JsonDict) -> Project:
 
 
 def parse_config(config_path: Path, credentials_path: Path) -> AppConfig:
-    raw_config = read_json_with_comments(path=CONFIG_PATH)
+    raw_config = read_json_with_comments(path=config_path)
     projects = list(map(parse_project, raw_config["projects"]))
+    cache_backend = CacheBackend(raw_config.get("cache_backend", "sqlite"))
+    raw_cache_dir = raw_config.get("cache_dir")
+    cache_dir = Path(raw_cache_dir).expanduser() if raw_cache_dir else None
+    compress_cache_segments = raw_config.get("compress_cache_segments", True)
+    toggl_client = TogglClientConfig(**raw_config.get("toggl_client", {}))
+    gsheet_client = GSheetClientConfig(**raw_config.get("gsheet_client", {}))
 
     credentials = read_json_with_comments(path=credentials_path)
     api_token: TogglApiToken = credentials["toggle_api_token"]
@@ -72,10 +121,70 @@ def parse_config(config_path: Path, credentials_path: Path) -> AppConfig:
         gsheet_url=gsheet_url,
         gspread_credentials_path=GSPREAD_CREDENTIALS,
         gspread_authorized_user_path=GSPREAD_AUTHORIZED_USER,
+        cache_backend=cache_backend,
+        cache_dir=cache_dir,
+        compress_cache_segments=compress_cache_segments,
+        toggl_client=toggl_client,
+        gsheet_client=gsheet_client,
     )
     return config
 
 
+FileStamp = Tuple[str, int, int]  # path, modification time (ns), size
+
+
+def get_file_stamps(paths: List[Path]) -> List[FileStamp]:
+    stamps = []
+    for path in paths:
+        stat = path.stat()
+        stamps.append((str(path), stat.st_mtime_ns, stat.st_size))
+    return stamps
+
+
+def load_config_snapshot(path: Path, stamps: List[FileStamp]) -> Optional[AppConfig]:
+    """Return the config parsed in a previous run, if its source files are unchanged"""
+    try:
+        with path.open("rb") as f:
+            version, snapshot_stamps, config = pickle.load(f)
+    except FileNotFoundError:
+        return None
+    except Exception as error:
+        # The snapshot is just a shortcut: if it cannot be loaded, parse the config
+        logger.warning(f"Ignoring unreadable config snapshot {path}: {error!r}")
+        return None
+
+    if version != CONFIG_SNAPSHOT_VERSION or snapshot_stamps != stamps:
+        return None
+
+    return config
+
+
+def save_config_snapshot(
+    path: Path,
+    stamps: List[FileStamp],
+    config: AppConfig,
+) -> None:
+    """Store the parsed config, only readable by the user as it holds secrets"""
+    snapshot = (CONFIG_SNAPSHOT_VERSION, stamps, config)
+    try:
+        # mkstemp creates the file with 0600 permissions
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.")
+    except OSError as error:
+        logger.warning(f"Failed to save config snapshot at {path}: {error!r}")
+        return
+
+    try:
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump(snapshot, f, protocol=pickle.HIGHEST_PROTOCOL)
+        # Replace the previous snapshot atomically, so that it is never half written
+        os.replace(tmp_path, path)
+    except OSError as error:
+        logger.warning(f"Failed to save config snapshot at {path}: {error!r}")
+    finally:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+
+
 _CACHED_APP_CONFIG: Optional[AppConfig] = None
 
 
@@ -87,7 +196,13 @@ def get_config() -> AppConfig:
     abort_if_config_file_does_not_exist(path=CONFIG_PATH)
     abort_if_credentials_file_does_not_exist(path=SECRETS_PATH)
 
-    config = parse_config(config_path=CONFIG_PATH, credentials_path=SECRETS_PATH)
+    # Stamp the source files before parsing them, so that any change made while
+    # parsing invalidates the snapshot
+    stamps = get_file_stamps([CONFIG_PATH, SECRETS_PATH])
+    config = load_config_snapshot(CONFIG_SNAPSHOT_PATH, stamps)
+    if config is None:
+        config = parse_config(config_path=CONFIG_PATH, credentials_path=SECRETS_PATH)
+        save_config_snapshot(CONFIG_SNAPSHOT_PATH, stamps, config)
 
     _CACHED_APP_CONFIG = config
 
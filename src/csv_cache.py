@@ -0,0 +1,410 @@
+from __future__ import annotations
+
+import bisect
+import csv
+import datetime
+import io
+import os
+import tempfile
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import IO, Dict, Iterator, List, Optional, Tuple, Union, cast
+
+from src.compaction import (
+    CompactionReport,
+    deduplicate_entries,
+    get_size,
+    read_all,
+    time_full_read,
+)
+from src.filesystem import FileLock
+from src.timestamps import to_epoch
+from src.types import Project, TimeRange, TogglProjectId, TogglTimeEntry
+
+TableRow = List[Union[str, int]]
+ProjectMap = Dict[TogglProjectId, Project]
+DayNumber = int  # days since epoch, in UTC
+ByteOffset = int
+
+SECONDS_PER_DAY = 24 * 60 * 60
+
+# Parsing ISO strings is faster than building datetimes from epoch seconds
+fromisoformat = datetime.datetime.fromisoformat
+
+
+def entry_to_table_row(entry: TogglTimeEntry) -> TableRow:
+    return [
+        entry.id,
+        entry.project.id,
+        entry.project.alias,
+        entry.project.start_date.isoformat(),
+        entry.description,
+        entry.start.isoformat(),
+        entry.stop.isoformat(),  # type:ignore
+    ]
+
+
+def table_row_to_entry(
+    row: TableRow,
+    projects: Optional[ProjectMap] = None,
+) -> TogglTimeEntry:
+    """Build an entry from a CSV row
+
+    Entries of the same project share the ``Project`` instance found in ``projects``.
+    Projects missing in ``projects`` are built from the row and added to it, so that
+    the following rows of the same project reuse them too.
+    """
+    if projects is None:
+        projects = {}
+
+    project_id = int(row[1])
+    project = projects.get(project_id)
+    if project is None:
+        project = Project(
+            id=project_id,
+            alias=cast(str, row[2]),
+            start_date=fromisoformat(cast(str, row[3])),
+        )
+        projects[project_id] = project
+
+    return TogglTimeEntry(
+        id=int(row[0]),
+        project=project,
+        description=cast(str, row[4]),
+        start=fromisoformat(cast(str, row[5])),
+        stop=fromisoformat(cast(str, row[6])),
+    )
+
+
+def entry_to_csv_line(entry: TogglTimeEntry) -> bytes:
+    buffer = io.StringIO()
+    csv.writer(buffer).writerow(entry_to_table_row(entry))
+    return buffer.getvalue().encode()
+
+
+def is_in_time_range(entry: TogglTimeEntry, time_range: Optional[TimeRange]) -> bool:
+    if time_range is None:
+        return True
+    if entry.start < time_range.after:
+        return False
+    return time_range.until is None or entry.stop <= time_range.until  # type: ignore
+
+
+def day_number(moment: datetime.datetime) -> DayNumber:
+    return to_epoch(moment) // SECONDS_PER_DAY
+
+
+@dataclass
+class SeekIndex:
+    """Byte offset of the first row of each day in the CSV cache
+
+    ``size`` is the size of the CSV file when the index was last updated, and it is used
+    to detect indexes that are out of sync with their CSV file.
+    """
+
+    size: int = 0
+    days: List[DayNumber] = field(default_factory=list)
+    offsets: List[ByteOffset] = field(default_factory=list)
+
+    def add(self, day: DayNumber, offset: ByteOffset) -> None:
+        if self.days and day <= self.days[-1]:
+            return
+
+        self.days.append(day)
+        self.offsets.append(offset)
+
+    def find_offset(self, day: DayNumber) -> Optional[ByteOffset]:
+        """Return the offset of the first row on or after ``day``, if any"""
+        position = bisect.bisect_left(self.days, day)
+        if position == len(self.days):
+            return None
+
+        return self.offsets[position]
+
+    @property
+    def last_offset(self) -> ByteOffset:
+        return self.offsets[-1] if self.offsets else 0
+
+    @classmethod
+    def load(cls, path: Path) -> Optional[SeekIndex]:
+        if path.exists() is False:
+            return None
+
+        with path.open("r") as f:
+            rows = list(csv.reader(f))
+
+        if not rows or rows[0][0] != "size":
+            return None
+
+        index = cls(size=int(rows[0][1]))
+        for day, offset in rows[1:]:
+            index.add(int(day), int(offset))
+        return index
+
+    def save(self, path: Path) -> None:
+        # Several readers might rebuild an outdated index at once, so replace it
+        # atomically instead of writing it in place
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.")
+        try:
+            with os.fdopen(fd, "w") as f:
+                writer = csv.writer(f)
+                writer.writerow(["size", self.size])
+                writer.writerows(zip(self.days, self.offsets))
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+
+
+class CsvEntryCache:
+    """Append-only CSV file, one row per entry, sorted by start date
+
+    A sidecar index with the byte offset of the first row of each day is kept next to
+    the CSV file, so that reads can seek straight to the first relevant row instead of
+    parsing the file from the beginning.
+
+    Writing entries that start before the last cached entry breaks the sort order and
+    might duplicate entries, hence it leaves a marker file to compact the cache. Until
+    then, reads parse the whole file.
+
+    Several processes can share the cache: writes take an exclusive lock, and reads only
+    take a shared lock while opening the file, to read the rows written until then.
+    """
+
+    def __init__(self, path: Path, projects: Optional[ProjectMap] = None) -> None:
+        self.path = path
+        self.projects = projects or {}
+        self.index_path = path.with_name(f"{path.name}.idx")
+        self.compaction_marker_path = path.with_name(f"{path.name}.needs-compaction")
+        self.lock = FileLock(path.with_name(f"{path.name}.lock"))
+
+    def load(self) -> Iterator[TogglTimeEntry]:
+        snapshot = self._open_snapshot()
+        if snapshot is None:
+            return
+
+        f, index = snapshot
+        yield from self._load_from(f, offset=0, end=index.size)
+
+    def _open_snapshot(self) -> Optional[Tuple[IO[bytes], SeekIndex]]:
+        """Open the CSV file, along with the index of the rows written so far
+
+        Compacting or removing the cache replaces the file, but files already open keep
+        reading the previous one.
+        """
+        with self.lock.shared():
+            if self.path.exists() is False:
+                return None
+            return self.path.open("rb"), self._get_index()
+
+    def _load_from(
+        self,
+        f: IO[bytes],
+        offset: ByteOffset,
+        end: ByteOffset,
+    ) -> Iterator[TogglTimeEntry]:
+        # Assumption: all entries are sorted by start date
+        projects = dict(self.projects)
+        with f:
+            f.seek(offset)
+            for row in csv.reader(read_lines(f, end)):
+                entry = table_row_to_entry(row, projects)  # type: ignore
+                yield entry
+
+    def _get_index(self) -> SeekIndex:
+        """Return the sidecar index, rebuilding it if it is missing or outdated"""
+        size = self.path.stat().st_size if self.path.exists() else 0
+        index = SeekIndex.load(self.index_path)
+        if index is not None and index.size == size:
+            return index
+
+        index = SeekIndex()
+        if size:
+            with self.path.open("rb") as f:
+                _index_rows(f, index)
+        index.size = size
+        index.save(self.index_path)
+        return index
+
+    def read(
+        self,
+        time_range: Optional[TimeRange] = None,
+        pid: Optional[TogglProjectId] = None,
+    ) -> Iterator[TogglTimeEntry]:
+        for entry in self._read_range(time_range):
+            if pid is None or entry.project.id == pid:
+                yield entry
+
+    def _read_range(
+        self,
+        time_range: Optional[TimeRange] = None,
+    ) -> Iterator[TogglTimeEntry]:
+        if time_range is None:
+            yield from self.load()
+            return
+
+        snapshot = self._open_snapshot()
+        if snapshot is None:
+            return
+
+        f, index = snapshot
+        if self.needs_compaction():
+            # Entries written out of order might be anywhere in the file, so neither
+            # the index nor the sort order can be trusted until the cache is compacted
+            for entry in self._load_from(f, offset=0, end=index.size):
+                if is_in_time_range(entry, time_range):
+                    yield entry
+            return
+
+        offset = index.find_offset(day_number(time_range.after))
+        if offset is None:
+            # No entries on or after the requested time range
+            f.close()
+            return
+
+        entries_iter = self._load_from(f, offset=offset, end=index.size)
+
+        for entry in entries_iter:
+            if entry.start < time_range.after:
+                continue
+
+            if time_range.after <= entry.start:
+                if time_range.until is None:
+                    yield entry
+                    continue
+
+                if entry.stop <= time_range.until:  # type: ignore
+                    yield entry
+                    continue
+
+            if time_range.until and time_range.until < entry.stop:  # type: ignore
+                break
+
+    def last_start(self) -> Optional[datetime.datetime]:
+        snapshot = self._open_snapshot()
+        if snapshot is None:
+            return None
+
+        f, index = snapshot
+        if self.needs_compaction():
+            # Entries written out of order might follow the latest one
+            starts = [entry.start for entry in self._load_from(f, 0, index.size)]
+            return max(starts, default=None)
+
+        last_entry: Optional[TogglTimeEntry] = None
+        for last_entry in self._load_from(f, offset=index.last_offset, end=index.size):
+            pass
+
+        if last_entry is None:
+            return None
+
+        return last_entry.start
+
+    def write(self, entries: List[TogglTimeEntry]) -> None:
+        # Assumption: all entries must be sorted by start date
+        with self.lock.exclusive():
+            last_start = self.last_start() if entries else None
+            if last_start is not None and any(
+                to_epoch(entry.start) <= to_epoch(last_start) for entry in entries
+            ):
+                self.compaction_marker_path.touch()
+
+            index = self._get_index()
+            with self.path.open("ab") as f:
+                _write_rows(f, entries, index)
+
+            index.save(self.index_path)
+
+    def needs_compaction(self) -> bool:
+        return self.compaction_marker_path.exists()
+
+    def compact(self) -> CompactionReport:
+        """Rewrite the cache sorted by start date and without duplicated entries
+
+        The new cache is written to a temporary file that then replaces the cache, so
+        that an interrupted compaction leaves the cache untouched.
+        """
+        with self.lock.exclusive():
+            bytes_before = get_size(self.path, self.index_path)
+            entries, read_seconds_before = read_all(self.load)
+            compacted = deduplicate_entries(entries)
+
+            index = SeekIndex()
+            fd, tmp_path = tempfile.mkstemp(
+                dir=self.path.parent, prefix=f".{self.path.name}."
+            )
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    _write_rows(f, compacted, index)
+                os.replace(tmp_path, self.path)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.unlink(tmp_path)
+
+            # An index out of sync with the new file would be rebuilt, as its size
+            # differs
+            index.save(self.index_path)
+            if self.compaction_marker_path.exists():
+                self.compaction_marker_path.unlink()
+
+        return CompactionReport(
+            rows_before=len(entries),
+            rows_after=len(compacted),
+            bytes_before=bytes_before,
+            bytes_after=get_size(self.path, self.index_path),
+            read_seconds_before=read_seconds_before,
+            read_seconds_after=time_full_read(self.load),
+        )
+
+    def remove(self) -> None:
+        # The lock file stays, other processes might be waiting on it
+        with self.lock.exclusive():
+            for path in (self.path, self.index_path, self.compaction_marker_path):
+                if path.exists():
+                    path.unlink()
+
+
+def read_lines(f: IO[bytes], end: ByteOffset) -> Iterator[str]:
+    """Yield the lines of ``f`` up to ``end``, ignoring the rows appended afterwards"""
+    position = f.tell()
+    for line in f:
+        position += len(line)
+        if end < position:
+            return
+        yield line.decode()
+
+
+def _write_rows(
+    f: IO[bytes],
+    entries: List[TogglTimeEntry],
+    index: SeekIndex,
+) -> None:
+    """Append ``entries`` to ``f`` and add the offset of each new day to ``index``"""
+    for entry in entries:
+        if entry.stop is None:
+            # Ongoing time entry, just ignore it
+            continue
+        index.add(day_number(entry.start), f.tell())
+        f.write(entry_to_csv_line(entry))
+    index.size = f.tell()
+
+
+def _index_rows(f: IO[bytes], index: SeekIndex) -> None:
+    """Add the offset of the first row of each day in ``f`` to ``index``"""
+    # A row spans several lines if its description contains line breaks, so keep track
+    # of the offset of every line and let the csv reader tell where each row starts
+    line_offsets: List[ByteOffset] = []
+
+    def read_lines() -> Iterator[str]:
+        while True:
+            line_offsets.append(f.tell())
+            line = f.readline()
+            if not line:
+                return
+            yield line.decode()
+
+    row_start = 0
+    for row in csv.reader(read_lines()):
+        start = fromisoformat(row[5])
+        index.add(day_number(start), line_offsets[row_start])
+        row_start = len(line_offsets)
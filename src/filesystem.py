@@ -1,8 +1,12 @@
+import contextlib
+import fcntl
 import json
 import logging
 import re
 import sys
+import threading
 from pathlib import Path
+from typing import Iterator, Optional
 
 from src.types import JsonDict
 
@@ -17,31 +21,28 @@ def read_json_with_comments(path: Path) -> JsonDict:
     return content
 
 
-# match any "//" that is not in an URL
-HAS_JS_COMMENT = re.compile(r"(^|[^:])\/\/[^a-zA-Z0-9]?")
-COMMENT_AT_BEGINNING_OF_LINE = re.compile(r"^//")
+# Strings are matched first, so that "//" or "/*" inside a string are not taken as the
+# start of a comment
+JSONC_TOKEN = re.compile(
+    r"""
+    (?P<string>"(?:\\.|[^"\\])*")
+    | (?P<line_comment>//[^\n]*)
+    | (?P<block_comment>/\*.*?\*/)
+    """,
+    re.DOTALL | re.VERBOSE,
+)
 
 
 def remove_comments_from_json(content: str) -> str:
-    clean_lines = []
-    for line in content.split("\n"):
-        has_comment = HAS_JS_COMMENT.search(line)
-        if has_comment:
-            clean_line = line.strip()
-            if COMMENT_AT_BEGINNING_OF_LINE.match(clean_line):
-                # The whole line is a comment, skip it
-                continue
-            else:
-                # Remove the comment and anything in the line after the comment
-                clean_line = line
-                position_of_comment = clean_line.index("//")
-                clean_line = clean_line[:position_of_comment].strip()
-        else:
-            clean_line = line
-        clean_lines.append(clean_line)
-
-    json_str = "\n".join(clean_lines)
-    return json_str
+    """Remove ``//`` and ``/* */`` comments from JSONC in a single pass"""
+
+    def keep_strings(match: re.Match) -> str:
+        if match.lastgroup == "string":
+            return match.group()
+        # Keep line breaks, so that JSON errors point to the right line
+        return "\n" * match.group().count("\n")
+
+    return JSONC_TOKEN.sub(keep_strings, content)
 
 
 def abort_if_file_does_not_exist(path: Path, message: str) -> None:
@@ -51,3 +52,42 @@ def abort_if_file_does_not_exist(path: Path, message: str) -> None:
     logger.error(message)
     print(message)
     sys.exit(1)
+
+
+class FileLock:
+    """Advisory lock shared by every process that locks the same file
+
+    Any amount of processes can hold the shared lock at once, while the exclusive lock
+    is held by a single process and only when nobody holds the shared one.
+
+    Locking again from a thread that already holds the lock does nothing, so that
+    methods holding the exclusive lock can call the ones taking the shared lock.
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self._held = threading.local()
+
+    def shared(self) -> contextlib.AbstractContextManager[None]:
+        return self._lock(fcntl.LOCK_SH)
+
+    def exclusive(self) -> contextlib.AbstractContextManager[None]:
+        return self._lock(fcntl.LOCK_EX)
+
+    @contextlib.contextmanager
+    def _lock(self, operation: int) -> Iterator[None]:
+        held: Optional[int] = getattr(self._held, "operation", None)
+        if held is not None:
+            if held != fcntl.LOCK_EX and operation == fcntl.LOCK_EX:
+                raise RuntimeError(f"cannot upgrade the shared lock on {self.path}")
+            yield
+            return
+
+        # Closing the file releases the lock, even if the process is killed
+        with self.path.open("a") as f:
+            fcntl.flock(f.fileno(), operation)
+            self._held.operation = operation
+            try:
+                yield
+            finally:
+                self._held.operation = None
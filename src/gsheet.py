@@ -1,20 +1,44 @@
 from __future__ import annotations
 
 import datetime
-from typing import Dict, Iterator, List, Optional, Tuple, Union
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    TypeVar,
+    Union,
+)
 
 import gspread
 from gspread import Client as GSheetClient
+from gspread.exceptions import APIError
 from gspread.models import Spreadsheet, Worksheet
 
-from src.config import get_config
-from src.types import ProjectAlias, ProjectDailyStats
+from src.config import GSheetClientConfig, get_config
+from src.metrics import get_metrics
+from src.retry import get_backoff
+from src.types import JsonDict, ProjectAlias, ProjectDailyStats
+
+logger = logging.getLogger(__name__)
 
 _CACHED_GSHEET_CLIENT: Optional[GSheetClient] = None
+_CACHED_RATE_LIMITER: Optional[SheetsRateLimiter] = None
 MIN_DATE = datetime.date.min
 
 GSheetCell = Union[str, bool, int]
 GSheetRow = List[GSheetCell]
+# Unformatted value read from a worksheet: numbers might come back as floats
+GSheetValue = Union[GSheetCell, float]
 
 
 def get_sheet_client() -> GSheetClient:
@@ -41,6 +65,226 @@ def get_sheet_client() -> GSheetClient:
     return client
 
 
+Clock = Callable[[], float]
+Sleep = Callable[[float], None]
+T = TypeVar("T")
+
+
+class TokenBucket:
+    """Allow ``capacity`` calls per minute, refilling one token at a time
+
+    Callers that find the bucket empty reserve the next token and sleep until it is
+    refilled, hence calls are queued in arrival order instead of failing.
+    """
+
+    def __init__(
+        self,
+        capacity: int,
+        clock: Clock = time.monotonic,
+        sleep: Sleep = time.sleep,
+    ) -> None:
+        self._capacity = capacity
+        self._rate = capacity / 60  # tokens per second
+        self._clock = clock
+        self._sleep = sleep
+        self._tokens = float(capacity)
+        self._updated_at = clock()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> float:
+        """Take a token, waiting for it if needed, and return the seconds waited"""
+        with self._lock:
+            now = self._clock()
+            elapsed = now - self._updated_at
+            self._tokens = min(self._capacity, self._tokens + elapsed * self._rate)
+            self._updated_at = now
+
+            # The token is reserved even if it is not available yet: the balance goes
+            # negative and later callers wait for the tokens owed to earlier ones
+            self._tokens -= 1
+            wait = 0.0 if self._tokens >= 0 else -self._tokens / self._rate
+
+        if wait:
+            self._sleep(wait)
+        return wait
+
+
+@dataclass
+class SheetsClientStats:
+    requests: int = 0  # including retried requests
+    retries: int = 0
+    coalesced_writes: int = 0  # batch updates merged into another one
+    seconds_waited: float = 0  # on quota and on backoff
+
+
+@dataclass(eq=False)
+class _PendingWrite:
+    spreadsheet: Spreadsheet
+    requests: List[JsonDict]
+    done: threading.Event = field(default_factory=threading.Event)
+    error: Optional[BaseException] = None
+
+
+class SheetsRateLimiter:
+    """Keep Sheets API calls within the read and write quotas of the project
+
+    Reads wait for their quota. Writes wait for theirs too, and the batch updates
+    queued meanwhile are merged into a single batch update, so they use up a single
+    write of the quota. Calls rejected with a 429 are retried with exponential
+    backoff.
+    """
+
+    def __init__(
+        self,
+        settings: Optional[GSheetClientConfig] = None,
+        clock: Clock = time.monotonic,
+        sleep: Sleep = time.sleep,
+    ) -> None:
+        self._settings = settings or GSheetClientConfig()
+        self._sleep = sleep
+        self._read_bucket = TokenBucket(
+            self._settings.read_requests_per_minute, clock=clock, sleep=sleep
+        )
+        self._write_bucket = TokenBucket(
+            self._settings.write_requests_per_minute, clock=clock, sleep=sleep
+        )
+        self.stats = SheetsClientStats()
+        self._stats_lock = threading.Lock()
+        self._pending: List[_PendingWrite] = []
+        self._pending_lock = threading.Lock()
+        self._write_lock = threading.Lock()
+
+    def read(self, call: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        get_metrics().count("gsheet.reads")
+        return self._call(self._read_bucket, lambda: call(*args, **kwargs))
+
+    def batch_update(self, spreadsheet: Spreadsheet, requests: List[JsonDict]) -> None:
+        pending = _PendingWrite(spreadsheet=spreadsheet, requests=requests)
+        with self._pending_lock:
+            self._pending.append(pending)
+
+        while not pending.done.is_set():
+            # Only one thread writes at a time, the rest queue their writes meanwhile
+            with self._write_lock:
+                if pending.done.is_set():
+                    break
+                self._wait(self._write_bucket)
+                self._write_pending()
+
+        if pending.error is not None:
+            raise pending.error
+
+    def _write_pending(self) -> None:
+        batch = self._take_pending_batch()
+        merged = [request for pending in batch for request in pending.requests]
+        get_metrics().count("gsheet.writes")
+        try:
+            self._call_with_retries(
+                lambda: batch[0].spreadsheet.batch_update({"requests": merged})
+            )
+        except Exception as error:
+            if len(batch) == 1:
+                batch[0].error = error
+            else:
+                # A batch update is applied atomically, do not let a write fail
+                # because of another one that was merged with it
+                self._write_one_by_one(batch)
+        finally:
+            for pending in batch:
+                pending.done.set()
+
+        with self._stats_lock:
+            self.stats.coalesced_writes += len(batch) - 1
+
+    def _write_one_by_one(self, batch: List[_PendingWrite]) -> None:
+        for pending in batch:
+            body = {"requests": pending.requests}
+            get_metrics().count("gsheet.writes")
+            try:
+                self._call(
+                    self._write_bucket,
+                    lambda: pending.spreadsheet.batch_update(body),
+                )
+            except Exception as error:
+                pending.error = error
+
+    def _take_pending_batch(self) -> List[_PendingWrite]:
+        """Return the oldest queued writes that fit in a single batch update"""
+        with self._pending_lock:
+            first = self._pending[0]
+            batch = [first]
+            rows = count_rows(first.requests)
+            for pending in self._pending[1:]:
+                if pending.spreadsheet is not first.spreadsheet:
+                    continue
+                pending_rows = count_rows(pending.requests)
+                if MAX_ROWS_PER_BATCH < rows + pending_rows:
+                    break
+                batch.append(pending)
+                rows += pending_rows
+
+            self._pending = [p for p in self._pending if p not in batch]
+
+        return batch
+
+    def _call(self, bucket: TokenBucket, call: Callable[[], T]) -> T:
+        self._wait(bucket)
+        return self._call_with_retries(call)
+
+    def _wait(self, bucket: TokenBucket) -> None:
+        waited = bucket.acquire()
+        with self._stats_lock:
+            self.stats.seconds_waited += waited
+        get_metrics().count("gsheet.seconds_waited", waited)
+
+    def _call_with_retries(self, call: Callable[[], T]) -> T:
+        attempt = 0
+        while True:
+            with self._stats_lock:
+                self.stats.requests += 1
+            try:
+                return call()
+            except APIError as error:
+                response = error.response
+                if response.status_code != 429:
+                    raise
+                if attempt == self._settings.max_retries:
+                    raise
+                retry_after = response.headers.get("Retry-After")
+
+            delay = get_backoff(self._settings, attempt, retry_after)
+            logger.info(f"Sheets API quota exceeded, retrying in {delay:.1f}s")
+            with self._stats_lock:
+                self.stats.retries += 1
+                self.stats.seconds_waited += delay
+            metrics = get_metrics()
+            metrics.count("gsheet.retries")
+            metrics.count("gsheet.seconds_waited", delay)
+            self._sleep(delay)
+            attempt += 1
+
+
+def get_rate_limiter() -> SheetsRateLimiter:
+    global _CACHED_RATE_LIMITER
+    if _CACHED_RATE_LIMITER:
+        return _CACHED_RATE_LIMITER
+
+    limiter = SheetsRateLimiter(settings=get_config().gsheet_client)
+
+    _CACHED_RATE_LIMITER = limiter
+
+    return limiter
+
+
+def count_rows(requests: List[JsonDict]) -> int:
+    """Return the amount of rows written by the requests of a batch update"""
+    return sum(
+        len(change.get("rows", []))
+        for request in requests
+        for change in request.values()
+    )
+
+
 def stats_to_cells(stats: ProjectDailyStats) -> Iterator[GSheetRow]:
     """Return cells: date, description, seconds, billable"""
     date_str = stats.date.isoformat()
@@ -50,12 +294,13 @@ def stats_to_cells(stats: ProjectDailyStats) -> Iterator[GSheetRow]:
 
 
 WorksheetName = str
-WorksheetIndex = int
-WorksheetIndexToMap = Dict[WorksheetName, Worksheet]
+WorksheetNameToSheetMap = Dict[WorksheetName, Worksheet]
 
 
-def get_sheets_name_to_index_map(spreadsheet: Spreadsheet) -> WorksheetIndexToMap:
-    return {sheet.title: index for index, sheet in enumerate(spreadsheet)}
+def get_sheets_by_name(spreadsheet: Spreadsheet) -> WorksheetNameToSheetMap:
+    """Return every worksheet in the spreadsheet, fetched in a single request"""
+    sheets = get_rate_limiter().read(spreadsheet.worksheets)
+    return {sheet.title: sheet for sheet in sheets}
 
 
 RowIndex = int  # 0-based index
@@ -108,11 +353,61 @@ def column_name_to_number(name: str) -> int:
     return column_number
 
 
-def find_last_date(sheet: Worksheet) -> datetime.date:
-    first_column = sheet.col_values(column_name_to_number("A"))
+@dataclass
+class WorksheetSnapshot:
+    """Columns of a worksheet read once per run
+
+    ``find_last_date``, ``find_last_date_rows_range`` and ``check_if_last_row_invoiced``
+    answer from these columns instead of reading the worksheet again. Values are
+    unformatted, so that they do not depend on the number format or locale of the
+    worksheet.
+    """
+
+    row_columns: List[List[GSheetValue]]  # date, description, seconds, billable
+    invoices_column: List[GSheetValue]
+
+    @property
+    def first_column(self) -> List[GSheetValue]:
+        return self.row_columns[0] if self.row_columns else []
+
+    def row(self, number: RowNumber) -> List[GSheetValue]:
+        index = number - 1
+        return [
+            column[index] if index < len(column) else "" for column in self.row_columns
+        ]
+
+
+ROW_COLUMNS_RANGE = "A:D"
+INVOICES_COLUMN_RANGE = "I:I"
+
+
+def column_values(value_range: List[List[GSheetValue]]) -> List[GSheetValue]:
+    # with major_dimension=COLUMNS a non-empty range holds a single list of values
+    return value_range[0] if value_range else []
+
+
+def take_snapshot(sheet: Worksheet) -> WorksheetSnapshot:
+    """Read the row and invoice columns of ``sheet`` in a single request"""
+    row_columns, invoices_column = get_rate_limiter().read(
+        sheet.batch_get,
+        [ROW_COLUMNS_RANGE, INVOICES_COLUMN_RANGE],
+        major_dimension="COLUMNS",
+        value_render_option="UNFORMATTED_VALUE",
+    )
+    return WorksheetSnapshot(
+        row_columns=list(row_columns),
+        invoices_column=column_values(invoices_column),
+    )
+
+
+def find_last_date(snapshot: WorksheetSnapshot) -> datetime.date:
+    first_column = snapshot.first_column
+    if not first_column:
+        return datetime.date.min
+
     bottom_row_value = first_column[-1]
     try:
-        last_date = datetime.date.fromisoformat(bottom_row_value)
+        last_date = datetime.date.fromisoformat(str(bottom_row_value))
     except ValueError:
         # no date found in bottom_row_value, hence return early not to delete anything
         # and return the earliest day possible so that no entries are skipped
@@ -121,8 +416,10 @@ def find_last_date(sheet: Worksheet) -> datetime.date:
     return last_date
 
 
-def find_last_date_rows_range(sheet: Worksheet) -> Tuple[RowNumber, RowNumber]:
-    first_column = sheet.col_values(column_name_to_number("A"))
+def find_last_date_rows_range(
+    snapshot: WorksheetSnapshot,
+) -> Tuple[RowNumber, RowNumber]:
+    first_column = snapshot.first_column
     bottom_row_value = first_column[-1]
 
     start_index: RowIndex = first_column.index(bottom_row_value)
@@ -133,7 +430,7 @@ def find_last_date_rows_range(sheet: Worksheet) -> Tuple[RowNumber, RowNumber]:
     return start, end
 
 
-def check_if_last_row_invoiced(sheet: Worksheet) -> bool:
+def check_if_last_row_invoiced(snapshot: WorksheetSnapshot) -> bool:
     """Return True if the last row in the sheet has an invoiced entry
 
     An invoiced entry must have any value in column I.
@@ -141,90 +438,297 @@ def check_if_last_row_invoiced(sheet: Worksheet) -> bool:
     Assumption: days are invoiced in full - either all the entries in a given day are
     invoiced or none are invoiced, but a day cannot be partially invoiced.
     """
-    start_row_number, _ = find_last_date_rows_range(sheet)
+    if not snapshot.first_column:
+        return False
 
-    invoices_column_number = column_name_to_number("I")
-    invoices_column = sheet.col_values(invoices_column_number)
-    last_invoiced_row: RowNumber = len(invoices_column)
+    start_row_number, _ = find_last_date_rows_range(snapshot)
+
+    last_invoiced_row: RowNumber = len(snapshot.invoices_column)
 
     last_row_was_invoiced = start_row_number <= last_invoiced_row
 
     return last_row_was_invoiced
 
 
-def delete_rows_with_last_date(sheet: Worksheet) -> datetime.date:
-    """Delete rows from the bottom up, and returns deleted date value"""
-    last_date = find_last_date(sheet)  # Store last date before deleting any rows
-
-    start_number, end_number = find_last_date_rows_range(sheet)
-    sheet.delete_rows(start_index=start_number, end_index=end_number)
-
-    return last_date
-
-
-def upload_to_gsheet(stats: List[ProjectDailyStats], append_only: bool) -> None:
-    client = get_sheet_client()
-    config = get_config()
-
-    spreadsheet = client.open_by_url(config.gsheet_url)
-    name_to_index = get_sheets_name_to_index_map(spreadsheet)
+CellUpdate = Tuple[RowNumber, ColumnNumber, GSheetCell]
+
+
+@dataclass
+class WorksheetUpdate:
+    """Changes to apply to a worksheet: delete a range of rows, then append rows"""
+
+    sheet: Worksheet
+    alias: ProjectAlias
+    rows_to_delete: Optional[Tuple[RowNumber, RowNumber]] = None
+    rows_to_append: List[GSheetRow] = field(default_factory=list)
+    cells_to_update: List[CellUpdate] = field(default_factory=list)
+
+    @property
+    def is_empty(self) -> bool:
+        return not (self.rows_to_delete or self.rows_to_append or self.cells_to_update)
+
+    def to_requests(self) -> Iterator[List[JsonDict]]:
+        """Return the Sheets API requests of each batch update
+
+        Cells are updated before deleting rows, so that row numbers still match. All
+        changes go in a single batch update, unless there are more than
+        ``MAX_ROWS_PER_BATCH`` rows to append.
+        """
+        requests: List[JsonDict] = []
+        for row_number, column_number, cell in self.cells_to_update:
+            update = {
+                "updateCells": {
+                    "start": {
+                        "sheetId": self.sheet.id,
+                        "rowIndex": row_number - 1,
+                        "columnIndex": column_number - 1,
+                    },
+                    "rows": [row_to_row_data([cell])],
+                    "fields": "userEnteredValue",
+                }
+            }
+            requests.append(update)
+
+        if self.rows_to_delete:
+            start, end = self.rows_to_delete
+            delete = {
+                "deleteDimension": {
+                    "range": {
+                        "sheetId": self.sheet.id,
+                        "dimension": "ROWS",
+                        "startIndex": start - 1,  # 0-based, inclusive
+                        "endIndex": end,  # 0-based, exclusive
+                    }
+                }
+            }
+            requests.append(delete)
+
+        rows = self.rows_to_append
+        for chunk_start in range(0, len(rows), MAX_ROWS_PER_BATCH):
+            chunk_end = chunk_start + MAX_ROWS_PER_BATCH
+            chunk = rows[chunk_start:chunk_end]
+            append = {
+                "appendCells": {
+                    "sheetId": self.sheet.id,
+                    "rows": [row_to_row_data(row) for row in chunk],
+                    "fields": "userEnteredValue",
+                }
+            }
+            requests.append(append)
+            yield requests
+            requests = []
+
+        if requests:
+            yield requests
+
+
+MAX_ROWS_PER_BATCH = 5000
+
+
+def cell_to_cell_data(cell: GSheetCell) -> JsonDict:
+    # bool is a subclass of int, hence check it first
+    if isinstance(cell, bool):
+        return {"userEnteredValue": {"boolValue": cell}}
+    if isinstance(cell, int):
+        return {"userEnteredValue": {"numberValue": cell}}
+    return {"userEnteredValue": {"stringValue": cell}}
+
+
+def row_to_row_data(row: GSheetRow) -> JsonDict:
+    return {"values": [cell_to_cell_data(cell) for cell in row]}
+
+
+def is_same_value(cell: GSheetCell, value: GSheetValue) -> bool:
+    """Return True if ``value``, read unformatted, is what writing ``cell`` stored"""
+    # bool is a subclass of int, hence True would otherwise equal 1
+    if isinstance(cell, bool) or isinstance(value, bool):
+        return cell is value
+    return cell == value
+
+
+def diff_worksheet_update(
+    update: WorksheetUpdate, snapshot: WorksheetSnapshot
+) -> WorksheetUpdate:
+    """Turn a delete-and-reappend update into one that only writes changed cells
+
+    The rows planned for deletion are compared with the rows planned to be appended
+    in their place: matching rows are left untouched, differing cells are updated,
+    and only surplus rows are deleted or appended.
+    """
+    if update.rows_to_delete is None:
+        return update
+
+    start, end = update.rows_to_delete
+    rows = update.rows_to_append
+    existing_amount = end - start + 1
+    overlap = min(existing_amount, len(rows))
+
+    cells_to_update: List[CellUpdate] = []
+    for offset in range(overlap):
+        row_number = start + offset
+        existing_row = snapshot.row(row_number)
+        for column_index, cell in enumerate(rows[offset]):
+            existing = (
+                existing_row[column_index] if column_index < len(existing_row) else ""
+            )
+            if not is_same_value(cell, existing):
+                column_number = column_index_to_number(column_index)
+                cells_to_update.append((row_number, column_number, cell))
+
+    rows_to_delete: Optional[Tuple[RowNumber, RowNumber]] = None
+    if existing_amount > overlap:
+        rows_to_delete = (start + overlap, end)
+
+    return WorksheetUpdate(
+        sheet=update.sheet,
+        alias=update.alias,
+        rows_to_delete=rows_to_delete,
+        rows_to_append=rows[overlap:],
+        cells_to_update=cells_to_update,
+    )
 
-    sorted_stats = sorted(stats, key=lambda s: s.date)
 
-    # "checked": a project is "checked" if the program has already inspected the GSheet
-    # tab of the project and deleted the last row/entry in that tab.
-    #
-    # Each stat specifies the Toggl project it belongs to, but the stats list is not
-    # sorted per project, which means that if you don't track if you have already
-    # "checked" a project or not, you might end up deleting the "last" row multiple
-    # times (aka, you delete mulitple bottom lines when you should only delete the last
-    # one).
-    checked_projects: Dict[ProjectAlias, datetime.date] = {}
-    invoiced_per_project: Dict[ProjectAlias, bool] = {}
+def apply_worksheet_update(spreadsheet: Spreadsheet, update: WorksheetUpdate) -> None:
+    limiter = get_rate_limiter()
+    for requests in update.to_requests():
+        limiter.batch_update(spreadsheet, requests)
 
-    for project_stats in sorted_stats:
-        alias = project_stats.alias
 
-        # Get worksheet
-        if alias not in name_to_index:
-            # TODO: create sheet automatically
-            raise NotImplementedError("create sheet manually for the time being")
-        worksheet_index = name_to_index[alias]
-        sheet = spreadsheet.get_worksheet(worksheet_index)
-
-        # Check if the last recorded entry has already been invoiced
-        last_invoiced_row_already_inspected = alias in invoiced_per_project
-        if not append_only and not last_invoiced_row_already_inspected:
-            last_row_was_invoiced = check_if_last_row_invoiced(sheet)
-            invoiced_per_project[alias] = last_row_was_invoiced
-        else:
-            last_row_was_invoiced = invoiced_per_project[alias]
+def plan_worksheet_update(
+    sheet: Worksheet,
+    alias: ProjectAlias,
+    stats: List[ProjectDailyStats],
+    append_only: bool,
+    diff: bool,
+) -> WorksheetUpdate:
+    """Plan the changes of a single worksheet - stats must be sorted by date"""
+    update = WorksheetUpdate(sheet=sheet, alias=alias)
 
+    snapshot: Optional[WorksheetSnapshot] = None
+    if append_only:
+        cut_date = MIN_DATE
+    else:
         # Delete all entries from the last recorded day, as it might be partially
         # uploaded, and reupload that day and any following days
         # Do not delete if last recorded day was already invoiced
-        must_delete_rows_with_last_date = (
-            alias not in checked_projects and append_only is False
-        )
-        if append_only is True and alias not in checked_projects:
-            checked_projects[alias] = MIN_DATE
-        if must_delete_rows_with_last_date:
-            if last_row_was_invoiced:
-                # do not delete last date rows, just append after the last date
-                last_date = find_last_date(sheet)
-                cut_date = last_date + datetime.timedelta(days=1)
-            else:
-                cut_date = delete_rows_with_last_date(sheet)
-                print(f"Deleted {cut_date} entries for {alias!r}")
-            checked_projects[alias] = cut_date
+        snapshot = take_snapshot(sheet)
+        last_date = find_last_date(snapshot)
+        if last_date == MIN_DATE:
+            # no date found, hence do not delete anything
+            cut_date = last_date
+        elif check_if_last_row_invoiced(snapshot):
+            # do not delete last date rows, just append after the last date
+            cut_date = last_date + datetime.timedelta(days=1)
         else:
-            cut_date = checked_projects[alias]
+            cut_date = last_date
+            update.rows_to_delete = find_last_date_rows_range(snapshot)
+            print(f"Deleting {cut_date} entries for {alias!r}")
 
+    for project_stats in stats:
         if project_stats.date < cut_date:
             print(f"Skipping {project_stats.date} for {alias!r}")
             continue
 
-        new_rows = list(stats_to_cells(project_stats))
-
         print(f"Appending {project_stats.date} for {alias!r}")
-        sheet.append_rows(new_rows)
+        update.rows_to_append.extend(stats_to_cells(project_stats))
+
+    if diff and snapshot is not None:
+        update = diff_worksheet_update(update, snapshot)
+
+    return update
+
+
+def upload_worksheet(
+    spreadsheet: Spreadsheet,
+    sheet: Worksheet,
+    alias: ProjectAlias,
+    stats: List[ProjectDailyStats],
+    append_only: bool,
+    diff: bool,
+) -> None:
+    update = plan_worksheet_update(sheet, alias, stats, append_only, diff)
+    if update.is_empty:
+        print(f"Nothing to update in {alias!r} worksheet")
+        return
+
+    print(f"Updating {alias!r} worksheet...")
+    apply_worksheet_update(spreadsheet, update)
+    print(f"{alias!r} worksheet updated")
+
+
+class WorksheetUploadFailed(Exception):
+    def __init__(self, errors: Dict[ProjectAlias, BaseException]) -> None:
+        self.errors = errors
+        failed = ", ".join(repr(alias) for alias in errors)
+        super().__init__(f"Failed to update the worksheets of {failed}")
+
+
+def group_stats_per_alias(
+    stats: Iterable[ProjectDailyStats],
+) -> Dict[ProjectAlias, List[ProjectDailyStats]]:
+    """Group stats per project alias, keeping their order"""
+    grouped: Dict[ProjectAlias, List[ProjectDailyStats]] = {}
+    for project_stats in stats:
+        grouped.setdefault(project_stats.alias, []).append(project_stats)
+    return grouped
+
+
+def upload_to_gsheet(
+    stats: List[ProjectDailyStats],
+    append_only: bool,
+    diff: bool = False,
+) -> None:
+    """Upload stats to the GSheet - stats must be sorted by date
+
+    Each project has its own worksheet, hence worksheets are read, planned and
+    updated concurrently. Each worksheet is read once, into a ``WorksheetSnapshot``,
+    and its changes are then applied with a single batch update. With ``diff``, only
+    the cells that differ from the worksheet are written, so a run without changes
+    makes no writes.
+
+    A failure in one worksheet does not stop the others: failures are collected and
+    raised together, per project, once every worksheet is done.
+    """
+    client = get_sheet_client()
+    config = get_config()
+
+    limiter = get_rate_limiter()
+
+    spreadsheet = limiter.read(client.open_by_url, config.gsheet_url)
+    sheets = get_sheets_by_name(spreadsheet)
+
+    stats_per_alias = group_stats_per_alias(stats)
+    for alias in stats_per_alias:
+        if alias not in sheets:
+            # TODO: create sheet automatically
+            raise NotImplementedError("create sheet manually for the time being")
+
+    if not stats_per_alias:
+        return
+
+    max_workers = min(config.gsheet_client.max_workers, len(stats_per_alias))
+    errors: Dict[ProjectAlias, BaseException] = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            alias: executor.submit(
+                upload_worksheet,
+                spreadsheet,
+                sheets[alias],
+                alias,
+                alias_stats,
+                append_only,
+                diff,
+            )
+            for alias, alias_stats in stats_per_alias.items()
+        }
+        for alias, future in futures.items():
+            error = future.exception()
+            if error is not None:
+                print(f"Failed to update {alias!r} worksheet: {error}")
+                errors[alias] = error
+
+    logger.info(f"Sheets client stats: {limiter.stats}")
+    print(f"Waited {limiter.stats.seconds_waited:.1f}s on Google Sheets API quota")
+
+    if errors:
+        raise WorksheetUploadFailed(errors)
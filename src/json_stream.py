@@ -0,0 +1,62 @@
+import codecs
+import json
+from typing import Any, Iterable, Iterator
+
+WHITESPACE = " \t\n\r"
+
+
+class TruncatedJsonArray(Exception):
+    ...
+
+
+def iter_json_array(chunks: Iterable[bytes]) -> Iterator[Any]:
+    """Decode a JSON array incrementally and yield its items as soon as they arrive
+
+    Only the item being decoded is kept in memory, hence memory usage does not depend on
+    the size of the array.
+    """
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder("utf-8")()
+    buffer = ""
+    started = False
+
+    for chunk in chunks:
+        buffer += utf8.decode(chunk)
+        position = 0
+        while True:
+            while position < len(buffer) and buffer[position] in WHITESPACE:
+                position += 1
+            if position == len(buffer):
+                break
+
+            char = buffer[position]
+            if not started:
+                if char != "[":
+                    raise ValueError(f"Expected a JSON array, got {char!r}")
+                started = True
+                position += 1
+                continue
+
+            if char == ",":
+                position += 1
+                continue
+
+            if char == "]":
+                return
+
+            try:
+                item, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                # Item not fully received yet
+                break
+
+            if end == len(buffer) and not isinstance(item, (dict, list)):
+                # Scalars like numbers might continue in the next chunk
+                break
+
+            yield item
+            position = end
+
+        buffer = buffer[position:]
+
+    raise TruncatedJsonArray("JSON array ended before its closing bracket")
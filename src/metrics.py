@@ -0,0 +1,87 @@
+"""Time spent per stage and counters of API calls and cache rows, per run"""
+import contextlib
+import json
+import logging
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, Optional, TypeVar, Union
+
+from src.types import JsonDict
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+Amount = Union[int, float]
+
+
+class Metrics:
+    """Timing spans and counters, safe to update from several threads
+
+    Spans with the same name add up, so a stage that runs several times reports its
+    total time.
+    """
+
+    def __init__(self) -> None:
+        self.spans: Dict[str, float] = {}
+        self.counters: Dict[str, Amount] = {}
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def span(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            logger.info(f"{name} took {elapsed:.3f}s")
+            with self._lock:
+                self.spans[name] = self.spans.get(name, 0) + elapsed
+
+    def count(self, name: str, amount: Amount = 1) -> None:
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def count_items(self, name: str, items: Iterable[T]) -> Iterator[T]:
+        """Yield ``items``, counting them once they are all yielded"""
+        amount = 0
+        try:
+            for item in items:
+                amount += 1
+                yield item
+        finally:
+            self.count(name, amount)
+
+    def to_json(self) -> JsonDict:
+        with self._lock:
+            return {
+                "spans": {
+                    name: round(seconds, 6) for name, seconds in self.spans.items()
+                },
+                "counters": dict(sorted(self.counters.items())),
+            }
+
+    def log(self) -> None:
+        report = self.to_json()
+        for name, seconds in report["spans"].items():
+            logger.info(f"span {name}: {seconds:.3f}s")
+        for name, amount in report["counters"].items():
+            logger.info(f"counter {name}: {amount}")
+
+    def save(self, path: Path) -> None:
+        path.write_text(json.dumps(self.to_json(), indent=2))
+
+
+_CACHED_METRICS: Optional[Metrics] = None
+
+
+def get_metrics() -> Metrics:
+    global _CACHED_METRICS
+    if _CACHED_METRICS:
+        return _CACHED_METRICS
+
+    metrics = Metrics()
+
+    _CACHED_METRICS = metrics
+
+    return metrics
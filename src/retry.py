@@ -0,0 +1,46 @@
+"""Backoff policy shared by the Toggl and Google Sheets clients"""
+import datetime
+import email.utils
+import random
+from typing import Optional, Protocol
+
+
+class BackoffSettings(Protocol):
+    backoff_factor: float  # seconds, doubled on every retry
+    max_backoff: float  # seconds
+
+
+def get_backoff(
+    settings: BackoffSettings,
+    attempt: int,
+    retry_after: Optional[str],
+) -> float:
+    """Return seconds to wait before retrying: exponential backoff with full jitter
+
+    If the server specifies a Retry-After header, wait at least that long.
+    """
+    cap = min(settings.max_backoff, settings.backoff_factor * 2**attempt)
+    backoff = random.uniform(0, cap)
+    return max(backoff, parse_retry_after(retry_after))
+
+
+def parse_retry_after(value: Optional[str]) -> float:
+    """Return seconds to wait according to a Retry-After header value
+
+    The header holds either an amount of seconds or an HTTP date.
+    """
+    if not value:
+        return 0
+
+    try:
+        return max(0, float(value))
+    except ValueError:
+        pass
+
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return 0
+
+    now = datetime.datetime.now(tz=retry_at.tzinfo)
+    return max(0, (retry_at - now).total_seconds())
@@ -0,0 +1,320 @@
+from __future__ import annotations
+
+import csv
+import dataclasses
+import datetime
+import gzip
+import json
+import os
+import shutil
+import tempfile
+from dataclasses import dataclass
+from pathlib import Path
+from typing import IO, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from src.compaction import (
+    CompactionReport,
+    deduplicate_entries,
+    get_size,
+    read_all,
+    time_full_read,
+)
+from src.csv_cache import (
+    ProjectMap,
+    entry_to_csv_line,
+    is_in_time_range,
+    read_lines,
+    table_row_to_entry,
+)
+from src.filesystem import FileLock
+from src.timestamps import from_epoch, to_epoch
+from src.types import EpochSeconds, TimeRange, TogglProjectId, TogglTimeEntry
+
+Month = str  # YYYY-MM, in UTC
+
+MANIFEST_FILE = "manifest.json"
+
+
+@dataclass
+class Segment:
+    """Entries that started in a given month, kept in a CSV file
+
+    Only the segment of the latest month is open: it is appended to, and ``size`` tells
+    how many of its bytes hold complete rows. The rest are closed: they are sorted,
+    without duplicated entries, optionally compressed, and only replaced as a whole.
+    """
+
+    month: Month
+    file: str
+    first_start: EpochSeconds
+    last_start: EpochSeconds
+    rows: int
+    size: int
+    closed: bool
+    sorted: bool = True
+
+    def overlaps(self, time_range: Optional[TimeRange]) -> bool:
+        if time_range is None:
+            return True
+        if self.last_start < to_epoch(time_range.after):
+            return False
+        until = time_range.until
+        return until is None or self.first_start <= to_epoch(until)
+
+
+Manifest = Dict[Month, Segment]
+
+
+def get_month(entry: TogglTimeEntry) -> Month:
+    return from_epoch(to_epoch(entry.start)).strftime("%Y-%m")
+
+
+def group_by_month(
+    entries: Iterable[TogglTimeEntry],
+) -> Dict[Month, List[TogglTimeEntry]]:
+    months: Dict[Month, List[TogglTimeEntry]] = {}
+    for entry in entries:
+        if entry.stop is None:
+            # Ongoing time entry, just ignore it
+            continue
+        months.setdefault(get_month(entry), []).append(entry)
+    return months
+
+
+class SegmentedEntryCache:
+    """Directory of CSV files, one per month, listed in ``manifest.json``
+
+    The manifest keeps the time range of each segment, so reads only open the segments
+    that overlap the requested time range, and the last start is known without reading
+    any segment.
+
+    Entries are written to the segment of the latest month. Once entries of a later
+    month are written, that segment is closed: it is sorted, deduplicated and, unless
+    disabled, compressed. Writing entries of a closed month, e.g. when fetching older
+    entries, rewrites that month's segment only.
+
+    Several processes can share the cache: writes take an exclusive lock, and reads only
+    take a shared lock while opening the segments, to read the rows written until then.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        projects: Optional[ProjectMap] = None,
+        compress: bool = True,
+    ) -> None:
+        self.path = path
+        self.projects = projects or {}
+        self.compress = compress
+        self.manifest_path = path / MANIFEST_FILE
+        # Outside of the cache directory, as removing the cache deletes the directory
+        self.lock = FileLock(path.with_name(f"{path.name}.lock"))
+
+    def _load_manifest(self) -> Manifest:
+        if self.manifest_path.exists() is False:
+            return {}
+
+        raw = json.loads(self.manifest_path.read_text())
+        segments = [Segment(**segment) for segment in raw["segments"]]
+        return {segment.month: segment for segment in segments}
+
+    def _save_manifest(self, manifest: Manifest) -> None:
+        raw = {
+            "segments": [
+                dataclasses.asdict(segment) for _, segment in sorted(manifest.items())
+            ]
+        }
+        self._replace(self.manifest_path, json.dumps(raw, indent=2).encode())
+
+    def _replace(self, path: Path, content: bytes) -> None:
+        """Write ``path`` atomically, so readers never see it half written"""
+        fd, tmp_path = tempfile.mkstemp(dir=self.path, prefix=f".{path.name}.")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(content)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+
+    def _open_segments(
+        self,
+        time_range: Optional[TimeRange],
+    ) -> List[Tuple[Segment, IO[bytes]]]:
+        """Open the segments that overlap ``time_range``, oldest first
+
+        Closed segments are replaced rather than rewritten, and files already open keep
+        reading the previous version.
+        """
+        with self.lock.shared():
+            manifest = self._load_manifest()
+            return [
+                (segment, (self.path / segment.file).open("rb"))
+                for _, segment in sorted(manifest.items())
+                if segment.overlaps(time_range)
+            ]
+
+    def _read_segment(self, segment: Segment, f: IO[bytes]) -> Iterator[TogglTimeEntry]:
+        projects = dict(self.projects)
+        with f:
+            if segment.file.endswith(".gz"):
+                lines: Iterator[str] = (
+                    line.decode() for line in gzip.GzipFile(fileobj=f)
+                )
+            else:
+                lines = read_lines(f, segment.size)
+
+            for row in csv.reader(lines):
+                yield table_row_to_entry(row, projects)  # type: ignore
+
+    def load(self) -> Iterator[TogglTimeEntry]:
+        yield from self.read()
+
+    def read(
+        self,
+        time_range: Optional[TimeRange] = None,
+        pid: Optional[TogglProjectId] = None,
+    ) -> Iterator[TogglTimeEntry]:
+        segments = self._open_segments(time_range)
+        try:
+            for segment, f in segments:
+                for entry in self._read_segment(segment, f):
+                    if pid is not None and entry.project.id != pid:
+                        continue
+                    if is_in_time_range(entry, time_range):
+                        yield entry
+        finally:
+            for _, f in segments:
+                f.close()
+
+    def last_start(self) -> Optional[datetime.datetime]:
+        with self.lock.shared():
+            manifest = self._load_manifest()
+
+        if not manifest:
+            return None
+
+        return from_epoch(max(segment.last_start for segment in manifest.values()))
+
+    def _write_segment(
+        self,
+        month: Month,
+        entries: List[TogglTimeEntry],
+        closed: bool,
+    ) -> Segment:
+        """Write a sorted and deduplicated segment, replacing any previous one"""
+        entries = deduplicate_entries(entries)
+        content = b"".join(entry_to_csv_line(entry) for entry in entries)
+        file = f"{month}.csv"
+        if closed and self.compress:
+            file = f"{file}.gz"
+            # No timestamp in the header, so that equal segments are equal files
+            content = gzip.compress(content, mtime=0)
+
+        self._replace(self.path / file, content)
+        return Segment(
+            month=month,
+            file=file,
+            first_start=to_epoch(entries[0].start),
+            last_start=to_epoch(entries[-1].start),
+            rows=len(entries),
+            size=len(content),
+            closed=closed,
+        )
+
+    def _append(self, segment: Segment, entries: List[TogglTimeEntry]) -> None:
+        starts = [to_epoch(entry.start) for entry in entries]
+        if min(starts) <= segment.last_start:
+            segment.sorted = False
+
+        with (self.path / segment.file).open("ab") as f:
+            f.seek(segment.size)
+            # Drop any row left half written by an interrupted write
+            f.truncate()
+            for entry in entries:
+                f.write(entry_to_csv_line(entry))
+            segment.size = f.tell()
+
+        segment.first_start = min(segment.first_start, *starts)
+        segment.last_start = max(segment.last_start, *starts)
+        segment.rows += len(entries)
+
+    def write(self, entries: List[TogglTimeEntry]) -> None:
+        with self.lock.exclusive():
+            self.path.mkdir(parents=True, exist_ok=True)
+            manifest = self._load_manifest()
+            for month, month_entries in sorted(group_by_month(entries).items()):
+                segment = manifest.get(month)
+                latest = max(manifest) if manifest else None
+                if segment is not None and segment.closed is False:
+                    self._append(segment, month_entries)
+                elif latest is None or latest < month:
+                    if latest is not None:
+                        manifest[latest] = self._close(manifest[latest])
+                    manifest[month] = self._write_segment(
+                        month, month_entries, closed=False
+                    )
+                else:
+                    if segment is not None:
+                        month_entries = [*self._read_closed(segment), *month_entries]
+                    manifest[month] = self._write_segment(
+                        month, month_entries, closed=True
+                    )
+
+            self._save_manifest(manifest)
+            self._remove_unused(manifest)
+
+    def _read_closed(self, segment: Segment) -> Iterator[TogglTimeEntry]:
+        return self._read_segment(segment, (self.path / segment.file).open("rb"))
+
+    def _close(self, segment: Segment) -> Segment:
+        if segment.closed:
+            return segment
+        entries = list(self._read_closed(segment))
+        return self._write_segment(segment.month, entries, closed=True)
+
+    def _remove_unused(self, manifest: Manifest) -> None:
+        # Only once the manifest no longer points to them
+        used = {segment.file for segment in manifest.values()}
+        for path in self.path.glob("*.csv*"):
+            if path.name not in used:
+                path.unlink()
+
+    def needs_compaction(self) -> bool:
+        with self.lock.shared():
+            manifest = self._load_manifest()
+        return any(segment.sorted is False for segment in manifest.values())
+
+    def compact(self) -> CompactionReport:
+        """Rewrite every segment sorted by start date and without duplicated entries
+
+        Duplicated entries are removed across segments too, in case an entry was moved
+        to another month.
+        """
+        with self.lock.exclusive():
+            bytes_before = get_size(self.path)
+            entries, read_seconds_before = read_all(self.load)
+            compacted = deduplicate_entries(entries)
+
+            months = group_by_month(compacted)
+            latest = max(months, default=None)
+            manifest = {
+                month: self._write_segment(month, month_entries, closed=month != latest)
+                for month, month_entries in months.items()
+            }
+            self._save_manifest(manifest)
+            self._remove_unused(manifest)
+
+        return CompactionReport(
+            rows_before=len(entries),
+            rows_after=len(compacted),
+            bytes_before=bytes_before,
+            bytes_after=get_size(self.path),
+            read_seconds_before=read_seconds_before,
+            read_seconds_after=time_full_read(self.load),
+        )
+
+    def remove(self) -> None:
+        # The lock file stays, other processes might be waiting on it
+        with self.lock.exclusive():
+            shutil.rmtree(self.path, ignore_errors=True)
@@ -0,0 +1,462 @@
+from __future__ import annotations
+
+import contextlib
+import datetime
+import itertools
+import logging
+import sqlite3
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from src.compaction import CompactionReport, get_size, read_all, time_full_read
+from src.csv_cache import CsvEntryCache, ProjectMap
+from src.timestamps import from_epoch, to_epoch
+from src.types import (
+    EntrySummary,
+    EpochSeconds,
+    Project,
+    ProjectDailyStats,
+    TimeRange,
+    TogglEntryId,
+    TogglProjectId,
+    TogglTimeEntry,
+)
+
+logger = logging.getLogger(__name__)
+
+SECONDS_PER_DAY = 24 * 60 * 60
+EPOCH_DATE = datetime.date(1970, 1, 1)
+
+# Deleted and updated rows leave free pages behind, worth reclaiming once they are a
+# sizeable share of a database that is not tiny
+MAX_FREE_PAGES_RATIO = 0.25
+MIN_PAGES_TO_COMPACT = 256
+# Seconds to wait for other processes to finish writing before giving up
+BUSY_TIMEOUT = 60
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS projects (
+    id INTEGER PRIMARY KEY,
+    alias TEXT NOT NULL,
+    start_date TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS entries (
+    id INTEGER PRIMARY KEY,
+    project_id INTEGER NOT NULL REFERENCES projects (id),
+    description TEXT NOT NULL,
+    start INTEGER NOT NULL,
+    stop INTEGER NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS entries_project_id_start ON entries (project_id, start);
+CREATE INDEX IF NOT EXISTS entries_start ON entries (start);
+
+-- Materialised view of the total duration per project, day and description, kept up
+-- to date as entries are written or deleted
+CREATE TABLE IF NOT EXISTS daily_totals (
+    project_id INTEGER NOT NULL,
+    day INTEGER NOT NULL,  -- days since epoch, in UTC
+    description TEXT NOT NULL,
+    duration INTEGER NOT NULL,
+    first_start INTEGER NOT NULL,
+    PRIMARY KEY (project_id, day, description)
+);
+
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+WATERMARK_KEY = "sync_watermark"
+COVERED_SINCE_KEY = "covered_since"
+DAILY_TOTALS_KEY = "daily_totals_built"
+
+REFRESH_DAILY_TOTALS = [
+    "DELETE FROM daily_totals WHERE project_id = :project_id AND day = :day",
+    """
+    INSERT INTO daily_totals (project_id, day, description, duration, first_start)
+    SELECT project_id, :day, description, SUM(stop - start), MIN(start)
+    FROM entries
+    WHERE project_id = :project_id
+        AND start >= :day * 86400
+        AND start < :next_day * 86400
+    GROUP BY description
+    """,
+]
+
+BUILD_DAILY_TOTALS = [
+    "DELETE FROM daily_totals",
+    """
+    INSERT INTO daily_totals (project_id, day, description, duration, first_start)
+    SELECT project_id, start / 86400, description, SUM(stop - start), MIN(start)
+    FROM entries
+    GROUP BY project_id, start / 86400, description
+    """,
+]
+
+# SQLite limits the amount of parameters per query
+MAX_PARAMETERS = 500
+
+UPSERT_PROJECT = """
+INSERT INTO projects (id, alias, start_date) VALUES (?, ?, ?)
+ON CONFLICT (id) DO UPDATE SET alias = excluded.alias, start_date = excluded.start_date
+"""
+
+UPSERT_ENTRY = """
+INSERT INTO entries (id, project_id, description, start, stop) VALUES (?, ?, ?, ?, ?)
+ON CONFLICT (id) DO UPDATE SET
+    project_id = excluded.project_id,
+    description = excluded.description,
+    start = excluded.start,
+    stop = excluded.stop
+"""
+
+EntryRow = Tuple[int, TogglProjectId, str, int, int]
+DayNumber = int  # days since epoch, in UTC
+ProjectDay = Tuple[TogglProjectId, DayNumber]
+
+
+class SqliteEntryCache:
+    """SQLite database with entries indexed by project and start date
+
+    Entries are upserted by Toggl entry id, so writing the same entry twice updates it
+    instead of duplicating it.
+
+    The total duration per project, day and description is kept in a materialised view
+    that is updated whenever entries are written or deleted. Only the days touched by
+    the change are recomputed.
+
+    If a legacy CSV cache is found, its entries are imported the first time the
+    database is opened and the CSV file is renamed so that it is not imported again.
+
+    Upserts never duplicate entries, so compacting only reclaims the free pages left by
+    updated and deleted rows.
+
+    The database is kept in write-ahead log mode, so that several processes can read it
+    while another one writes to it.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        legacy_csv_path: Optional[Path] = None,
+        projects: Optional[ProjectMap] = None,
+    ) -> None:
+        self.path = path
+        self.legacy_csv_path = legacy_csv_path
+        # Aliases are taken from here rather than from the database, as they might have
+        # been renamed since the project was last written
+        self.projects = projects or {}
+        self.wal_path = path.with_name(f"{path.name}-wal")
+        self._connection: Optional[sqlite3.Connection] = None
+        self._projects: Dict[TogglProjectId, Project] = {}
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        if self._connection is None:
+            self._connection = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT)
+            self._connection.execute("PRAGMA journal_mode = WAL")
+            self._connection.executescript(SCHEMA)
+            self._migrate_legacy_csv()
+            self._build_daily_totals()
+        return self._connection
+
+    def close(self) -> None:
+        if self._connection is None:
+            return
+
+        self._connection.close()
+        self._connection = None
+        self._projects = {}
+
+    def _migrate_legacy_csv(self) -> None:
+        csv_path = self.legacy_csv_path
+        if csv_path is None or csv_path.exists() is False:
+            return
+
+        legacy_cache = CsvEntryCache(path=csv_path, projects=self.projects)
+        with legacy_cache.lock.exclusive():
+            # Another process might have migrated it while waiting for the lock
+            if csv_path.exists() is False:
+                return
+
+            logger.info(f"Migrating legacy cache {csv_path} to {self.path}")
+            self.write(list(legacy_cache.load()))
+
+            backup_path = csv_path.with_name(f"{csv_path.name}.bak")
+            csv_path.rename(backup_path)
+            logger.info(f"Legacy cache moved to {backup_path}")
+
+    def _build_daily_totals(self) -> None:
+        """Build the daily totals view of databases created before it existed"""
+        if self._get_meta(DAILY_TOTALS_KEY) is not None:
+            return
+
+        with self.connection as connection:
+            for statement in BUILD_DAILY_TOTALS:
+                connection.execute(statement)
+            self._set_meta(DAILY_TOTALS_KEY, "1")
+
+    @contextlib.contextmanager
+    def _write_transaction(self) -> Iterator[sqlite3.Connection]:
+        """Take the write lock before the first read of the transaction
+
+        Otherwise another process could change the entries read before writing, and
+        the daily totals refreshed from them would go stale.
+        """
+        with self.connection as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            yield connection
+
+    def _find_days(self, ids: List[TogglEntryId]) -> Set[ProjectDay]:
+        """Return project and day of the cached entries with the given ids"""
+        days: Set[ProjectDay] = set()
+        for i in range(0, len(ids), MAX_PARAMETERS):
+            batch_end = i + MAX_PARAMETERS
+            batch = ids[i:batch_end]
+            placeholders = ", ".join("?" * len(batch))
+            cursor = self.connection.execute(
+                "SELECT project_id, start / 86400 FROM entries"
+                f" WHERE id IN ({placeholders})",
+                batch,
+            )
+            days.update(cursor.fetchall())
+        return days
+
+    def _refresh_daily_totals(
+        self,
+        connection: sqlite3.Connection,
+        days: Set[ProjectDay],
+    ) -> None:
+        params = [
+            {"project_id": project_id, "day": day, "next_day": day + 1}
+            for project_id, day in sorted(days)
+        ]
+        for statement in REFRESH_DAILY_TOTALS:
+            connection.executemany(statement, params)
+
+    def _get_project(self, project_id: TogglProjectId) -> Project:
+        if project_id in self.projects:
+            return self.projects[project_id]
+
+        if project_id not in self._projects:
+            cursor = self.connection.execute(
+                "SELECT alias, start_date FROM projects WHERE id = ?",
+                (project_id,),
+            )
+            alias, start_date = cursor.fetchone()
+            self._projects[project_id] = Project(
+                id=project_id,
+                alias=alias,
+                start_date=datetime.datetime.fromisoformat(start_date),
+            )
+        return self._projects[project_id]
+
+    def _row_to_entry(self, row: EntryRow) -> TogglTimeEntry:
+        entry_id, project_id, description, start, stop = row
+        return TogglTimeEntry(
+            id=entry_id,
+            project=self._get_project(project_id),
+            description=description,
+            start=from_epoch(start),
+            stop=from_epoch(stop),
+        )
+
+    def load(self) -> Iterator[TogglTimeEntry]:
+        yield from self.read()
+
+    def read(
+        self,
+        time_range: Optional[TimeRange] = None,
+        pid: Optional[TogglProjectId] = None,
+    ) -> Iterator[TogglTimeEntry]:
+        conditions: List[str] = []
+        params: List[int] = []
+        if pid is not None:
+            conditions.append("project_id = ?")
+            params.append(pid)
+        if time_range is not None:
+            conditions.append("start >= ?")
+            params.append(to_epoch(time_range.after))
+            if time_range.until is not None:
+                conditions.append("stop <= ?")
+                params.append(to_epoch(time_range.until))
+
+        query = "SELECT id, project_id, description, start, stop FROM entries"
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += " ORDER BY start, id"
+
+        for row in self.connection.execute(query, params):
+            yield self._row_to_entry(row)
+
+    def last_start(self) -> Optional[datetime.datetime]:
+        cursor = self.connection.execute("SELECT MAX(start) FROM entries")
+        (last_start,) = cursor.fetchone()
+        if last_start is None:
+            return None
+
+        return from_epoch(last_start)
+
+    def write(self, entries: List[TogglTimeEntry]) -> None:
+        projects = {}
+        rows = []
+        for entry in entries:
+            if entry.stop is None:
+                # Ongoing time entry, just ignore it
+                continue
+            project = entry.project
+            projects[project.id] = project
+            rows.append(
+                (
+                    entry.id,
+                    project.id,
+                    entry.description,
+                    to_epoch(entry.start),
+                    to_epoch(entry.stop),
+                )
+            )
+
+        with self._write_transaction() as connection:
+            # Days where the entries were before being updated must be refreshed too
+            touched_days = self._find_days([row[0] for row in rows])
+            touched_days.update((row[1], row[3] // SECONDS_PER_DAY) for row in rows)
+
+            connection.executemany(
+                UPSERT_PROJECT,
+                [(p.id, p.alias, p.start_date.isoformat()) for p in projects.values()],
+            )
+            connection.executemany(UPSERT_ENTRY, rows)
+            self._refresh_daily_totals(connection, touched_days)
+
+        # Project aliases might have changed, so resolve them again on next read
+        self._projects = {}
+
+    def delete(self, ids: Iterable[TogglEntryId]) -> None:
+        ids = list(ids)
+        with self._write_transaction() as connection:
+            touched_days = self._find_days(ids)
+            connection.executemany(
+                "DELETE FROM entries WHERE id = ?",
+                [(entry_id,) for entry_id in ids],
+            )
+            self._refresh_daily_totals(connection, touched_days)
+
+    def read_daily_stats(
+        self,
+        time_range: Optional[TimeRange] = None,
+        pid: Optional[TogglProjectId] = None,
+    ) -> Iterator[ProjectDailyStats]:
+        """Return the stats of each project and day, sorted by date
+
+        Unlike ``read``, ``time_range`` is applied per whole day: days that overlap with
+        ``time_range`` are fully included.
+        """
+        conditions: List[str] = []
+        params: List[int] = []
+        if pid is not None:
+            conditions.append("project_id = ?")
+            params.append(pid)
+        if time_range is not None:
+            conditions.append("day >= ?")
+            params.append(to_epoch(time_range.after) // SECONDS_PER_DAY)
+            if time_range.until is not None:
+                conditions.append("day <= ?")
+                params.append(to_epoch(time_range.until) // SECONDS_PER_DAY)
+
+        query = "SELECT project_id, day, description, duration FROM daily_totals"
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += " ORDER BY day, project_id, first_start"
+
+        rows = self.connection.execute(query, params)
+        for (project_id, day), group in itertools.groupby(rows, key=lambda r: r[:2]):
+            yield ProjectDailyStats(
+                alias=self._get_project(project_id).alias,
+                date=EPOCH_DATE + datetime.timedelta(days=day),
+                entries=[
+                    EntrySummary(description=description, duration=duration)
+                    for _, _, description, duration in group
+                ],
+            )
+
+    def _get_meta(self, key: str) -> Optional[str]:
+        cursor = self.connection.execute(
+            "SELECT value FROM meta WHERE key = ?",
+            (key,),
+        )
+        row = cursor.fetchone()
+        if row is None:
+            return None
+
+        return row[0]
+
+    def _set_meta(self, key: str, value: str) -> None:
+        with self.connection as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                (key, value),
+            )
+
+    def get_watermark(self) -> Optional[EpochSeconds]:
+        """Return when entries were last synced with Toggl, if they ever were"""
+        watermark = self._get_meta(WATERMARK_KEY)
+        if watermark is None:
+            return None
+
+        return int(watermark)
+
+    def set_watermark(self, watermark: EpochSeconds) -> None:
+        self._set_meta(WATERMARK_KEY, str(watermark))
+
+    def get_covered_since(self) -> Optional[EpochSeconds]:
+        """Return since when every entry up to the watermark is cached, if known"""
+        covered_since = self._get_meta(COVERED_SINCE_KEY)
+        if covered_since is None:
+            return None
+
+        return int(covered_since)
+
+    def set_covered_since(self, covered_since: EpochSeconds) -> None:
+        self._set_meta(COVERED_SINCE_KEY, str(covered_since))
+
+    def needs_compaction(self) -> bool:
+        (page_count,) = self.connection.execute("PRAGMA page_count").fetchone()
+        (free_pages,) = self.connection.execute("PRAGMA freelist_count").fetchone()
+        return (
+            MIN_PAGES_TO_COMPACT <= page_count
+            and MAX_FREE_PAGES_RATIO < free_pages / page_count
+        )
+
+    def compact(self) -> CompactionReport:
+        """Rebuild the database file without free pages
+
+        VACUUM writes the database to a temporary copy before replacing it, so that an
+        interrupted compaction leaves the cache untouched.
+        """
+        bytes_before = get_size(self.path, self.wal_path)
+        entries, read_seconds_before = read_all(self.load)
+        self.connection.execute("VACUUM")
+        # The vacuumed database is written to the log first, move it to the database
+        self.connection.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        (rows_after,) = self.connection.execute(
+            "SELECT COUNT(*) FROM entries"
+        ).fetchone()
+
+        return CompactionReport(
+            rows_before=len(entries),
+            rows_after=rows_after,
+            bytes_before=bytes_before,
+            bytes_after=get_size(self.path, self.wal_path),
+            read_seconds_before=read_seconds_before,
+            read_seconds_after=time_full_read(self.load),
+        )
+
+    def remove(self) -> None:
+        self.close()
+        for suffix in ("", "-wal", "-shm"):
+            path = self.path.with_name(f"{self.path.name}{suffix}")
+            if path.exists():
+                path.unlink()
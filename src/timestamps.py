@@ -0,0 +1,16 @@
+import datetime
+
+from src.types import EpochSeconds
+
+UTC = datetime.timezone.utc
+
+
+def to_epoch(moment: datetime.datetime) -> EpochSeconds:
+    """Return seconds since epoch - naive datetimes are assumed to be in UTC"""
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=UTC)
+    return int(moment.timestamp())
+
+
+def from_epoch(seconds: EpochSeconds) -> datetime.datetime:
+    return datetime.datetime.fromtimestamp(seconds, tz=UTC)
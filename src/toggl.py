@@ -2,20 +2,67 @@ from __future__ import annotations
 
 import datetime
 import enum
-from pathlib import Path
-from typing import Dict, Iterator, List, Optional, Tuple, Union, cast
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, Tuple
 
 import requests
+from requests.adapters import HTTPAdapter
 from requests.auth import HTTPBasicAuth
 
-from src.config import TogglApiToken, get_config
-from src.types import JsonDict, Project, TimeRange, TogglProjectId, TogglTimeEntry
+from src.cache import (
+    SyncableEntryCache,
+    cache_entries,
+    find_cached_entries,
+    find_time_range_not_cached,
+    get_syncable_entry_cache,
+)
+from src.config import TogglApiToken, TogglClientConfig, get_config
+from src.json_stream import iter_json_array
+from src.metrics import get_metrics
+from src.retry import get_backoff
+from src.timestamps import from_epoch, to_epoch
+from src.types import (
+    EpochSeconds,
+    JsonDict,
+    Project,
+    TimeRange,
+    TogglEntryId,
+    TogglProjectId,
+    TogglTimeEntry,
+)
+
+logger = logging.getLogger(__name__)
 
 _CACHED_TOGGL_CLIENT: Optional[Toggl] = None
 
+# Responses worth retrying: rate limited or transient server errors
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+# The time entries endpoint returns at most this amount of entries per request
+MAX_ENTRIES_PER_REQUEST = 1000
+MIN_WINDOW_SPAN = datetime.timedelta(hours=1)
+
+STREAM_CHUNK_SIZE = 64 * 1024  # bytes
+CACHE_BATCH_SIZE = 1000  # entries written to the cache at once
+
+
+API_URL = "https://api.track.toggl.com/api/v8"
+
+# Toggl might take a while to make changes visible, so sync from a bit earlier than
+# the time of the previous sync
+SYNC_WATERMARK_MARGIN = 5 * 60  # seconds
+
+# The ``me`` endpoint only returns entries started in the last 9 days
+ME_SYNC_HORIZON = 9 * 24 * 60 * 60  # seconds
+
 
 class Endpoint(enum.Enum):
-    TIME_ENTRIES = "https://api.track.toggl.com/api/v8/time_entries"
+    ME = "me"
+    TIME_ENTRIES = "time_entries"
 
 
 class ProjectNotSupported(Exception):
@@ -24,67 +71,516 @@ class ProjectNotSupported(Exception):
     ...
 
 
+@dataclass
+class TogglClientStats:
+    requests: int = 0  # including retried requests
+    retries: int = 0
+    connections_opened: int = 0
+    seconds_waited: float = 0
+
+    @property
+    def reused_connections(self) -> int:
+        return self.requests - self.connections_opened
+
+
 class Toggl:  # TODO: rename to TogglClient
     _token: TogglApiToken
-
-    def __init__(self, token: TogglApiToken) -> None:
+    _session: requests.Session
+
+    def __init__(
+        self,
+        token: TogglApiToken,
+        settings: Optional[TogglClientConfig] = None,
+        api_url: str = API_URL,
+    ) -> None:
         self._token = token
-
-    def _get(self, endpoint: str, params: Dict) -> List[JsonDict]:
-        result = requests.get(
-            endpoint,
-            auth=HTTPBasicAuth(self._token, "api_token"),
-            params=params,
+        self._settings = settings or TogglClientConfig()
+        self._api_url = api_url
+        self.stats = TogglClientStats()
+        self._stats_lock = threading.Lock()
+
+        # Share one session across requests, so that connections are kept alive
+        self._adapter = HTTPAdapter(
+            pool_connections=self._settings.pool_connections,
+            pool_maxsize=self._settings.pool_maxsize,
         )
-        result.raise_for_status()
+        self._session = requests.Session()
+        self._session.mount("https://", self._adapter)
+        self._session.mount("http://", self._adapter)
+        self._session.auth = HTTPBasicAuth(self._token, "api_token")
+
+    def _count_connections_opened(self) -> int:
+        pools = self._adapter.poolmanager.pools
+        return sum(pools[key].num_connections for key in pools.keys())
+
+    def _request(
+        self,
+        endpoint: str,
+        params: Dict,
+        stream: bool = False,
+    ) -> requests.Response:
+        metrics = get_metrics()
+        attempt = 0
+        while True:
+            with self._stats_lock:
+                self.stats.requests += 1
+            metrics.count("toggl.requests")
+            retry_after: Optional[str] = None
+            try:
+                response = self._session.get(
+                    endpoint,
+                    params=params,
+                    timeout=self._settings.timeout,
+                    stream=stream,
+                )
+            except (requests.ConnectionError, requests.Timeout) as error:
+                if attempt >= self._settings.max_retries:
+                    raise
+                reason = repr(error)
+            else:
+                is_retriable = response.status_code in RETRY_STATUS_CODES
+                if not is_retriable or attempt >= self._settings.max_retries:
+                    response.raise_for_status()
+                    return response
+                reason = f"HTTP {response.status_code}"
+                retry_after = response.headers.get("Retry-After")
+                # Read the short error body of streamed responses too, so that their
+                # connection goes back to the pool to be reused by the retry
+                response.content
+                response.close()
+            finally:
+                with self._stats_lock:
+                    self.stats.connections_opened = self._count_connections_opened()
+
+            delay = get_backoff(self._settings, attempt, retry_after)
+            logger.info(f"Toggl request failed ({reason}), retrying in {delay:.1f}s")
+            with self._stats_lock:
+                self.stats.retries += 1
+                self.stats.seconds_waited += delay
+            metrics.count("toggl.retries")
+            metrics.count("toggl.seconds_waited", delay)
+            time.sleep(delay)
+            attempt += 1
+
+    def _url(self, endpoint: Endpoint) -> str:
+        return f"{self._api_url}/{endpoint.value}"
+
+    def _get(self, endpoint: str, params: Dict) -> Any:
+        result = self._request(endpoint, params)
+        get_metrics().count("toggl.bytes_received", len(result.content))
         return result.json()
 
-    def get_entries(self, tr: Optional[TimeRange] = None) -> Iterator[TogglTimeEntry]:
+    def _get_stream(self, endpoint: str, params: Dict) -> Iterator[JsonDict]:
+        """Yield the items of the returned JSON array while it is being downloaded"""
+        with self._request(endpoint, params, stream=True) as result:
+            chunks = result.iter_content(chunk_size=STREAM_CHUNK_SIZE)
+            yield from iter_json_array(count_bytes_received(chunks))
+
+    def get_entries(
+        self,
+        tr: Optional[TimeRange] = None,
+        pid: Optional[TogglProjectId] = None,
+    ) -> Iterator[TogglTimeEntry]:
         # https://github.com/toggl/toggl_api_docs/blob/master/chapters/time_entries.md
-        updated_tr, cached_entries = find_cached_entries(tr)
+        entry_cache = self._get_syncable_entry_cache()
+        if entry_cache and entry_cache.get_watermark() is not None:
+            self._sync_or_refetch(entry_cache, tr)
+            yield from get_metrics().count_items(
+                "cache.rows_read", entry_cache.read(tr, pid=pid)
+            )
+            return
+
+        updated_tr, cached_entries = find_cached_entries(tr, pid=pid)
         i = 0
         for i, cached_entry in enumerate(cached_entries):
             yield cached_entry
 
         print(f"{i} entries from cache...")
 
-        if updated_tr is None:
-            # Case when the cache has been deleted, only query from the earliest project
-            # date in the config, nothing more
-            config = get_config()
-            earliest_date = sorted(proj.start_date for proj in config.projects)[0]
-            updated_tr = TimeRange(after=earliest_date)
-
-        params = {"start_date": updated_tr.after.isoformat()}
-        if updated_tr.until:
-            params["end_date"] = updated_tr.until.isoformat()
-
-        data = self._get("https://api.track.toggl.com/api/v8/time_entries", params)
-        project_map = get_config().project_id_to_name_map
+        yield from self._fetch_and_cache(updated_tr, entry_cache)
+
+    def update_cache(self, tr: Optional[TimeRange] = None) -> None:
+        """Fetch new and changed entries into the cache, without reading cached ones"""
+        entry_cache = self._get_syncable_entry_cache()
+        if entry_cache and entry_cache.get_watermark() is not None:
+            self._sync_or_refetch(entry_cache, tr)
+            return
+
+        updated_tr = find_time_range_not_cached(tr)
+        for _ in self._fetch_and_cache(updated_tr, entry_cache):
+            pass
+
+    def _get_syncable_entry_cache(self) -> Optional[SyncableEntryCache]:
+        if not self._settings.incremental_sync:
+            return None
+
+        return get_syncable_entry_cache()
+
+    def _fetch_and_cache(
+        self,
+        updated_tr: Optional[TimeRange],
+        entry_cache: Optional[SyncableEntryCache],
+    ) -> Iterator[TogglTimeEntry]:
+        sync_started_at = get_sync_started_at()
+        time_range = get_time_range_to_fetch(updated_tr)
+        if self._settings.stream:
+            data = self._stream_time_entries(time_range)
+        else:
+            data = self._fetch_time_entries(time_range)
+
+        # Cache entries in batches, so that they are not all kept in memory
         entries_to_cache = []
-        for raw_time_entry in data:
-            try:
-                entry = _parse_toggl_entry(raw_time_entry, project_map)
-            except ProjectNotSupported:
-                # Toggl returns entries for all projects. It doesn't allow filtering per
-                # project. However, that doesn't mean you need to cache entries from
-                # projects you don't care about.
-                # pro: you save space in caching and reduce load/write time
-                # con: when adding a new project, you need to remove cache and fetch all
-                #      entries again - which is fine because it occurs very rarely
-                continue
+        for entry in parse_supported_entries(data):
             entries_to_cache.append(entry)
             yield entry
+            if len(entries_to_cache) >= CACHE_BATCH_SIZE:
+                cache_entries(entries_to_cache)
+                entries_to_cache = []
 
         cache_entries(entries_to_cache)
+        if entry_cache:
+            mark_fetched(entry_cache, time_range, sync_started_at)
+
+        reused = self.stats.reused_connections
+        logger.info(f"Toggl client stats: {self.stats}, {reused} reused connections")
+
+    def _sync_or_refetch(
+        self,
+        entry_cache: SyncableEntryCache,
+        tr: Optional[TimeRange],
+    ) -> None:
+        time_range = get_time_range_to_refetch(entry_cache, tr)
+        if time_range is None:
+            self.sync(entry_cache)
+            time_range = get_time_range_to_recheck(tr)
+            if time_range is None:
+                return
+
+        fetched = [entry.id for entry in self._fetch_and_cache(time_range, entry_cache)]
+        drop_entries_gone_from_toggl(entry_cache, time_range, fetched)
+
+    def sync(self, entry_cache: SyncableEntryCache) -> None:
+        """Update cached entries that were created, edited or deleted in Toggl since
+        the last sync
+        """
+        # https://github.com/toggl/toggl_api_docs/blob/master/chapters/users.md
+        sync_started_at = get_sync_started_at()
+        params = {
+            "with_related_data": "true",
+            "since": entry_cache.get_watermark(),
+        }
+        payload = self._get(self._url(Endpoint.ME), params)
+        apply_sync(entry_cache, payload, default_watermark=sync_started_at)
+
+    def _fetch_window(self, window: TimeRange) -> List[JsonDict]:
+        """Fetch entries in ``window``, splitting it if Toggl truncates the response"""
+        params = {"start_date": window.after.isoformat()}
+        if window.until:
+            params["end_date"] = window.until.isoformat()
+
+        data = self._get(self._url(Endpoint.TIME_ENTRIES), params)
+
+        halves = split_truncated_window(window, len(data))
+        if halves is None:
+            return data
+
+        first_half, second_half = halves
+        return self._fetch_window(first_half) + self._fetch_window(second_half)
+
+    def _fetch_time_entries(self, time_range: TimeRange) -> Iterator[JsonDict]:
+        """Fetch raw entries one month at a time, concurrently, sorted by start date"""
+        windows = split_time_range_per_month(time_range)
+
+        max_workers = self._settings.max_workers
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            # map() returns windows in order, even if they are fetched out of order
+            windows_data = executor.map(self._fetch_window, windows)
+            yield from sort_and_deduplicate(windows_data)
+
+    def _stream_window(
+        self,
+        window: TimeRange,
+        seen: Set[TogglEntryId],
+    ) -> Iterator[JsonDict]:
+        """Stream entries in ``window``, splitting it if Toggl truncates the response
+
+        Entries in ``seen`` are skipped, and yielded entries are added to it.
+        """
+        params = {"start_date": window.after.isoformat()}
+        if window.until:
+            params["end_date"] = window.until.isoformat()
+
+        amount = 0
+        url = self._url(Endpoint.TIME_ENTRIES)
+        for raw_entry in self._get_stream(url, params):
+            amount += 1
+            if raw_entry["id"] in seen:
+                continue
+            seen.add(raw_entry["id"])
+            yield raw_entry
+
+        halves = split_truncated_window(window, amount)
+        if halves is None:
+            return
+
+        # Entries already yielded from the truncated response are skipped
+        for half in halves:
+            yield from self._stream_window(half, seen)
+
+    def _stream_time_entries(self, time_range: TimeRange) -> Iterator[JsonDict]:
+        """Stream raw entries one month at a time, as they are downloaded
+
+        Unlike ``_fetch_time_entries``, windows are not fetched concurrently, so that
+        only the entry being decoded is held in memory.
+        """
+        seen: Set[TogglEntryId] = set()
+        for window in split_time_range_per_month(time_range):
+            yield from self._stream_window(window, seen)
+
+
+def count_bytes_received(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    received = 0
+    try:
+        for chunk in chunks:
+            received += len(chunk)
+            yield chunk
+    finally:
+        get_metrics().count("toggl.bytes_received", received)
+
+
+def get_sync_started_at() -> EpochSeconds:
+    now = datetime.datetime.now(tz=datetime.timezone.utc)
+    return to_epoch(now) - SYNC_WATERMARK_MARGIN
+
+
+def apply_sync(
+    entry_cache: SyncableEntryCache,
+    payload: JsonDict,
+    default_watermark: EpochSeconds,
+) -> None:
+    """Apply to the cache the changed entries returned by the ``me`` endpoint
+
+    {
+        "since": 1361258771,
+        "data": {
+            "time_entries": [
+                {"id": 436691234, "pid": 123, ..., "at": "2013-03-11T15:36:58+00:00"},
+                {"id": 436691235, ..., "server_deleted_at": "2013-03-12T09:00:00+00:00"}
+            ],
+            ...
+        }
+    }
+    """
+    raw_entries = (payload.get("data") or {}).get("time_entries") or []
+    project_map = get_config().project_id_to_name_map
+
+    changed: List[TogglTimeEntry] = []
+    deleted: List[TogglEntryId] = []
+    for raw_entry in raw_entries:
+        if raw_entry.get("server_deleted_at"):
+            deleted.append(raw_entry["id"])
+            continue
+
+        try:
+            entry = _parse_toggl_entry(raw_entry, project_map)
+        except ProjectNotSupported:
+            # The entry might have been moved out of a supported project
+            deleted.append(raw_entry["id"])
+            continue
+
+        if entry.ongoing:
+            # Ongoing entries are not cached, they will be synced once stopped
+            continue
+
+        changed.append(entry)
+
+    entry_cache.delete(deleted)
+    entry_cache.write(sorted(changed, key=lambda entry: entry.start))
+    metrics = get_metrics()
+    metrics.count("cache.rows_deleted", len(deleted))
+    metrics.count("cache.rows_written", len(changed))
+    entry_cache.set_watermark(payload.get("since") or default_watermark)
+    print(f"Synced {len(changed)} changed and {len(deleted)} deleted entries")
+
+
+def get_time_range_to_refetch(
+    entry_cache: SyncableEntryCache,
+    tr: Optional[TimeRange],
+) -> Optional[TimeRange]:
+    """Return the time range to fetch again, if syncing with ``me`` would miss entries
+
+    The ``me`` endpoint misses the entries changed while the cache was not synced for
+    longer than its horizon, and it never returns entries older than the cached ones.
+    """
+    watermark = entry_cache.get_watermark()
+    assert watermark is not None
+    after = to_epoch(get_time_range_to_fetch(tr).after)
+    covered_since = entry_cache.get_covered_since()
+
+    is_recent = get_sync_started_at() - ME_SYNC_HORIZON <= watermark
+    is_covered = covered_since is not None and covered_since <= after
+    if is_recent and is_covered:
+        return None
+
+    return TimeRange(after=from_epoch(min(watermark, after)))
+
+
+def get_time_range_to_recheck(
+    tr: Optional[TimeRange],
+    now: Optional[datetime.datetime] = None,
+) -> Optional[TimeRange]:
+    """Return the time range to fetch again after syncing with ``me``, if any
+
+    The ``me`` endpoint only returns entries that started within its horizon, so edits
+    to older entries, e.g. fixing last month before invoicing, would never be synced.
+    Entries since the start of the previous month are fetched again to catch those.
+    """
+    now = now or datetime.datetime.now(tz=datetime.timezone.utc)
+    horizon = from_epoch(to_epoch(now) - ME_SYNC_HORIZON)
+    month_start = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    previous_month_start = (month_start - datetime.timedelta(days=1)).replace(day=1)
+
+    after = max(get_time_range_to_fetch(tr).after, previous_month_start)
+    until = horizon if tr is None or tr.until is None else min(tr.until, horizon)
+    if until <= after:
+        return None
+
+    return TimeRange(after=after, until=until)
+
+
+def mark_fetched(
+    entry_cache: SyncableEntryCache,
+    time_range: TimeRange,
+    sync_started_at: EpochSeconds,
+) -> None:
+    # From now on, only fetch entries changed after this fetch
+    entry_cache.set_watermark(sync_started_at)
+
+    if time_range.until is not None and to_epoch(time_range.until) < sync_started_at:
+        # Entries after the fetched range are still unknown
+        return
 
+    after = to_epoch(time_range.after)
+    covered_since = entry_cache.get_covered_since()
+    if covered_since is None or after < covered_since:
+        entry_cache.set_covered_since(after)
 
-def get_toggl_client(token: TogglApiToken) -> Toggl:
+
+def drop_entries_gone_from_toggl(
+    entry_cache: SyncableEntryCache,
+    time_range: TimeRange,
+    fetched_ids: Iterable[TogglEntryId],
+) -> None:
+    """Delete the cached entries in ``time_range`` that Toggl did not return"""
+    cached_ids = {entry.id for entry in entry_cache.read(time_range)}
+    gone = cached_ids - set(fetched_ids)
+    entry_cache.delete(gone)
+    get_metrics().count("cache.rows_deleted", len(gone))
+
+
+def get_time_range_to_fetch(updated_tr: Optional[TimeRange]) -> TimeRange:
+    if updated_tr is None:
+        # Case when the cache has been deleted, only query from the earliest project
+        # date in the config, nothing more
+        config = get_config()
+        earliest_date = sorted(proj.start_date for proj in config.projects)[0]
+        updated_tr = TimeRange(after=earliest_date)
+
+    return updated_tr
+
+
+def parse_supported_entries(
+    raw_entries: Iterable[JsonDict],
+) -> Iterator[TogglTimeEntry]:
+    project_map = get_config().project_id_to_name_map
+    for raw_time_entry in raw_entries:
+        try:
+            entry = _parse_toggl_entry(raw_time_entry, project_map)
+        except ProjectNotSupported:
+            # Toggl returns entries for all projects. It doesn't allow filtering per
+            # project. However, that doesn't mean you need to cache entries from
+            # projects you don't care about.
+            # pro: you save space in caching and reduce load/write time
+            # con: when adding a new project, you need to remove cache and fetch all
+            #      entries again - which is fine because it occurs very rarely
+            continue
+        yield entry
+
+
+def split_truncated_window(
+    window: TimeRange,
+    amount: int,
+) -> Optional[Tuple[TimeRange, TimeRange]]:
+    """Return both halves of ``window`` if Toggl might have truncated its response
+
+    ``amount`` is the number of entries Toggl returned for ``window``.
+    """
+    if amount < MAX_ENTRIES_PER_REQUEST or window.until is None:
+        return None
+
+    span = window.until - window.after
+    if span <= MIN_WINDOW_SPAN:
+        logger.warning(f"{window} returned {amount} entries, might be truncated")
+        return None
+
+    middle = window.after + span / 2
+    first_half = TimeRange(after=window.after, until=middle)
+    second_half = TimeRange(after=middle, until=window.until)
+    return first_half, second_half
+
+
+def sort_and_deduplicate(
+    windows_data: Iterable[List[JsonDict]],
+) -> Iterator[JsonDict]:
+    """Yield raw entries of consecutive windows in start order, without duplicates"""
+    # Entries starting exactly at the boundary between windows could be returned
+    # in both windows
+    seen = set()
+    for data in windows_data:
+        for raw_entry in sorted(data, key=lambda raw: raw["start"]):
+            if raw_entry["id"] in seen:
+                continue
+            seen.add(raw_entry["id"])
+            yield raw_entry
+
+
+def split_time_range_per_month(
+    time_range: TimeRange,
+    now: Optional[datetime.datetime] = None,
+) -> List[TimeRange]:
+    """Split ``time_range`` in consecutive windows that never span more than a month
+
+    Ranges without ``until`` are considered to end ``now``.
+    """
+    after = time_range.after
+    until = time_range.until
+    if until is None:
+        until = now or datetime.datetime.now(tz=after.tzinfo)
+
+    windows = []
+    while after < until:
+        month_start = after.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+        if month_start.month == 12:
+            next_month = month_start.replace(year=month_start.year + 1, month=1)
+        else:
+            next_month = month_start.replace(month=month_start.month + 1)
+
+        window_until = min(next_month, until)
+        windows.append(TimeRange(after=after, until=window_until))
+        after = window_until
+
+    return windows
+
+
+def get_toggl_client(
+    token: TogglApiToken,
+    settings: Optional[TogglClientConfig] = None,
+) -> Toggl:
     global _CACHED_TOGGL_CLIENT
     if _CACHED_TOGGL_CLIENT:
         return _CACHED_TOGGL_CLIENT
 
-    client = Toggl(token=token)
+    client = Toggl(token=token, settings=settings)
 
     _CACHED_TOGGL_CLIENT = client
 
@@ -109,13 +605,14 @@ def _parse_toggl_entry(
         "at":"2013-03-11T15:36:58+00:00"
     }
     """
-    project_id: TogglProjectId = raw_entry["pid"]
+    # Entries without project do not have "pid"
+    project_id: Optional[TogglProjectId] = raw_entry.get("pid")
 
     stop: Optional[datetime.datetime] = None
     if "stop" in raw_entry:
         stop = datetime.datetime.fromisoformat(raw_entry["stop"])
 
-    if project_id in project_map:
+    if project_id is not None and project_id in project_map:
         project = project_map[project_id]
     else:
         raise ProjectNotSupported
@@ -135,125 +632,41 @@ def _parse_toggl_entry(
     return entry
 
 
-def get_project_entries(
+def get_entries(
     *,
-    pid: TogglProjectId,
     time_range: Optional[TimeRange] = None,
+    pid: Optional[TogglProjectId] = None,
 ) -> Iterator[TogglTimeEntry]:
-
-    # The API doesn't filter entries per project. It forces you to fetch all entries and
-    # then filter them locally
-    # TODO: cache them locally to avoid calling too much
+    """Return the entries of every project, or only of ``pid`` if provided"""
     config = get_config()
-    toggl = get_toggl_client(token=config.toggl_api_token)
-    time_entries = toggl.get_entries(tr=time_range)
-    for entry in time_entries:
-        if entry.project.id == pid:
-            yield entry
-
-
-# ======================================================================================
-# CAVEAT: this is a bad hack to get it working ASAP, you should use a DB...
-#
-# Use SQLite to filter by date, etc.
-
-import csv  # noqa
-
-TOGGL_ENTRIES_CACHE = Path("toggl-cache.csv")
-# TODO: once you remove this hack, remove the cache file from the .gitignore
-
-CacheKey = str
-TableRow = List[Union[str, int]]
-
-
-def find_cached_entries(
-    tr: Optional[TimeRange],
-) -> Tuple[Optional[TimeRange], List[TogglTimeEntry]]:
-    """Most common use case: find all entries from a given time on."""
-    cached_entries = list(read_cache(tr))
-    if not cached_entries:
-        return tr, []
-
-    last_datetime = cached_entries[-1].start  # TODO: should this be start or stop?
-    last_datetime += datetime.timedelta(seconds=1)
-    updated_tr = TimeRange(after=last_datetime, until=tr.until if tr else None)
-    return updated_tr, cached_entries
-
-
-def entry_to_table_row(entry: TogglTimeEntry) -> TableRow:
-    return [
-        entry.id,
-        entry.project.id,
-        entry.project.alias,
-        entry.project.start_date.isoformat(),
-        entry.description,
-        entry.start.isoformat(),
-        entry.stop.isoformat(),  # type:ignore
-    ]
-
-
-def table_row_to_entry(row: TableRow) -> TogglTimeEntry:
-    return TogglTimeEntry(
-        id=int(row[0]),
-        project=Project(
-            id=int(row[1]),
-            alias=cast(str, row[2]),
-            start_date=datetime.datetime.fromisoformat(cast(str, row[3])),
-        ),
-        description=cast(str, row[4]),
-        start=datetime.datetime.fromisoformat(cast(str, row[5])),
-        stop=datetime.datetime.fromisoformat(cast(str, row[6])),
+    toggl = get_toggl_client(
+        token=config.toggl_api_token,
+        settings=config.toggl_client,
     )
-
-
-def read_cache(time_range: Optional[TimeRange] = None) -> Iterator[TogglTimeEntry]:
-    entries_iter = load_cache()
-    if time_range is None:
-        yield from entries_iter
-        return
-
-    for entry in entries_iter:
-        if entry.start < time_range.after:
-            continue
-
-        if time_range.after <= entry.start:
-            if time_range.until is None:
-                yield entry
-                continue
-
-            if entry.stop <= time_range.until:  # type: ignore
-                yield entry
-                continue
-
-        if time_range.until and time_range.until < entry.stop:  # type: ignore
-            break
-
-
-def load_cache() -> Iterator[TogglTimeEntry]:
-    # Assumption: all entries are sorted by start date
-    if TOGGL_ENTRIES_CACHE.exists() is False:
+    time_entries = toggl.get_entries(tr=time_range, pid=pid)
+    if pid is None:
+        yield from time_entries
         return
 
-    with TOGGL_ENTRIES_CACHE.open("r") as f:
-        for row in csv.reader(f):
-            entry = table_row_to_entry(row)  # type: ignore
+    for entry in time_entries:
+        if entry.project.id == pid:
             yield entry
 
 
-def cache_entries(entries: List[TogglTimeEntry]) -> None:
-    # Assumption: all entries must be sorted by start date
-    with TOGGL_ENTRIES_CACHE.open("a") as f:
-        writer = csv.writer(f)
-        for entry in entries:
-            if entry.stop is None:
-                # Ongoing time entry, just ignore it
-                continue
-            row = entry_to_table_row(entry)
-            writer.writerow(row)
-
+def get_project_entries(
+    *,
+    pid: TogglProjectId,
+    time_range: Optional[TimeRange] = None,
+) -> Iterator[TogglTimeEntry]:
+    # The API doesn't filter entries per project. It forces you to fetch all entries and
+    # then filter them locally. The cache, however, is indexed per project.
+    return get_entries(time_range=time_range, pid=pid)
 
-def remove_cache() -> None:
-    if not TOGGL_ENTRIES_CACHE.exists():
-        return
 
-    TOGGL_ENTRIES_CACHE.unlink()
+def update_cache(*, time_range: Optional[TimeRange] = None) -> None:
+    config = get_config()
+    toggl = get_toggl_client(
+        token=config.toggl_api_token,
+        settings=config.toggl_client,
+    )
+    toggl.update_cache(tr=time_range)
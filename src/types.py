@@ -10,16 +10,23 @@ TogglProjectId = int
 ProjectAlias = str
 TogglEntryDescription = str
 DurationInSeconds = int
+EpochSeconds = int
 
 
-@dataclass
+# Slotted classes do not have a per-instance __dict__, which makes them considerably
+# smaller - relevant when holding years of entries in memory. Classes are frozen where
+# nothing needs to mutate them after creation, except TogglTimeEntry: frozen instances
+# are noticeably slower to build, and entries are built in bulk when loading the cache.
+
+
+@dataclass(frozen=True, slots=True)
 class Project:
     id: TogglProjectId
     alias: ProjectAlias
     start_date: datetime.datetime
 
 
-@dataclass
+@dataclass(slots=True)
 class TogglTimeEntry:
     id: TogglEntryId
     project: Project
@@ -44,7 +51,7 @@ class TogglTimeEntry:
         return None
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class TimeRange:
     after: datetime.datetime
     until: Optional[datetime.datetime] = None
@@ -55,20 +62,20 @@ class TimeRange:
         return f"{self.__class__.__name__}({self.after} - {self.until})"
 
 
-@dataclass
+@dataclass(slots=True)
 class DailyStat:
     date: datetime.date
     entries: List[EntrySummary]
 
 
-@dataclass
+@dataclass(slots=True)
 class ProjectDailyStats:
     alias: ProjectAlias
     date: datetime.date
     entries: List[EntrySummary]
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class EntrySummary:
     description: TogglEntryDescription
     duration: DurationInSeconds
@@ -0,0 +1,49 @@
+import datetime
+from pathlib import Path
+
+import pytest
+
+from src import cache, config, metrics
+from src.config import AppConfig
+from src.metrics import Metrics
+from src.sqlite_cache import SqliteEntryCache
+from src.types import Project
+
+UTC = datetime.timezone.utc
+
+
+@pytest.fixture
+def project() -> Project:
+    return Project(
+        id=123,
+        alias="project",
+        start_date=datetime.datetime(2021, 1, 1, tzinfo=UTC),
+    )
+
+
+@pytest.fixture
+def app_config(
+    monkeypatch: pytest.MonkeyPatch,
+    tmp_path: Path,
+    project: Project,
+) -> AppConfig:
+    """Use an in-memory config and a temporary SQLite cache"""
+    app_config = AppConfig(
+        projects=[project],
+        toggl_api_token="token",
+        gsheet_url="https://example.com",
+        gspread_credentials_path=Path(),
+        gspread_authorized_user_path=Path(),
+    )
+    monkeypatch.setattr(config, "_CACHED_APP_CONFIG", app_config)
+    entry_cache = SqliteEntryCache(path=tmp_path / "cache.sqlite3")
+    monkeypatch.setattr(cache, "_CACHED_ENTRY_CACHE", entry_cache)
+    return app_config
+
+
+@pytest.fixture(autouse=True)
+def run_metrics(monkeypatch: pytest.MonkeyPatch) -> Metrics:
+    """Collect the metrics of each test separately"""
+    run_metrics = Metrics()
+    monkeypatch.setattr(metrics, "_CACHED_METRICS", run_metrics)
+    return run_metrics
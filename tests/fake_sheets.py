@@ -0,0 +1,145 @@
+from __future__ import annotations
+
+import threading
+from collections import Counter
+from typing import Any, Collection, Dict, List, Optional
+
+from src.gsheet import GSheetValue
+from src.types import JsonDict
+
+
+def column_name_to_index(name: str) -> int:
+    return ord(name) - ord("A")
+
+
+class FakeWorksheet:
+    """In-memory stand-in for ``gspread.models.Worksheet``
+
+    Cells hold the unformatted values that the Sheets API would return.
+    """
+
+    def __init__(
+        self,
+        title: str = "project",
+        id: int = 42,
+        rows: Optional[List[List[GSheetValue]]] = None,
+    ) -> None:
+        self.title = title
+        self.id = id
+        self.rows: List[List[GSheetValue]] = rows or []
+        self.calls: Counter[str] = Counter()
+
+    def batch_get(
+        self,
+        ranges: List[str],
+        major_dimension: str = "ROWS",
+        value_render_option: str = "FORMATTED_VALUE",
+    ) -> List[Any]:
+        assert major_dimension == "COLUMNS", "only column ranges are supported"
+        assert value_render_option == "UNFORMATTED_VALUE", "only unformatted values"
+        self.calls["batch_get"] += 1
+        return [self._get_columns(column_range) for column_range in ranges]
+
+    def _get_columns(self, column_range: str) -> List[List[GSheetValue]]:
+        first, last = column_range.split(":")
+        columns = []
+        for index in range(column_name_to_index(first), column_name_to_index(last) + 1):
+            column = [row[index] if index < len(row) else "" for row in self.rows]
+            # The Sheets API drops trailing empty values and columns
+            while column and column[-1] == "":
+                column.pop()
+            columns.append(column)
+        while columns and not columns[-1]:
+            columns.pop()
+        return columns
+
+    def apply(self, request: JsonDict) -> None:
+        if "deleteDimension" in request:
+            deleted = request["deleteDimension"]["range"]
+            start, end = deleted["startIndex"], deleted["endIndex"]
+            del self.rows[start:end]
+        elif "appendCells" in request:
+            for row_data in request["appendCells"]["rows"]:
+                self.rows.append([to_value(c) for c in row_data["values"]])
+        elif "updateCells" in request:
+            update = request["updateCells"]
+            row_index = update["start"]["rowIndex"]
+            column_index = update["start"]["columnIndex"]
+            for row_data in update["rows"]:
+                row = self.rows[row_index]
+                for offset, cell_data in enumerate(row_data["values"]):
+                    index = column_index + offset
+                    row.extend([""] * (index + 1 - len(row)))
+                    row[index] = to_value(cell_data)
+                row_index += 1
+        else:
+            raise NotImplementedError(f"unsupported request: {request}")
+
+
+def to_value(cell_data: JsonDict) -> GSheetValue:
+    [value] = cell_data["userEnteredValue"].values()
+    return value
+
+
+def request_sheet_id(request: JsonDict) -> int:
+    [change] = request.values()
+    if "range" in change:
+        return change["range"]["sheetId"]
+    if "start" in change:
+        return change["start"]["sheetId"]
+    return change["sheetId"]
+
+
+class FakeSpreadsheet:
+    """In-memory stand-in for ``gspread.models.Spreadsheet``
+
+    Batch updates are applied to the worksheets, atomically, unless they touch a
+    worksheet in ``failing_sheet_ids``.
+    """
+
+    def __init__(
+        self,
+        worksheets: List[FakeWorksheet],
+        failing_sheet_ids: Collection[int] = (),
+    ) -> None:
+        self.sheets: Dict[int, FakeWorksheet] = {
+            sheet.id: sheet for sheet in worksheets
+        }
+        self.failing_sheet_ids = failing_sheet_ids
+        self.batch_updates: List[JsonDict] = []
+        self.calls: Counter[str] = Counter()
+        self._lock = threading.Lock()
+
+    def worksheets(self) -> List[FakeWorksheet]:
+        self.calls["worksheets"] += 1
+        return list(self.sheets.values())
+
+    def batch_update(self, body: JsonDict) -> None:
+        with self._lock:
+            self.calls["batch_update"] += 1
+            sheet_ids = [request_sheet_id(request) for request in body["requests"]]
+            if any(sheet_id in self.failing_sheet_ids for sheet_id in sheet_ids):
+                raise RuntimeError("quota exceeded")
+
+            self.batch_updates.append(body)
+            for sheet_id, request in zip(sheet_ids, body["requests"]):
+                self.sheets[sheet_id].apply(request)
+
+    @property
+    def total_calls(self) -> Counter[str]:
+        """Calls made to the spreadsheet and to any of its worksheets"""
+        total = Counter(self.calls)
+        for sheet in self.sheets.values():
+            total.update(sheet.calls)
+        return total
+
+
+class FakeClient:
+    """In-memory stand-in for ``gspread.Client``, serving a single spreadsheet"""
+
+    def __init__(self, spreadsheet: FakeSpreadsheet) -> None:
+        self.spreadsheet = spreadsheet
+
+    def open_by_url(self, url: str) -> FakeSpreadsheet:
+        self.spreadsheet.calls["open_by_url"] += 1
+        return self.spreadsheet
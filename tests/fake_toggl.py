@@ -0,0 +1,115 @@
+from __future__ import annotations
+
+import datetime
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, List, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+from src.toggl import MAX_ENTRIES_PER_REQUEST, ME_SYNC_HORIZON
+from src.types import JsonDict
+
+API_PATH = "/api/v8"
+
+
+class FakeTogglServer:
+    """Local HTTP server that mimics the Toggl ``time_entries`` and ``me`` endpoints
+
+    Entries are filtered by ``start_date`` and ``end_date`` comparing ISO strings, so
+    all entries must use the same time zone. The ``me`` endpoint returns the entries
+    whose ``at`` is after ``since``, including deleted ones, but only those started in
+    the last ``ME_SYNC_HORIZON`` seconds.
+
+    Like Toggl, the ``time_entries`` endpoint returns ``MAX_ENTRIES_PER_REQUEST``
+    entries at most.
+
+    Status codes in ``failures`` are returned, in order, before serving any entry.
+    Every request is recorded in ``requests``.
+    """
+
+    def __init__(
+        self,
+        entries: List[JsonDict],
+        failures: Optional[List[int]] = None,
+    ) -> None:
+        self.entries = entries
+        self.failures = list(failures or [])
+        self.requests: List[JsonDict] = []
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._build_handler())
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host!s}:{port}{API_PATH}"
+
+    def __enter__(self) -> FakeTogglServer:
+        self._thread.start()
+        return self
+
+    def __exit__(self, *_: object) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _get_time_entries(self, params: JsonDict) -> List[JsonDict]:
+        after = params.get("start_date")
+        until = params.get("end_date")
+        entries = [
+            entry
+            for entry in self.entries
+            if not entry.get("server_deleted_at")
+            and (after is None or after <= entry["start"])
+            and (until is None or entry["start"] <= until)
+        ]
+        return entries[:MAX_ENTRIES_PER_REQUEST]
+
+    def _get_me(self, params: JsonDict) -> JsonDict:
+        since = int(params["since"])
+        horizon = time.time() - ME_SYNC_HORIZON
+        changed = [
+            entry
+            for entry in self.entries
+            if since <= datetime.datetime.fromisoformat(entry["at"]).timestamp()
+            and horizon <= datetime.datetime.fromisoformat(entry["start"]).timestamp()
+        ]
+        return {"since": int(time.time()), "data": {"time_entries": changed}}
+
+    def _respond(self, path: str, params: JsonDict) -> Tuple[int, Any]:
+        with self._lock:
+            self.requests.append({"path": path, **params})
+            if self.failures:
+                return self.failures.pop(0), []
+
+        if path == f"{API_PATH}/time_entries":
+            return 200, self._get_time_entries(params)
+
+        if path == f"{API_PATH}/me":
+            return 200, self._get_me(params)
+
+        return 404, {}
+
+    def _build_handler(self) -> type:
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self) -> None:
+                url = urlparse(self.path)
+                params = {key: values[0] for key, values in parse_qs(url.query).items()}
+                status, content = fake._respond(url.path, params)
+                body = json.dumps(content).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                if status == 429:
+                    self.send_header("Retry-After", "0")
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *_: object) -> None:
+                # Keep test output clean
+                pass
+
+        return Handler
@@ -0,0 +1,72 @@
+import asyncio
+import datetime
+
+from src import cache
+from src.async_toggl import AsyncToggl
+from src.config import TogglClientConfig
+from src.types import JsonDict, TimeRange
+from tests.fake_toggl import FakeTogglServer
+
+UTC = datetime.timezone.utc
+
+
+def build_raw_entry(id: int, pid: int, start: str, stop: str) -> JsonDict:
+    return {
+        "id": id,
+        "pid": pid,
+        "start": start,
+        "stop": stop,
+        "description": f"entry {id}",
+        "at": stop,
+    }
+
+
+raw_entries = [
+    build_raw_entry(1, 123, "2021-01-10T10:00:00+00:00", "2021-01-10T11:00:00+00:00"),
+    build_raw_entry(2, 999, "2021-01-20T10:00:00+00:00", "2021-01-20T11:00:00+00:00"),
+    build_raw_entry(3, 123, "2021-02-10T10:00:00+00:00", "2021-02-10T11:00:00+00:00"),
+    build_raw_entry(4, 123, "2021-03-10T10:00:00+00:00", "2021-03-10T11:00:00+00:00"),
+]
+
+
+def test_async_client_fetches_and_caches_project_entries(app_config):
+    time_range = TimeRange(
+        after=datetime.datetime(2021, 1, 1, tzinfo=UTC),
+        until=datetime.datetime(2021, 4, 1, tzinfo=UTC),
+    )
+    settings = TogglClientConfig(backoff_factor=0)
+
+    async def fetch():
+        async with AsyncToggl("token", settings, api_url=server.url) as toggl:
+            return [e async for e in toggl.get_project_entries(123, time_range)]
+
+    with FakeTogglServer(raw_entries, failures=[429, 503]) as server:
+        entries = asyncio.run(fetch())
+
+    assert [entry.id for entry in entries] == [1, 3, 4]
+    # One request per month, plus the two retried failures
+    assert len(server.requests) == 3 + 2
+    assert [entry.id for entry in cache.load_cache()] == [1, 3, 4]
+
+
+def test_async_client_fetches_several_time_ranges_concurrently(app_config):
+    time_ranges = [
+        TimeRange(
+            after=datetime.datetime(2021, 1, 1, tzinfo=UTC),
+            until=datetime.datetime(2021, 2, 1, tzinfo=UTC),
+        ),
+        TimeRange(
+            after=datetime.datetime(2021, 3, 1, tzinfo=UTC),
+            until=datetime.datetime(2021, 4, 1, tzinfo=UTC),
+        ),
+    ]
+
+    async def fetch():
+        async with AsyncToggl("token", api_url=server.url) as toggl:
+            return await toggl.fetch_time_ranges(time_ranges)
+
+    with FakeTogglServer(raw_entries) as server:
+        january, march = asyncio.run(fetch())
+
+    assert [entry.id for entry in january] == [1]
+    assert [entry.id for entry in march] == [4]
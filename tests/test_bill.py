@@ -1,8 +1,14 @@
 import datetime
 
-from src.bill import aggregate_entries
+import pytest
+
+from src import bill, cache, gsheet, toggl
+from src.bill import EntriesNotSorted, aggregate_entries, iter_project_daily_stats
+from src.config import AppConfig
 from src.types import EntrySummary, Project, ProjectDailyStats, TogglTimeEntry
 
+UTC = datetime.timezone.utc
+
 
 def test_aggregate_entries_per_project_per_day_and_per_description():
     any_date = datetime.datetime.now()
@@ -41,3 +47,121 @@ def test_aggregate_entries_per_project_per_day_and_per_description():
             ],
         ),
     ]
+
+
+def test_aggregate_entries_yields_stats_sorted_by_date_in_a_single_pass():
+    any_date = datetime.datetime.now()
+    project_1 = Project(1234, alias="project alias 1", start_date=any_date)
+    project_2 = Project(5678, alias="project alias 2", start_date=any_date)
+
+    def build_entry(id: int, project: Project, start: str) -> TogglTimeEntry:
+        start_datetime = datetime.datetime.fromisoformat(start)
+        return TogglTimeEntry(
+            id=id,
+            project=project,
+            start=start_datetime,
+            stop=start_datetime + datetime.timedelta(minutes=10),
+            description="do foo",
+        )
+
+    entries = [
+        build_entry(1, project_1, "2013-03-11T09:00:00+00:00"),
+        build_entry(2, project_2, "2013-03-11T10:00:00+00:00"),
+        build_entry(3, project_1, "2013-03-11T11:00:00+00:00"),
+        build_entry(4, project_2, "2013-03-12T09:00:00+00:00"),
+    ]
+
+    stats = iter_project_daily_stats(iter(entries))
+
+    assert next(stats) == ProjectDailyStats(
+        date=datetime.date(2013, 3, 11),
+        alias="project alias 1",
+        entries=[EntrySummary(description="do foo", duration=1200)],
+    )
+    assert next(stats) == ProjectDailyStats(
+        date=datetime.date(2013, 3, 11),
+        alias="project alias 2",
+        entries=[EntrySummary(description="do foo", duration=600)],
+    )
+    assert next(stats) == ProjectDailyStats(
+        date=datetime.date(2013, 3, 12),
+        alias="project alias 2",
+        entries=[EntrySummary(description="do foo", duration=600)],
+    )
+
+    with pytest.raises(EntriesNotSorted):
+        aggregate_entries(reversed(entries))
+
+
+@pytest.fixture
+def projects(app_config: AppConfig, project: Project) -> list:
+    other_project = Project(
+        id=456,
+        alias="other project",
+        start_date=datetime.datetime(2021, 1, 2, tzinfo=UTC),
+    )
+    app_config.projects.append(other_project)
+    return [project, other_project]
+
+
+def test_bill_several_projects_with_a_single_fetch(monkeypatch, projects):
+    unknown_project = Project(
+        id=789, alias="unknown", start_date=projects[0].start_date
+    )
+
+    def build_entry(id: int, project: Project, day: int) -> TogglTimeEntry:
+        start = datetime.datetime(2021, 1, day, 9, tzinfo=UTC)
+        return TogglTimeEntry(
+            id=id,
+            project=project,
+            start=start,
+            stop=start + datetime.timedelta(minutes=10),
+            description="do foo",
+        )
+
+    entries = [
+        build_entry(1, projects[0], day=1),
+        build_entry(2, projects[1], day=1),  # before the project start date
+        build_entry(3, unknown_project, day=2),
+        build_entry(4, projects[1], day=2),
+    ]
+    fetches = []
+
+    def update_cache(*, time_range):
+        fetches.append(time_range)
+        cache.cache_entries(entries)
+
+    uploads = []
+    monkeypatch.setattr(toggl, "update_cache", update_cache)
+    monkeypatch.setattr(
+        gsheet, "upload_to_gsheet", lambda stats, **kwargs: uploads.append(stats)
+    )
+
+    bill.bill(projects=[], clean_cache=False, fetch_only=False, append_only=False)
+
+    assert len(fetches) == 1
+    assert fetches[0].after == projects[0].start_date
+    assert uploads == [
+        [
+            ProjectDailyStats(
+                alias="project",
+                date=datetime.date(2021, 1, 1),
+                entries=[EntrySummary(description="do foo", duration=600)],
+            ),
+            ProjectDailyStats(
+                alias="other project",
+                date=datetime.date(2021, 1, 2),
+                entries=[EntrySummary(description="do foo", duration=600)],
+            ),
+        ]
+    ]
+
+
+def test_bill_unknown_project(projects):
+    with pytest.raises(bill.ProjectAliasNotFound):
+        bill.bill(
+            projects=["unknown"],
+            clean_cache=False,
+            fetch_only=True,
+            append_only=False,
+        )
@@ -0,0 +1,458 @@
+import datetime
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import List
+
+import pytest
+
+from src.bill import aggregate_entries
+from src.columnar_cache import ColumnarEntryCache
+from src.csv_cache import CsvEntryCache
+from src.segmented_cache import SegmentedEntryCache
+from src.sqlite_cache import SqliteEntryCache
+from src.types import EntrySummary, Project, TimeRange, TogglTimeEntry
+
+UTC = datetime.timezone.utc
+
+project_a = Project(
+    id=1,
+    alias="project a",
+    start_date=datetime.datetime(2021, 1, 1, tzinfo=UTC),
+)
+project_b = Project(
+    id=2,
+    alias="project b",
+    start_date=datetime.datetime(2021, 1, 1, tzinfo=UTC),
+)
+
+
+def build_entry(
+    id: int,
+    project: Project,
+    start: str,
+    stop: str,
+    description: str = "description",
+) -> TogglTimeEntry:
+    return TogglTimeEntry(
+        id=id,
+        project=project,
+        description=description,
+        start=datetime.datetime.fromisoformat(start),
+        stop=datetime.datetime.fromisoformat(stop),
+    )
+
+
+entries = [
+    build_entry(1, project_a, "2021-01-01T10:00:00+00:00", "2021-01-01T11:00:00+00:00"),
+    build_entry(2, project_b, "2021-01-01T12:00:00+00:00", "2021-01-01T13:00:00+00:00"),
+    build_entry(3, project_a, "2021-01-02T10:00:00+00:00", "2021-01-02T11:00:00+00:00"),
+    build_entry(4, project_a, "2021-01-03T10:00:00+00:00", "2021-01-03T11:00:00+00:00"),
+]
+
+
+def test_sqlite_cache_reads_entries_per_project_and_time_range(tmp_path):
+    cache = SqliteEntryCache(path=tmp_path / "cache.sqlite3")
+    cache.write(entries)
+
+    time_range = TimeRange(
+        after=datetime.datetime(2021, 1, 1, tzinfo=UTC),
+        until=datetime.datetime(2021, 1, 2, 12, tzinfo=UTC),
+    )
+    cached = list(cache.read(time_range, pid=project_a.id))
+
+    assert cached == [entries[0], entries[2]]
+    assert cache.last_start() == entries[-1].start
+
+
+def test_sqlite_cache_upserts_entries_by_id(tmp_path):
+    cache = SqliteEntryCache(path=tmp_path / "cache.sqlite3")
+    cache.write(entries)
+
+    edited = build_entry(
+        3,
+        project_a,
+        "2021-01-02T10:00:00+00:00",
+        "2021-01-02T10:30:00+00:00",
+        description="edited",
+    )
+    cache.write([edited])
+
+    cached = list(cache.load())
+    assert len(cached) == len(entries)
+    assert cached[2] == edited
+
+
+def test_sqlite_cache_migrates_legacy_csv_cache(tmp_path):
+    csv_path = tmp_path / "cache.csv"
+    CsvEntryCache(path=csv_path).write(entries)
+
+    cache = SqliteEntryCache(path=tmp_path / "cache.sqlite3", legacy_csv_path=csv_path)
+
+    assert list(cache.load()) == entries
+    assert csv_path.exists() is False
+    assert (tmp_path / "cache.csv.bak").exists()
+
+
+def test_csv_cache_seeks_to_requested_time_range(tmp_path):
+    cache = CsvEntryCache(path=tmp_path / "cache.csv")
+    cache.write(entries[:2])
+    cache.write(entries[2:])
+
+    time_range = TimeRange(after=datetime.datetime(2021, 1, 2, tzinfo=UTC))
+
+    assert list(cache.read(time_range)) == entries[2:]
+    assert cache.last_start() == entries[-1].start
+
+
+def test_csv_cache_rebuilds_outdated_index(tmp_path):
+    cache = CsvEntryCache(path=tmp_path / "cache.csv")
+    multiline = build_entry(
+        5,
+        project_a,
+        "2021-01-04T10:00:00+00:00",
+        "2021-01-04T11:00:00+00:00",
+        description="first line\nsecond line",
+    )
+    cache.write([*entries, multiline])
+    cache.index_path.unlink()
+
+    time_range = TimeRange(after=datetime.datetime(2021, 1, 3, tzinfo=UTC))
+
+    assert list(cache.read(time_range)) == [entries[-1], multiline]
+    assert cache.index_path.exists()
+
+
+def test_columnar_cache_reads_entries_per_project_and_time_range(tmp_path):
+    cache = ColumnarEntryCache(path=tmp_path / "cache.columns")
+    assert cache.last_start() is None
+
+    cache.write(entries[:2])
+    cache.write(entries[2:])
+
+    time_range = TimeRange(
+        after=datetime.datetime(2021, 1, 1, tzinfo=UTC),
+        until=datetime.datetime(2021, 1, 2, 12, tzinfo=UTC),
+    )
+
+    assert list(cache.load()) == entries
+    assert list(cache.read(time_range, pid=project_a.id)) == [entries[0], entries[2]]
+    assert cache.last_start() == entries[-1].start
+
+
+def test_csv_cache_reads_unsorted_batches(tmp_path):
+    cache = CsvEntryCache(path=tmp_path / "cache.csv")
+    cache.write([entries[0], entries[3]])
+    cache.write([entries[2]])
+
+    time_range = TimeRange(
+        after=datetime.datetime(2021, 1, 2, tzinfo=UTC),
+        until=datetime.datetime(2021, 1, 2, 12, tzinfo=UTC),
+    )
+
+    assert cache.last_start() == entries[3].start
+    assert list(cache.read(time_range)) == [entries[2]]
+
+
+def test_columnar_cache_reads_unsorted_batches(tmp_path):
+    cache = ColumnarEntryCache(path=tmp_path / "cache.columns")
+    cache.write(entries[2:])
+    cache.write(entries[:2])
+
+    time_range = TimeRange(after=datetime.datetime(2021, 1, 2, tzinfo=UTC))
+
+    assert cache.last_start() == entries[-1].start
+    assert list(cache.read(time_range)) == entries[2:]
+
+
+def test_columnar_cache_ignores_interrupted_writes(tmp_path):
+    cache = ColumnarEntryCache(path=tmp_path / "cache.columns")
+    cache.write(entries[:2])
+    # As if the process was killed while appending the next entry
+    with (cache.path / "id.q").open("ab") as f:
+        f.write(b"\x01\x02\x03")
+
+    assert list(cache.load()) == entries[:2]
+
+    cache.write(entries[2:])
+    assert list(cache.load()) == entries
+
+
+def test_columnar_cache_keeps_tables_of_interrupted_writes(tmp_path, monkeypatch):
+    cache = ColumnarEntryCache(path=tmp_path / "cache.columns")
+    cache.write(entries[:2])
+
+    def interrupt(*_):
+        raise KeyboardInterrupt
+
+    monkeypatch.setattr(os, "replace", interrupt)
+    with pytest.raises(KeyboardInterrupt):
+        cache.write(entries[2:])
+    monkeypatch.undo()
+
+    assert list(cache.load())[:2] == entries[:2]
+    assert [path.name for path in cache.path.iterdir() if path.name[0] == "."] == []
+
+
+def test_sqlite_cache_deletes_entries_and_keeps_sync_watermark(tmp_path):
+    cache = SqliteEntryCache(path=tmp_path / "cache.sqlite3")
+    cache.write(entries)
+    assert cache.get_watermark() is None
+
+    cache.delete([entries[1].id, entries[3].id])
+    cache.set_watermark(1234)
+
+    assert list(cache.load()) == [entries[0], entries[2]]
+    assert cache.get_watermark() == 1234
+
+
+def test_csv_cache_shares_one_project_instance_per_project(tmp_path):
+    configured_project = Project(
+        id=project_a.id,
+        alias="configured alias",
+        start_date=project_a.start_date,
+    )
+    cache = CsvEntryCache(
+        path=tmp_path / "cache.csv",
+        projects={project_a.id: configured_project},
+    )
+    cache.write(entries)
+
+    loaded = list(cache.load())
+
+    assert loaded[0].project is configured_project
+    assert loaded[2].project is configured_project
+    assert loaded[1].project == project_b
+
+
+def test_sqlite_cache_keeps_daily_totals_up_to_date(tmp_path):
+    cache = SqliteEntryCache(path=tmp_path / "cache.sqlite3")
+    cache.write(entries)
+    assert list(cache.read_daily_stats()) == aggregate_entries(cache.load())
+
+    moved_to_another_day = build_entry(
+        3,
+        project_a,
+        "2021-01-03T12:00:00+00:00",
+        "2021-01-03T12:30:00+00:00",
+    )
+    cache.write([moved_to_another_day])
+    cache.delete([entries[1].id])
+
+    stats = list(cache.read_daily_stats(pid=project_a.id))
+
+    assert stats == aggregate_entries(cache.read(pid=project_a.id))
+    assert [stat.date.isoformat() for stat in stats] == ["2021-01-01", "2021-01-03"]
+    assert stats[1].entries == [EntrySummary(description="description", duration=5400)]
+
+
+def test_sqlite_cache_takes_aliases_of_renamed_projects_from_config(tmp_path):
+    path = tmp_path / "cache.sqlite3"
+    SqliteEntryCache(path=path).write(entries)
+    renamed = Project(id=1, alias="renamed", start_date=project_a.start_date)
+
+    cache = SqliteEntryCache(path=path, projects={renamed.id: renamed})
+
+    stats = list(cache.read_daily_stats(pid=project_a.id))
+    assert {stat.alias for stat in stats} == {"renamed"}
+    assert {entry.project.alias for entry in cache.read(pid=project_a.id)} == {
+        "renamed"
+    }
+
+
+def test_sqlite_cache_finds_touched_days_under_the_write_lock(tmp_path):
+    cache = SqliteEntryCache(path=tmp_path / "cache.sqlite3")
+    cache.write(entries[:1])
+    statements: List[str] = []
+    cache.connection.set_trace_callback(statements.append)
+
+    cache.write(entries[1:])
+
+    begin = statements.index("BEGIN IMMEDIATE")
+    [find_days] = [i for i, sql in enumerate(statements) if "start / 86400" in sql]
+    assert begin < find_days
+    assert statements[-1] == "COMMIT"
+
+
+def test_sqlite_cache_builds_daily_totals_of_existing_databases(tmp_path):
+    path = tmp_path / "cache.sqlite3"
+    cache = SqliteEntryCache(path=path)
+    cache.write(entries)
+    with cache.connection as connection:
+        connection.execute("DELETE FROM daily_totals")
+        connection.execute("DELETE FROM meta")
+    cache.close()
+
+    reopened_cache = SqliteEntryCache(path=path)
+
+    stats = list(reopened_cache.read_daily_stats())
+    assert stats == aggregate_entries(reopened_cache.load())
+
+
+def test_csv_cache_compacts_duplicated_and_unsorted_entries(tmp_path):
+    cache = CsvEntryCache(path=tmp_path / "cache.csv")
+    renamed = build_entry(
+        2,
+        project_b,
+        "2021-01-01T12:00:00+00:00",
+        "2021-01-01T13:00:00+00:00",
+        description="renamed",
+    )
+    cache.write(entries[2:])
+    assert cache.needs_compaction() is False
+
+    cache.write([*entries[:2], renamed])
+    assert cache.needs_compaction() is True
+
+    report = cache.compact()
+
+    assert list(cache.load()) == [entries[0], renamed, *entries[2:]]
+    assert (report.rows_before, report.rows_after) == (5, 4)
+    assert report.bytes_saved > 0
+    assert cache.needs_compaction() is False
+    time_range = TimeRange(after=datetime.datetime(2021, 1, 2, tzinfo=UTC))
+    assert list(cache.read(time_range)) == entries[2:]
+
+
+def test_columnar_cache_compacts_duplicated_and_unsorted_entries(tmp_path):
+    cache = ColumnarEntryCache(path=tmp_path / "cache.columns")
+    cache.write(entries[2:])
+    cache.write(entries)
+    assert cache.needs_compaction() is True
+
+    report = cache.compact()
+
+    assert list(cache.load()) == entries
+    assert (report.rows_before, report.rows_after) == (6, 4)
+    assert report.bytes_saved > 0
+    assert cache.needs_compaction() is False
+    assert sorted(path.name for path in tmp_path.iterdir()) == [
+        "cache.columns",
+        "cache.columns.lock",
+    ]
+
+
+def test_sqlite_cache_compacts_free_pages(tmp_path):
+    cache = SqliteEntryCache(path=tmp_path / "cache.sqlite3")
+    many_entries = [
+        build_entry(
+            id,
+            project_a,
+            "2021-01-01T10:00:00+00:00",
+            "2021-01-01T11:00:00+00:00",
+            description="description " * 50,
+        )
+        for id in range(2_000)
+    ]
+    cache.write(many_entries)
+    assert cache.needs_compaction() is False
+
+    cache.delete(entry.id for entry in many_entries[1:])
+    assert cache.needs_compaction() is True
+
+    report = cache.compact()
+
+    assert list(cache.load()) == many_entries[:1]
+    assert (report.rows_before, report.rows_after) == (1, 1)
+    assert report.bytes_saved > 0
+    assert cache.needs_compaction() is False
+
+
+def write_day(path: Path, day: int) -> None:
+    entries = []
+    for minute in range(0, 24 * 60, 60):
+        start = datetime.datetime(2021, 1, day, tzinfo=UTC)
+        start += datetime.timedelta(minutes=minute)
+        entry = TogglTimeEntry(
+            id=day * 10_000 + minute,
+            project=project_a,
+            description="line\n" * 10,
+            start=start,
+            stop=start + datetime.timedelta(minutes=5),
+        )
+        entries.append(entry)
+    CsvEntryCache(path=path).write(entries)
+
+
+def read_ids(path: Path) -> List[int]:
+    return [entry.id for entry in CsvEntryCache(path=path).load()]
+
+
+def test_csv_cache_is_shared_by_concurrent_processes(tmp_path):
+    path = tmp_path / "cache.csv"
+    days = range(1, 9)
+    with ProcessPoolExecutor(max_workers=4) as executor:
+        writes = [executor.submit(write_day, path, day) for day in days]
+        reads = [executor.submit(read_ids, path) for _ in days]
+        for write in writes:
+            write.result()
+        for read in reads:
+            # Days might be written in any order, but rows are never torn
+            assert len(set(read.result())) == len(read.result())
+
+    cache = CsvEntryCache(path=path)
+    cache.compact()
+
+    expected = [day * 10_000 + minute for day in days for minute in range(0, 1440, 60)]
+    assert [entry.id for entry in cache.load()] == expected
+
+
+monthly_entries = [
+    build_entry(1, project_a, "2021-01-10T10:00:00+00:00", "2021-01-10T11:00:00+00:00"),
+    build_entry(2, project_b, "2021-01-20T10:00:00+00:00", "2021-01-20T11:00:00+00:00"),
+    build_entry(3, project_a, "2021-02-10T10:00:00+00:00", "2021-02-10T11:00:00+00:00"),
+    build_entry(4, project_a, "2021-03-10T10:00:00+00:00", "2021-03-10T11:00:00+00:00"),
+]
+
+
+def test_segmented_cache_only_opens_segments_in_time_range(tmp_path):
+    cache = SegmentedEntryCache(path=tmp_path / "cache.segments")
+    cache.write(monthly_entries)
+    assert sorted(path.name for path in cache.path.glob("*.csv*")) == [
+        "2021-01.csv.gz",
+        "2021-02.csv.gz",
+        "2021-03.csv",
+    ]
+    (cache.path / "2021-01.csv.gz").unlink()
+
+    time_range = TimeRange(
+        after=datetime.datetime(2021, 2, 1, tzinfo=UTC),
+        until=datetime.datetime(2021, 3, 31, tzinfo=UTC),
+    )
+
+    assert list(cache.read(time_range)) == monthly_entries[2:]
+    assert list(cache.read(time_range, pid=project_b.id)) == []
+    assert cache.last_start() == monthly_entries[-1].start
+
+
+def test_segmented_cache_closes_and_compresses_past_months(tmp_path):
+    cache = SegmentedEntryCache(path=tmp_path / "cache.segments")
+    cache.write(monthly_entries[:1])
+    assert [path.name for path in cache.path.glob("*.csv*")] == ["2021-01.csv"]
+
+    cache.write(monthly_entries[2:3])
+    assert sorted(path.name for path in cache.path.glob("*.csv*")) == [
+        "2021-01.csv.gz",
+        "2021-02.csv",
+    ]
+
+    # Older entries are merged into their closed segment, which stays sorted
+    cache.write([monthly_entries[1], monthly_entries[0]])
+    assert list(cache.load()) == monthly_entries[:3]
+    assert cache.needs_compaction() is False
+
+
+def test_segmented_cache_compacts_current_month(tmp_path):
+    cache = SegmentedEntryCache(path=tmp_path / "cache.segments", compress=False)
+    march = build_entry(
+        5, project_b, "2021-03-01T10:00:00+00:00", "2021-03-01T11:00:00+00:00"
+    )
+    cache.write(monthly_entries)
+    cache.write([march, monthly_entries[-1]])
+    assert cache.needs_compaction() is True
+
+    report = cache.compact()
+
+    assert list(cache.load()) == [*monthly_entries[:3], march, monthly_entries[-1]]
+    assert (report.rows_before, report.rows_after) == (6, 5)
+    assert cache.needs_compaction() is False
@@ -0,0 +1,32 @@
+import json
+import subprocess
+import sys
+from typing import List
+
+# The ``google`` namespace package itself is set up on startup by a .pth file
+HEAVY_MODULES = ("aiohttp", "google.auth", "gspread", "requests")
+
+
+def get_imported_modules(*modules: str) -> List[str]:
+    """Return the modules loaded by a fresh interpreter after importing ``modules``"""
+    imports = "; ".join(f"import {module}" for module in modules)
+    script = f"{imports}; import json, sys; print(json.dumps(list(sys.modules)))"
+    result = subprocess.run(
+        [sys.executable, "-c", script],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return json.loads(result.stdout)
+
+
+def test_cli_does_not_import_http_clients_on_startup():
+    imported = get_imported_modules("src.cli", "src.bill")
+
+    heavy = [
+        name
+        for name in imported
+        for heavy_module in HEAVY_MODULES
+        if name == heavy_module or name.startswith(f"{heavy_module}.")
+    ]
+    assert heavy == []
@@ -0,0 +1,57 @@
+import os
+from pathlib import Path
+
+import pytest
+
+from src import config
+
+
+@pytest.fixture
+def config_files(monkeypatch: pytest.MonkeyPatch, tmp_path: Path) -> Path:
+    config_path = tmp_path / "config.jsonc"
+    config_path.write_text(
+        '{"projects": [{"id": 123, "alias": "project", "start": "2021-01-01"}]}'
+    )
+    secrets_path = tmp_path / "secrets.jsonc"
+    secrets_path.write_text(
+        '{"toggle_api_token": "token", "gsheet_url": "https://example.com"}'
+    )
+    monkeypatch.setattr(config, "CONFIG_PATH", config_path)
+    monkeypatch.setattr(config, "SECRETS_PATH", secrets_path)
+    monkeypatch.setattr(config, "CONFIG_SNAPSHOT_PATH", tmp_path / "snapshot.pickle")
+    monkeypatch.setattr(config, "_CACHED_APP_CONFIG", None)
+    return config_path
+
+
+def get_fresh_config() -> config.AppConfig:
+    config._CACHED_APP_CONFIG = None
+    return config.get_config()
+
+
+def test_config_snapshot_skips_parsing_unchanged_files(monkeypatch, config_files):
+    first = get_fresh_config()
+
+    def fail(*args, **kwargs):
+        raise AssertionError("config parsed again")
+
+    monkeypatch.setattr(config, "parse_config", fail)
+    assert get_fresh_config() == first
+    assert config.CONFIG_SNAPSHOT_PATH.stat().st_mode & 0o777 == 0o600
+
+
+def test_config_snapshot_is_invalidated_when_files_change(config_files):
+    assert [p.alias for p in get_fresh_config().projects] == ["project"]
+
+    config_files.write_text(
+        '{"projects": [{"id": 123, "alias": "renamed", "start": "2021-01-01"}]}'
+    )
+    stat = config_files.stat()
+    os.utime(config_files, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+
+    assert [p.alias for p in get_fresh_config().projects] == ["renamed"]
+
+
+def test_unreadable_config_snapshot_is_ignored(config_files):
+    config.CONFIG_SNAPSHOT_PATH.write_bytes(b"not a pickle")
+
+    assert [p.alias for p in get_fresh_config().projects] == ["project"]
@@ -1,6 +1,9 @@
+import fcntl
 import json
 
-from src.filesystem import remove_comments_from_json
+import pytest
+
+from src.filesystem import FileLock, remove_comments_from_json
 
 
 def test_parse_json_with_comments():
@@ -21,3 +24,59 @@ def test_parse_json_with_comments():
         "url": "https://example.com/",
         "foo": 1234,
     }
+
+
+def test_comment_markers_inside_strings_are_kept():
+    json_with_comments = (
+        "{\n"
+        '    "url": "https://example.com//path", // Comment 1\n'
+        '    "quote": "say \\"/* hi */\\"", /* Comment 2 */\n'
+        "    /* Comment 3\n"
+        "       spans lines */\n"
+        '    "slashes": "//"\n'
+        "}\n"
+    )
+
+    valid_json_str = remove_comments_from_json(json_with_comments)
+    content = json.loads(valid_json_str)
+    assert content == {
+        "url": "https://example.com//path",
+        "quote": 'say "/* hi */"',
+        "slashes": "//",
+    }
+    assert valid_json_str.count("\n") == json_with_comments.count("\n")
+
+
+def try_lock(lock: FileLock, operation: int) -> bool:
+    # Every open file is locked on its own, as if it was another process
+    with lock.path.open("a") as f:
+        try:
+            fcntl.flock(f.fileno(), operation | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return False
+        return True
+
+
+def test_file_lock_allows_several_readers_or_a_single_writer(tmp_path):
+    lock = FileLock(tmp_path / "cache.lock")
+
+    with lock.shared():
+        assert try_lock(lock, fcntl.LOCK_SH) is True
+        assert try_lock(lock, fcntl.LOCK_EX) is False
+
+    with lock.exclusive():
+        assert try_lock(lock, fcntl.LOCK_SH) is False
+        # Already held by this thread
+        with lock.shared():
+            pass
+
+    assert try_lock(lock, fcntl.LOCK_EX) is True
+
+
+def test_file_lock_cannot_be_upgraded(tmp_path):
+    lock = FileLock(tmp_path / "cache.lock")
+
+    with lock.shared():
+        with pytest.raises(RuntimeError):
+            with lock.exclusive():
+                pass
@@ -0,0 +1,357 @@
+import datetime
+import threading
+import time
+
+import pytest
+from gspread.exceptions import APIError
+
+from src import gsheet
+from src.gsheet import (
+    SheetsRateLimiter,
+    TokenBucket,
+    WorksheetSnapshot,
+    WorksheetUpdate,
+    WorksheetUploadFailed,
+    check_if_last_row_invoiced,
+    diff_worksheet_update,
+    find_last_date,
+    find_last_date_rows_range,
+    take_snapshot,
+)
+from src.types import EntrySummary, ProjectDailyStats
+from tests.fake_sheets import FakeClient, FakeSpreadsheet, FakeWorksheet
+
+
+@pytest.fixture(autouse=True)
+def rate_limiter(monkeypatch: pytest.MonkeyPatch) -> SheetsRateLimiter:
+    limiter = SheetsRateLimiter(sleep=lambda seconds: None)
+    monkeypatch.setattr(gsheet, "_CACHED_RATE_LIMITER", limiter)
+    return limiter
+
+
+def sheet_row(date, description="", seconds="", billable="", invoice=""):
+    """Return the unformatted values of a worksheet row, up to the invoice column"""
+    return [date, description, seconds, billable, "", "", "", "", invoice]
+
+
+def test_worksheet_update_deletes_and_appends_in_a_single_batch():
+    update = WorksheetUpdate(
+        sheet=FakeWorksheet(),
+        alias="project",
+        rows_to_delete=(10, 12),
+        rows_to_append=[["2021-01-01", "do foo", 120, True]],
+    )
+
+    batches = list(update.to_requests())
+
+    assert batches == [
+        [
+            {
+                "deleteDimension": {
+                    "range": {
+                        "sheetId": 42,
+                        "dimension": "ROWS",
+                        "startIndex": 9,
+                        "endIndex": 12,
+                    }
+                }
+            },
+            {
+                "appendCells": {
+                    "sheetId": 42,
+                    "rows": [
+                        {
+                            "values": [
+                                {"userEnteredValue": {"stringValue": "2021-01-01"}},
+                                {"userEnteredValue": {"stringValue": "do foo"}},
+                                {"userEnteredValue": {"numberValue": 120}},
+                                {"userEnteredValue": {"boolValue": True}},
+                            ]
+                        }
+                    ],
+                    "fields": "userEnteredValue",
+                }
+            },
+        ]
+    ]
+
+
+def test_worksheet_update_splits_large_appends_in_several_batches(monkeypatch):
+    monkeypatch.setattr(gsheet, "MAX_ROWS_PER_BATCH", 2)
+    update = WorksheetUpdate(
+        sheet=FakeWorksheet(),
+        alias="project",
+        rows_to_delete=(10, 12),
+        rows_to_append=[["2021-01-01", "do foo", 120, True]] * 5,
+    )
+
+    batches = list(update.to_requests())
+
+    assert [len(batch) for batch in batches] == [2, 1, 1]
+    assert "deleteDimension" in batches[0][0]
+
+
+def test_snapshot_reads_the_worksheet_once():
+    sheet = FakeWorksheet(
+        rows=[
+            sheet_row("date", invoice="invoice"),
+            sheet_row("2021-01-01", invoice="INV-1"),
+            sheet_row("2021-01-02"),
+            sheet_row("2021-01-02"),
+        ]
+    )
+
+    snapshot = take_snapshot(sheet)
+
+    assert sheet.calls["batch_get"] == 1
+    assert find_last_date(snapshot) == datetime.date(2021, 1, 2)
+    assert find_last_date_rows_range(snapshot) == (3, 4)
+    assert check_if_last_row_invoiced(snapshot) is False
+
+
+def test_snapshot_detects_invoiced_last_day():
+    snapshot = WorksheetSnapshot(
+        row_columns=[["date", "2021-01-01", "2021-01-02"]],
+        invoices_column=["invoice", "INV-1", "INV-2"],
+    )
+
+    assert check_if_last_row_invoiced(snapshot) is True
+
+
+def test_snapshot_of_empty_worksheet():
+    snapshot = take_snapshot(FakeWorksheet())
+
+    assert find_last_date(snapshot) == datetime.date.min
+    assert check_if_last_row_invoiced(snapshot) is False
+
+
+def test_diff_only_updates_changed_cells():
+    snapshot = WorksheetSnapshot(
+        row_columns=[
+            ["date", "2021-01-01", "2021-01-02", "2021-01-02"],
+            ["description", "do foo", "do bar", "do baz"],
+            ["seconds", 60, 120, 180],
+            ["billable", True, True, True],
+        ],
+        invoices_column=["invoice", "INV-1"],
+    )
+    update = WorksheetUpdate(
+        sheet=FakeWorksheet(),
+        alias="project",
+        rows_to_delete=(3, 4),
+        rows_to_append=[
+            ["2021-01-02", "do bar", 120, True],
+            ["2021-01-02", "do baz", 240, True],
+            ["2021-01-03", "do qux", 60, False],
+        ],
+    )
+
+    diffed = diff_worksheet_update(update, snapshot)
+
+    assert diffed.cells_to_update == [(4, 3, 240)]
+    assert diffed.rows_to_delete is None
+    assert diffed.rows_to_append == [["2021-01-03", "do qux", 60, False]]
+
+
+def test_diff_compares_typed_values():
+    snapshot = WorksheetSnapshot(
+        row_columns=[
+            ["date", "2021-01-02", "2021-01-02"],
+            ["description", "do bar", "do baz"],
+            # Numbers might be read back as floats, and 1 must not pass for True
+            ["seconds", 120.0, "60"],
+            ["billable", True, 1],
+        ],
+        invoices_column=[],
+    )
+    update = WorksheetUpdate(
+        sheet=FakeWorksheet(),
+        alias="project",
+        rows_to_delete=(2, 3),
+        rows_to_append=[
+            ["2021-01-02", "do bar", 120, True],
+            ["2021-01-02", "do baz", 60, True],
+        ],
+    )
+
+    diffed = diff_worksheet_update(update, snapshot)
+
+    assert diffed.cells_to_update == [(3, 3, 60), (3, 4, True)]
+
+
+def test_diff_deletes_surplus_rows():
+    snapshot = WorksheetSnapshot(
+        row_columns=[["date", "2021-01-02", "2021-01-02"], ["description", "a", "b"]],
+        invoices_column=[],
+    )
+    update = WorksheetUpdate(
+        sheet=FakeWorksheet(),
+        alias="project",
+        rows_to_delete=(2, 3),
+        rows_to_append=[["2021-01-02", "a", 60, True]],
+    )
+
+    diffed = diff_worksheet_update(update, snapshot)
+
+    assert diffed.cells_to_update == [(2, 3, 60), (2, 4, True)]
+    assert diffed.rows_to_delete == (3, 3)
+    assert diffed.rows_to_append == []
+
+
+@pytest.fixture
+def worksheet() -> FakeWorksheet:
+    sheet = FakeWorksheet(
+        rows=[
+            sheet_row("date", "description", "seconds", "billable", "invoice"),
+            sheet_row("2021-01-01", "do foo", 60, True, "INV-1"),
+            sheet_row("2021-01-02", "do bar", 120, False),
+        ]
+    )
+    return sheet
+
+
+def uploaded_stats():
+    return [
+        ProjectDailyStats(
+            alias="project",
+            date=datetime.date(2021, 1, 1),
+            entries=[EntrySummary(description="do foo", duration=60)],
+        ),
+        ProjectDailyStats(
+            alias="project",
+            date=datetime.date(2021, 1, 2),
+            entries=[EntrySummary(description="do bar (no charge)", duration=120)],
+        ),
+    ]
+
+
+def test_diff_upload_without_changes_makes_no_writes(
+    monkeypatch, app_config, worksheet
+):
+    worksheet.rows[2][1] = "do bar (no charge)"
+    spreadsheet = FakeSpreadsheet([worksheet])
+    monkeypatch.setattr(gsheet, "get_sheet_client", lambda: FakeClient(spreadsheet))
+
+    gsheet.upload_to_gsheet(uploaded_stats(), append_only=False, diff=True)
+
+    assert worksheet.calls["batch_get"] == 1
+    assert spreadsheet.batch_updates == []
+
+
+def test_diff_upload_does_not_touch_invoiced_rows(monkeypatch, app_config, worksheet):
+    worksheet.rows[2][8] = "INV-2"
+    spreadsheet = FakeSpreadsheet([worksheet])
+    monkeypatch.setattr(gsheet, "get_sheet_client", lambda: FakeClient(spreadsheet))
+
+    gsheet.upload_to_gsheet(uploaded_stats(), append_only=False, diff=True)
+
+    assert spreadsheet.batch_updates == []
+
+
+def test_upload_replaces_last_day_rows(monkeypatch, app_config, worksheet):
+    spreadsheet = FakeSpreadsheet([worksheet])
+    monkeypatch.setattr(gsheet, "get_sheet_client", lambda: FakeClient(spreadsheet))
+
+    gsheet.upload_to_gsheet(uploaded_stats(), append_only=False)
+
+    assert worksheet.rows[1:] == [
+        sheet_row("2021-01-01", "do foo", 60, True, "INV-1"),
+        ["2021-01-02", "do bar (no charge)", 120, False],
+    ]
+    assert spreadsheet.total_calls == {
+        "open_by_url": 1,
+        "worksheets": 1,
+        "batch_get": 1,
+        "batch_update": 1,
+    }
+
+
+def test_upload_reports_errors_per_project(monkeypatch, app_config, worksheet):
+    broken = FakeWorksheet(title="broken", id=7)
+    spreadsheet = FakeSpreadsheet([worksheet, broken], failing_sheet_ids=(7,))
+    monkeypatch.setattr(gsheet, "get_sheet_client", lambda: FakeClient(spreadsheet))
+    stats = [
+        ProjectDailyStats(
+            alias=alias,
+            date=datetime.date(2021, 1, 3),
+            entries=[EntrySummary(description="do foo", duration=60)],
+        )
+        for alias in ("project", "broken")
+    ]
+
+    with pytest.raises(WorksheetUploadFailed) as error:
+        gsheet.upload_to_gsheet(stats, append_only=True)
+
+    assert list(error.value.errors) == ["broken"]
+    assert len(spreadsheet.batch_updates) == 1
+    [append] = spreadsheet.batch_updates[0]["requests"]
+    assert append["appendCells"]["sheetId"] == worksheet.id
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+def test_token_bucket_queues_calls_over_quota():
+    clock = FakeClock()
+    bucket = TokenBucket(capacity=2, clock=clock, sleep=clock.sleep)
+
+    waits = [bucket.acquire() for _ in range(4)]
+
+    # 2 tokens per minute: a token every 30 seconds once the burst is spent
+    assert waits == [0, 0, 30, 30]
+    assert clock.now == 60
+
+
+class FakeResponse:
+    status_code = 429
+    headers = {"Retry-After": "3"}
+
+    def json(self):
+        return {"error": {"code": 429, "message": "Quota exceeded"}}
+
+
+def test_rate_limiter_retries_when_quota_is_exceeded():
+    clock = FakeClock()
+    limiter = SheetsRateLimiter(clock=clock, sleep=clock.sleep)
+    responses = [APIError(FakeResponse()), "values"]
+
+    def call():
+        response = responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    assert limiter.read(call) == "values"
+    assert limiter.stats.requests == 2
+    assert limiter.stats.retries == 1
+    assert limiter.stats.seconds_waited >= 3
+
+
+def test_rate_limiter_coalesces_queued_writes(rate_limiter):
+    spreadsheet = FakeSpreadsheet([FakeWorksheet(id=1), FakeWorksheet(id=2)])
+    first = [{"appendCells": {"sheetId": 1, "rows": []}}]
+    second = [{"appendCells": {"sheetId": 2, "rows": []}}]
+
+    # Queue both writes while another write is in progress
+    workers = [
+        threading.Thread(target=rate_limiter.batch_update, args=(spreadsheet, requests))
+        for requests in (first, second)
+    ]
+    with rate_limiter._write_lock:
+        for queued, worker in enumerate(workers, start=1):
+            worker.start()
+            while len(rate_limiter._pending) < queued:
+                time.sleep(0.001)
+    for worker in workers:
+        worker.join()
+
+    assert spreadsheet.batch_updates == [{"requests": first + second}]
+    assert rate_limiter.stats.coalesced_writes == 1
@@ -0,0 +1,38 @@
+import json
+from typing import List
+
+import pytest
+
+from src.json_stream import TruncatedJsonArray, iter_json_array
+
+
+def split_in_chunks(content: bytes, size: int) -> List[bytes]:
+    chunks = []
+    while content:
+        chunks.append(content[:size])
+        content = content[size:]
+    return chunks
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 7, 1000])
+def test_iter_json_array_yields_items_split_across_chunks(chunk_size):
+    items = [
+        {"id": 1, "description": "café [1], {2}"},
+        {"id": 22, "tags": ["a", "b"], "stop": None},
+        123,
+        "text",
+    ]
+    content = json.dumps(items, indent=2).encode()
+
+    decoded = list(iter_json_array(split_in_chunks(content, chunk_size)))
+
+    assert decoded == items
+
+
+def test_iter_json_array_handles_empty_array():
+    assert list(iter_json_array([b" [ ", b"]"])) == []
+
+
+def test_iter_json_array_fails_on_truncated_array():
+    with pytest.raises(TruncatedJsonArray):
+        list(iter_json_array([b'[{"id": 1}, {"id"']))
@@ -0,0 +1,72 @@
+import datetime
+import json
+
+from click.testing import CliRunner
+
+from src import cli
+from src.metrics import Metrics
+from src.toggl import Toggl
+from src.types import TimeRange
+from tests.fake_toggl import FakeTogglServer
+
+
+def test_spans_with_the_same_name_add_up():
+    metrics = Metrics()
+
+    with metrics.span("fetch"):
+        pass
+    first = metrics.spans["fetch"]
+    with metrics.span("fetch"):
+        pass
+
+    assert metrics.spans["fetch"] > first
+
+
+def test_count_items_counts_once_iterated():
+    metrics = Metrics()
+
+    items = metrics.count_items("rows", iter([1, 2, 3]))
+    assert "rows" not in metrics.counters
+
+    assert list(items) == [1, 2, 3]
+    assert metrics.counters == {"rows": 3}
+
+
+def test_toggl_requests_and_bytes_are_counted(app_config, run_metrics):
+    raw_entry = {
+        "id": 1,
+        "pid": 123,
+        "start": "2021-01-10T10:00:00+00:00",
+        "stop": "2021-01-10T11:00:00+00:00",
+        "description": "do foo",
+        "at": "2021-01-10T11:00:00+00:00",
+    }
+    time_range = TimeRange(
+        after=datetime.datetime(2021, 1, 1, tzinfo=datetime.timezone.utc),
+        until=datetime.datetime(2021, 2, 1, tzinfo=datetime.timezone.utc),
+    )
+
+    with FakeTogglServer([raw_entry]) as server:
+        client = Toggl(token="token", api_url=server.url)
+        assert [entry.id for entry in client.get_entries(time_range)] == [1]
+
+    counters = run_metrics.counters
+    assert counters["toggl.requests"] == len(server.requests)
+    assert counters["toggl.bytes_received"] > len(json.dumps(raw_entry))
+    assert counters["cache.rows_written"] == 1
+
+
+def test_metrics_option_writes_a_json_report(monkeypatch, tmp_path, run_metrics):
+    def fake_bill(**kwargs):
+        with run_metrics.span("upload"):
+            run_metrics.count("gsheet.writes")
+
+    monkeypatch.setattr(cli, "bill", fake_bill)
+    report_path = tmp_path / "metrics.json"
+
+    result = CliRunner().invoke(cli.bill_cmd, ["--all", "--metrics", str(report_path)])
+
+    assert result.exit_code == 0, result.output
+    report = json.loads(report_path.read_text())
+    assert list(report["spans"]) == ["upload"]
+    assert report["counters"] == {"gsheet.writes": 1}
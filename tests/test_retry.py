@@ -0,0 +1,16 @@
+from src.config import GSheetClientConfig
+from src.retry import get_backoff, parse_retry_after
+
+
+def test_parse_retry_after():
+    assert parse_retry_after(None) == 0
+    assert parse_retry_after("12") == 12
+    assert parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT") == 0
+    assert parse_retry_after("not a date") == 0
+
+
+def test_backoff_is_capped_but_waits_at_least_retry_after():
+    settings = GSheetClientConfig(backoff_factor=1, max_backoff=4)
+
+    assert all(0 <= get_backoff(settings, 10, None) <= 4 for _ in range(100))
+    assert get_backoff(settings, 0, "30") == 30
@@ -1,15 +1,21 @@
 import datetime
-from typing import List
+from typing import Dict, List, Optional
 
 import pytest
+import requests
 
-from src.toggl import TOGGL_ENTRIES_CACHE, cache_entries, read_cache
-from src.types import Project, TimeRange, TogglTimeEntry
+from src import cache, toggl
+from src.config import TogglClientConfig
+from src.timestamps import to_epoch
+from src.toggl import Toggl, get_time_range_to_recheck, split_time_range_per_month
+from src.types import JsonDict, Project, TimeRange, TogglTimeEntry
+from tests.fake_toggl import FakeTogglServer
 
 
-def generate_sample_data() -> List[TogglTimeEntry]:
-    years = 8
-    entries_per_day = 20
+def generate_sample_data(
+    years: int = 8,
+    entries_per_day: int = 20,
+) -> List[TogglTimeEntry]:
     amount = years * (365 * entries_per_day)
 
     entries = []
@@ -33,16 +39,262 @@ def generate_sample_data() -> List[TogglTimeEntry]:
     return entries
 
 
-@pytest.mark.skip(reason="ony for development purposes")
-def test_cache():
-    entries = generate_sample_data()
+def build_response(
+    status_code: int,
+    content: bytes = b"[]",
+    headers: Optional[Dict[str, str]] = None,
+) -> requests.Response:
+    response = requests.Response()
+    response.status_code = status_code
+    response._content = content
+    response.headers.update(headers or {})
+    return response
 
-    TOGGL_ENTRIES_CACHE.unlink()
-    cache_entries(entries)
 
-    rg = TimeRange(
-        after=datetime.datetime(2021, 1, 13),
-        until=datetime.datetime(2021, 1, 16),
+def test_client_retries_rate_limited_requests(monkeypatch):
+    responses = [
+        build_response(429, headers={"Retry-After": "7"}),
+        build_response(503),
+        build_response(200, b'[{"id": 1}]'),
+    ]
+    sleeps: List[float] = []
+    monkeypatch.setattr(toggl.time, "sleep", sleeps.append)
+
+    client = Toggl(token="token", settings=TogglClientConfig(max_backoff=1))
+    monkeypatch.setattr(client._session, "get", lambda *_, **__: responses.pop(0))
+
+    assert client._get("https://example.com", params={}) == [{"id": 1}]
+    assert client.stats.requests == 3
+    assert client.stats.retries == 2
+    assert sleeps[0] == 7  # Retry-After wins over the backoff
+    assert 0 <= sleeps[1] <= 1
+
+
+def test_client_gives_up_after_max_retries(monkeypatch):
+    monkeypatch.setattr(toggl.time, "sleep", lambda _: None)
+
+    client = Toggl(token="token", settings=TogglClientConfig(max_retries=2))
+    monkeypatch.setattr(client._session, "get", lambda *_, **__: build_response(500))
+
+    with pytest.raises(requests.HTTPError):
+        client._get("https://example.com", params={})
+    assert client.stats.retries == 2
+
+
+def test_client_releases_retried_streamed_responses(monkeypatch):
+    monkeypatch.setattr(toggl.time, "sleep", lambda _: None)
+    retried = build_response(503)
+    responses = [retried, build_response(200)]
+
+    client = Toggl(token="token")
+    monkeypatch.setattr(client._session, "get", lambda *_, **__: responses.pop(0))
+    closed: List[requests.Response] = []
+    monkeypatch.setattr(requests.Response, "close", lambda self: closed.append(self))
+
+    client._request("https://example.com", params={}, stream=True)
+
+    assert closed == [retried]
+
+
+def test_split_time_range_per_month():
+    time_range = TimeRange(
+        after=datetime.datetime(2021, 11, 15, 10),
+        until=datetime.datetime(2022, 1, 3),
+    )
+
+    windows = split_time_range_per_month(time_range)
+
+    assert windows == [
+        TimeRange(datetime.datetime(2021, 11, 15, 10), datetime.datetime(2021, 12, 1)),
+        TimeRange(datetime.datetime(2021, 12, 1), datetime.datetime(2022, 1, 1)),
+        TimeRange(datetime.datetime(2022, 1, 1), datetime.datetime(2022, 1, 3)),
+    ]
+
+
+def test_fetch_time_entries_merges_windows_in_start_order(monkeypatch):
+    monkeypatch.setattr(toggl, "MAX_ENTRIES_PER_REQUEST", 3)
+    raw_entries = [
+        {"id": 1, "start": "2021-01-10T00:00:00"},
+        {"id": 2, "start": "2021-01-20T00:00:00"},
+        {"id": 3, "start": "2021-01-25T00:00:00"},
+        {"id": 4, "start": "2021-02-01T00:00:00"},
+        {"id": 5, "start": "2021-02-10T00:00:00"},
+    ]
+
+    def fake_get(endpoint, params):
+        # Return entries in reverse order and include the boundary entry twice
+        after = params["start_date"]
+        until = params["end_date"]
+        matches = [raw for raw in raw_entries if after <= raw["start"] <= until]
+        return list(reversed(matches))
+
+    client = Toggl(token="token", settings=TogglClientConfig(max_workers=2))
+    monkeypatch.setattr(client, "_get", fake_get)
+
+    time_range = TimeRange(
+        after=datetime.datetime(2021, 1, 1),
+        until=datetime.datetime(2021, 3, 1),
     )
-    for i, entry in enumerate(read_cache(rg)):
-        print(i, entry)
+    fetched = list(client._fetch_time_entries(time_range))
+
+    assert [raw["id"] for raw in fetched] == [1, 2, 3, 4, 5]
+
+
+def test_client_streams_entries_in_start_order(monkeypatch):
+    monkeypatch.setattr(toggl, "MAX_ENTRIES_PER_REQUEST", 2)
+    raw_entries = [
+        {"id": 1, "start": "2021-01-10T00:00:00"},
+        {"id": 2, "start": "2021-01-20T00:00:00"},
+        {"id": 3, "start": "2021-01-25T00:00:00"},
+        {"id": 4, "start": "2021-02-10T00:00:00"},
+    ]
+    time_range = TimeRange(
+        after=datetime.datetime(2021, 1, 1),
+        until=datetime.datetime(2021, 3, 1),
+    )
+
+    with FakeTogglServer(raw_entries) as server:
+        settings = TogglClientConfig(stream=True)
+        client = Toggl(token="token", settings=settings, api_url=server.url)
+        streamed = list(client._stream_time_entries(time_range))
+
+    assert [raw["id"] for raw in streamed] == [1, 2, 3, 4]
+
+
+def build_synced_entry(
+    id: int,
+    start: datetime.datetime,
+    at: datetime.datetime,
+    **kwargs: str,
+) -> JsonDict:
+    return {
+        "id": id,
+        "pid": 123,
+        "start": start.isoformat(),
+        "stop": (start + datetime.timedelta(hours=1)).isoformat(),
+        "description": f"entry {id}",
+        "at": at.isoformat(),
+        **kwargs,
+    }
+
+
+def days_ago(days: int) -> datetime.datetime:
+    now = datetime.datetime.now(tz=datetime.timezone.utc).replace(microsecond=0)
+    return now - datetime.timedelta(days=days)
+
+
+def test_client_syncs_only_entries_changed_since_last_fetch(app_config):
+    time_range = TimeRange(after=days_ago(5))
+    raw_entries = [
+        build_synced_entry(1, start=days_ago(4), at=days_ago(4)),
+        build_synced_entry(2, start=days_ago(3), at=days_ago(3)),
+        build_synced_entry(3, start=days_ago(2), at=days_ago(2)),
+    ]
+
+    with FakeTogglServer(raw_entries) as server:
+        client = Toggl(token="token", api_url=server.url)
+        assert [entry.id for entry in client.get_entries(time_range)] == [1, 2, 3]
+
+        now = days_ago(0).isoformat()
+        server.entries = [
+            build_synced_entry(1, start=days_ago(4), at=days_ago(0), description="ed"),
+            build_synced_entry(2, start=days_ago(3), at=days_ago(3)),
+            build_synced_entry(
+                3, start=days_ago(2), at=days_ago(0), server_deleted_at=now
+            ),
+            build_synced_entry(4, start=days_ago(1), at=days_ago(0)),
+        ]
+        server.requests.clear()
+        entries = list(client.get_entries(time_range))
+
+    assert [entry.id for entry in entries] == [1, 2, 4]
+    assert entries[0].description == "ed"
+    assert [request["path"] for request in server.requests] == ["/api/v8/me"]
+
+
+def test_client_fetches_again_when_last_sync_is_beyond_me_horizon(app_config):
+    time_range = TimeRange(after=days_ago(30))
+    raw_entries = [
+        build_synced_entry(1, start=days_ago(25), at=days_ago(25)),
+        build_synced_entry(2, start=days_ago(20), at=days_ago(20)),
+    ]
+
+    with FakeTogglServer(raw_entries) as server:
+        client = Toggl(token="token", api_url=server.url)
+        assert [entry.id for entry in client.get_entries(time_range)] == [1, 2]
+
+        # As if the last run was 15 days ago: entries created, edited and deleted
+        # since then started too long ago to be returned by the ``me`` endpoint
+        entry_cache = cache.get_syncable_entry_cache()
+        assert entry_cache
+        entry_cache.set_watermark(to_epoch(days_ago(15)))
+        server.entries = [
+            build_synced_entry(
+                1, start=days_ago(25), at=days_ago(12), description="ed"
+            ),
+            build_synced_entry(3, start=days_ago(12), at=days_ago(12)),
+        ]
+        server.requests.clear()
+        entries = list(client.get_entries(time_range))
+
+    assert [entry.id for entry in entries] == [1, 3]
+    assert entries[0].description == "ed"
+    assert "/api/v8/me" not in [request["path"] for request in server.requests]
+
+
+def test_client_fetches_again_entries_older_than_me_horizon(app_config):
+    time_range = TimeRange(after=days_ago(20))
+    raw_entries = [
+        build_synced_entry(1, start=days_ago(15), at=days_ago(15)),
+        build_synced_entry(2, start=days_ago(14), at=days_ago(14)),
+        build_synced_entry(3, start=days_ago(3), at=days_ago(3)),
+    ]
+
+    with FakeTogglServer(raw_entries) as server:
+        client = Toggl(token="token", api_url=server.url)
+        assert [entry.id for entry in client.get_entries(time_range)] == [1, 2, 3]
+
+        # Entries that started too long ago to be returned by the ``me`` endpoint
+        now = days_ago(0).isoformat()
+        server.entries = [
+            build_synced_entry(1, start=days_ago(15), at=days_ago(0), description="ed"),
+            build_synced_entry(
+                2, start=days_ago(14), at=days_ago(0), server_deleted_at=now
+            ),
+            build_synced_entry(3, start=days_ago(3), at=days_ago(3)),
+        ]
+        entries = list(client.get_entries(time_range))
+
+    assert [entry.id for entry in entries] == [1, 3]
+    assert entries[0].description == "ed"
+
+
+def test_get_time_range_to_recheck_starts_on_previous_month():
+    now = datetime.datetime(2021, 3, 20, 12, tzinfo=datetime.timezone.utc)
+
+    time_range = get_time_range_to_recheck(
+        TimeRange(after=datetime.datetime(2020, 1, 1, tzinfo=datetime.timezone.utc)),
+        now=now,
+    )
+
+    assert time_range == TimeRange(
+        after=datetime.datetime(2021, 2, 1, tzinfo=datetime.timezone.utc),
+        until=datetime.datetime(2021, 3, 11, 12, tzinfo=datetime.timezone.utc),
+    )
+    recent = TimeRange(after=datetime.datetime(2021, 3, 15, tzinfo=now.tzinfo))
+    assert get_time_range_to_recheck(recent, now=now) is None
+
+
+def test_client_fetches_time_range_older_than_cached_entries(app_config):
+    raw_entries = [
+        build_synced_entry(1, start=days_ago(20), at=days_ago(20)),
+        build_synced_entry(2, start=days_ago(3), at=days_ago(3)),
+    ]
+
+    with FakeTogglServer(raw_entries) as server:
+        client = Toggl(token="token", api_url=server.url)
+        recent = TimeRange(after=days_ago(5))
+        assert [entry.id for entry in client.get_entries(recent)] == [2]
+
+        older = TimeRange(after=days_ago(30))
+        assert [entry.id for entry in client.get_entries(older)] == [1, 2]